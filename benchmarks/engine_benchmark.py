@@ -0,0 +1,163 @@
+"""
+Compare the thread-per-task engine with the asyncio engine against a local Discord stand-in.
+
+Both engines poll the stub server of benchmarks/load_benchmark.py, which generates
+`--message-rate` messages per second in every channel and delays each response by
+`--latency` seconds:
+    - threaded: the loop of the original bot, one thread per task polling the latest
+      messages with blocking requests (one connection per request) and sleeping `delay`.
+    - asyncio: the bot itself, main.run_monitors running monitor_discord_api coroutines
+      over the pooled HTTP client and the delivery pipeline.
+
+For every task count and engine, the benchmark reports the time until every channel
+was polled once, peak RSS, the number of polls, the messages delivered and the p50/p99
+mirror lag (webhook receipt time - message creation time). Every run happens in a fresh
+process so RSS numbers don't leak between runs. The global rate limit and the request
+budget of the bot are lifted by default, since the original loop had neither.
+
+Usage:
+    python benchmarks/engine_benchmark.py --tasks 100 500 2000 --duration 10
+"""
+
+################################ IMPORTS ################################
+import os                                                              ##
+import sys                                                             ##
+import json                                                            ##
+import time                                                            ##
+import shlex                                                           ##
+import asyncio                                                         ##
+import argparse                                                        ##
+import resource                                                        ##
+import tempfile                                                        ##
+import threading                                                       ##
+import subprocess                                                      ##
+import urllib.error                                                    ##
+import urllib.request                                                  ##
+#########################################################################
+
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import load_benchmark
+
+
+def run_threaded(base_url: str, tasks: int, delay: float, duration: float):
+    mirrored = set()
+    mirrored_mutex = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def send(method: str, url: str, payload: dict = None, headers: dict = None):
+        data = None if payload is None else json.dumps(payload).encode()
+        request = urllib.request.Request(url, data=data, method=method, headers={'Content-Type': 'application/json', **(headers or {})})
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                body = response.read()
+                return json.loads(body) if body else None
+        except (urllib.error.URLError, OSError):
+            return None
+
+    def monitor(task: int):
+        channel_id = str(1100000000000000000 + task)
+        webhook_url = f"{base_url}/api/webhooks/{task}/token{task}"
+        while time.monotonic() < stop_at:
+            messages = send('GET', f"{base_url}/api/v9/channels/{channel_id}/messages?limit=5", headers={'authorization': f"token{task}"})
+            for message in messages or ():
+                with mirrored_mutex:
+                    if message['id'] in mirrored:
+                        continue
+                    mirrored.add(message['id'])
+                author = message['author']
+                send('POST', webhook_url, {
+                    'username': author['username'],
+                    'avatar_url': f"https://cdn.discordapp.com/avatars/{author['id']}/{author['avatar']}.png",
+                    'content': message['content'],
+                    'embeds': message['embeds'][:1]
+                })
+            time.sleep(delay)
+
+    threads = [threading.Thread(target=monitor, args=(task,), daemon=True) for task in range(tasks)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_asyncio(base_url: str, tasks: int, delay: float, duration: float, global_rate: float, bot_options: list):
+    with tempfile.TemporaryDirectory() as directory:
+        # ids.txt, the outbox and the other state files of the bot stay out of the repository
+        previous_directory = os.getcwd()
+        os.chdir(directory)
+        try:
+            asyncio.run(load_benchmark.run_bot(base_url, tasks, delay, duration, global_rate, bot_options, fixed_delay=True))
+        finally:
+            os.chdir(previous_directory)
+
+
+def run_single(engine: str, tasks: int, args: argparse.Namespace):
+    stub, base_url = load_benchmark.start_stub({
+        'message_rate': args.message_rate,
+        'embed_ratio': args.embed_ratio,
+        'latency': args.latency,
+        'rate_limit_ratio': 0.0,
+        'retry_after': 0.0
+    })
+    try:
+        started = time.time()
+        if engine == 'threaded':
+            run_threaded(base_url, tasks, args.delay, args.duration)
+        else:
+            run_asyncio(base_url, tasks, args.delay, args.duration, args.global_rate, shlex.split(args.bot_options))
+        stub_stats = load_benchmark.fetch_stub_stats(base_url)
+    finally:
+        stub.terminate()
+        stub.join()
+
+    first_polls = stub_stats['first_polls']
+    lags = stub_stats['lags']
+    result = {
+        'engine': engine,
+        'tasks': tasks,
+        # Until every channel was polled once ('-' if some never were)
+        'startup_ms': round((max(first_polls) - started) * 1000, 1) if len(first_polls) == tasks else '-',
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'polls': stub_stats['requests']['messages'],
+        'delivered': stub_stats['delivered'],
+        'lag_p50_ms': round(load_benchmark.percentile(lags, 50) * 1000, 1),
+        'lag_p99_ms': round(load_benchmark.percentile(lags, 99) * 1000, 1),
+    }
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tasks', type=int, nargs='+', default=[100, 500, 2000])
+    parser.add_argument('--delay', type=float, default=1.0)
+    parser.add_argument('--latency', type=float, default=0.1, help="Seconds added to every stub response.")
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--message-rate', type=float, default=0.2, help="Messages per second generated in each channel.")
+    parser.add_argument('--embed-ratio', type=float, default=0.3, help="Share of messages that are rich embeds posted by a bot.")
+    parser.add_argument('--global-rate', type=float, default=100000, help="Global requests per second of the asyncio engine, 0 keeps its default.")
+    parser.add_argument('--bot-options', default='--request-budget 0', help="Extra command line options of the asyncio engine.")
+    parser.add_argument('--engine', choices=['threaded', 'asyncio'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.engine:
+        run_single(args.engine, args.tasks[0], args)
+        return
+
+    print(f"{'engine':<10}{'tasks':>8}{'startup ms':>12}{'peak RSS MB':>13}{'polls':>9}{'delivered':>11}{'p50 lag ms':>12}{'p99 lag ms':>12}")
+    for tasks in args.tasks:
+        for engine in ('threaded', 'asyncio'):
+            output = subprocess.run(
+                [sys.executable, __file__, '--engine', engine, '--tasks', str(tasks), '--delay', str(args.delay),
+                 '--latency', str(args.latency), '--duration', str(args.duration), '--message-rate', str(args.message_rate),
+                 '--embed-ratio', str(args.embed_ratio), '--global-rate', str(args.global_rate), f"--bot-options={args.bot_options}"],
+                capture_output=True, text=True, check=True
+            ).stdout
+            r = json.loads(output.strip().splitlines()[-1])
+            print(f"{r['engine']:<10}{r['tasks']:>8}{r['startup_ms']:>12}{r['peak_rss_mb']:>13}{r['polls']:>9}"
+                  f"{r['delivered']:>11}{r['lag_p50_ms']:>12}{r['lag_p99_ms']:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,353 @@
+"""
+Load test the mirroring hot path against a local stand-in of the Discord API.
+
+A stub server runs in its own process and serves /channels/{id}/messages for any
+channel ID, generating `--message-rate` messages per second and per channel (a
+`--embed-ratio` share of them are rich embeds posted by a bot). Every response is
+delayed by `--latency` seconds and a `--rate-limit-ratio` share of the requests is
+answered with a 429. Webhook POSTs are accepted and timestamped, which gives the
+mirror lag of every delivered message (webhook receipt time - message creation time).
+
+The bot runs in this process with `--tasks` synthetic tasks (one channel and one
+webhook each) for `--duration` seconds from a temporary working directory, then
+the benchmark reports throughput, p50/p99 mirror lag, request counts and peak RSS.
+Bot options (workers, batching, request budget...) are passed with --bot-options.
+
+Usage:
+    python benchmarks/load_benchmark.py --tasks 200 --message-rate 0.5 --duration 30
+    python benchmarks/load_benchmark.py --tasks 50 --rate-limit-ratio 0.05 --bot-options="--workers 8 --batch-window 0.5"
+"""
+
+################################ IMPORTS ################################
+import os                                                              ##
+import re                                                              ##
+import sys                                                             ##
+import json                                                            ##
+import time                                                            ##
+import shlex                                                           ##
+import random                                                          ##
+import asyncio                                                         ##
+import argparse                                                        ##
+import resource                                                        ##
+import tempfile                                                        ##
+import multiprocessing                                                 ##
+import urllib.parse                                                    ##
+import urllib.request                                                  ##
+#########################################################################
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+DISCORD_EPOCH_MS = 1420070400000
+# Messages kept per channel by the stub, older ones are no longer served
+CHANNEL_HISTORY = 1000
+MESSAGE_MARKER = re.compile(rb'msg-(\d+)')
+WEBHOOK_PATH = re.compile(r'/api/webhooks/(\d+)/[^/]+(/messages/\d+)?$')
+CHANNEL_PATH = re.compile(r'/api/v9/channels/(\d+)/messages$')
+REASONS = {200: 'OK', 204: 'No Content', 404: 'Not Found', 429: 'Too Many Requests'}
+
+
+def percentile(values: list, percent: float):
+    """
+    Return the given percentile of a list of numbers (0 if the list is empty).
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+class StubDiscord:
+    """
+    Serve the Discord endpoints used by the bot from generated channels.
+    """
+
+    def __init__(self, message_rate: float, embed_ratio: float, latency: float, rate_limit_ratio: float, retry_after: float):
+        self.message_rate = message_rate
+        self.embed_ratio = embed_ratio
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.started = time.time()
+
+        # Channel ID -> (message IDs, messages), oldest first
+        self.channels = {}
+        self.generated = 0
+        self.requests = {'messages': 0, 'webhooks': 0, 'rate_limited': 0, 'other': 0}
+        self.lags = []
+        self.delivered = set()
+        self.duplicates = 0
+        # Channel ID -> time of its first poll
+        self.first_polls = {}
+
+    def _build_message(self, channel_id: str, index: int, created: float):
+        # Like real snowflakes, IDs are unique across channels (the low bits hold a stub-wide sequence)
+        message_id = str(((int(created * 1000) - DISCORD_EPOCH_MS) << 22) | (self.generated & 0x3FFFFF))
+        author = {'id': '1000' + channel_id[-6:], 'username': f"user{index % 50}", 'avatar': 'stub'}
+        message = {'id': message_id, 'channel_id': channel_id, 'author': author, 'content': f"Load test msg-{message_id}", 'embeds': [], 'attachments': []}
+        if random.random() < self.embed_ratio:
+            author['bot'] = True
+            message['content'] = ''
+            message['embeds'] = [{
+                'type': 'rich',
+                'title': f"Embed {index}",
+                'description': f"msg-{message_id}",
+                'color': 0x7b253c,
+                'fields': [{'name': f"Field {field}", 'value': 'x' * 40, 'inline': True} for field in range(4)],
+                'thumbnail': {'url': 'https://cdn.discordapp.com/embed/avatars/0.png'}
+            }]
+        return message
+
+    def _channel(self, channel_id: str):
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = self.channels[channel_id] = ([], [], [0])
+        ids, messages, count = channel
+
+        # Messages are generated lazily at the configured rate since the stub started
+        due = int((time.time() - self.started) * self.message_rate)
+        for index in range(count[0], due):
+            # Message N is served from (N + 1) / message_rate seconds on, it is created at that time
+            message = self._build_message(channel_id, index, self.started + (index + 1) / self.message_rate)
+            ids.append(int(message['id']))
+            messages.append(message)
+            self.generated += 1
+        count[0] = max(count[0], due)
+
+        if len(ids) > 2 * CHANNEL_HISTORY:
+            del ids[:-CHANNEL_HISTORY], messages[:-CHANNEL_HISTORY]
+        return ids, messages
+
+    def _get_messages(self, channel_id: str, query: dict):
+        self.first_polls.setdefault(channel_id, time.time())
+        ids, messages = self._channel(channel_id)
+        limit = min(int(query.get('limit', ['50'])[0]), 100)
+        if 'after' in query:
+            after = int(query['after'][0])
+            start = next((position for position in range(len(ids) - 1, -1, -1) if ids[position] <= after), -1) + 1
+            selected = messages[start:start + limit]
+        else:
+            selected = messages[-limit:]
+        # Discord returns the newest messages first
+        return list(reversed(selected))
+
+    def _record_delivery(self, webhook_id: str, body: bytes):
+        now = time.time()
+        for match in MESSAGE_MARKER.finditer(body):
+            message_id = int(match.group(1))
+            key = (webhook_id, message_id)
+            if key in self.delivered:
+                self.duplicates += 1
+                continue
+            self.delivered.add(key)
+            self.lags.append(now - ((message_id >> 22) + DISCORD_EPOCH_MS) / 1000)
+
+    def stats(self):
+        return {
+            'generated': self.generated,
+            'requests': self.requests,
+            'delivered': len(self.delivered),
+            'duplicates': self.duplicates,
+            'lags': self.lags,
+            'first_polls': list(self.first_polls.values())
+        }
+
+    async def dispatch(self, method: str, target: str, body: bytes):
+        url = urllib.parse.urlsplit(target)
+        if url.path == '/stats':
+            return 200, {}, self.stats()
+
+        channel = CHANNEL_PATH.match(url.path)
+        webhook = WEBHOOK_PATH.match(url.path)
+        kind = 'messages' if channel else 'webhooks' if webhook else 'other'
+        self.requests[kind] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if kind != 'other' and random.random() < self.rate_limit_ratio:
+            self.requests['rate_limited'] += 1
+            headers = {'Retry-After': str(self.retry_after), 'X-RateLimit-Scope': 'user'}
+            return 429, headers, {'message': 'You are being rate limited.', 'retry_after': self.retry_after, 'global': False}
+
+        if channel and method == 'GET':
+            return 200, {}, self._get_messages(channel.group(1), urllib.parse.parse_qs(url.query))
+        if webhook:
+            if method == 'GET':
+                # Webhook verification
+                return 200, {}, {'id': webhook.group(1), 'token': 'stub'}
+            if method == 'POST':
+                self._record_delivery(webhook.group(1), body)
+            if method in ('POST', 'PATCH') and 'wait=true' in url.query:
+                return 200, {}, {'id': str(((int(time.time() * 1000) - DISCORD_EPOCH_MS) << 22) | random.getrandbits(22))}
+            return 204, {}, None
+        return 404, {}, {'message': 'Unknown route'}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # Connections are kept alive like Discord's, so the bot's pools are exercised
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode().split(' ', 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    name, _, value = line.decode().partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                status, response_headers, payload = await self.dispatch(method, target, body)
+                content = b'' if payload is None else json.dumps(payload).encode()
+                head = f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Length: {len(content)}\r\n"
+                if payload is not None:
+                    head += "Content-Type: application/json\r\n"
+                head += ''.join(f"{name}: {value}\r\n" for name, value in response_headers.items())
+                writer.write(head.encode() + b'\r\n' + content)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def run_stub(config: dict, ready):
+    """
+    Entry point of the stub server process, the bound port is sent through 'ready'.
+    """
+    async def serve():
+        stub = StubDiscord(**config)
+        server = await asyncio.start_server(stub.handle, '127.0.0.1', 0, backlog=1024)
+        ready.put(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+def start_stub(config: dict):
+    """
+    Start the stub server in its own process and return the process and its base URL.
+    """
+    context = multiprocessing.get_context('spawn')
+    ready = context.Queue()
+    stub = context.Process(target=run_stub, args=(config, ready), daemon=True)
+    stub.start()
+    return stub, f"http://127.0.0.1:{ready.get(timeout=30)}"
+
+
+def fetch_stub_stats(base_url: str):
+    with urllib.request.urlopen(f"{base_url}/stats") as response:
+        return json.loads(response.read())
+
+
+async def run_bot(base_url: str, tasks: int, delay: float, duration: float, global_rate: float, bot_options: list, fixed_delay: bool = False):
+    import main as bot
+    from logger import set_log_level
+    from utils import discord_utils,http_utils
+    from utils.metrics_utils import metrics
+    from utils.ratelimit_utils import rate_limit_scheduler
+
+    options = bot.parse_options(['--log-level', 'ERROR', '--report-interval', '3600', '--api-url', f"{base_url}/api/v9", *bot_options])
+    set_log_level(options.log_level)
+    http_utils.configure_http_pools(pool_size = options.pool_size, http2 = not options.no_http2)
+    discord_utils.DISCORD_API_URL = options.api_url
+    if global_rate:
+        rate_limit_scheduler.global_rate = global_rate
+
+    synthetic_tasks = [
+        {
+            'account_token_id': f"token{task}",
+            'channel_id': str(1100000000000000000 + task),
+            'webhook_url': f"{base_url}/api/webhooks/{task}/token{task}",
+            'incognito_mode': task % 2 == 0,
+            'delay': delay,
+            # Pins the adaptive polling interval to the delay
+            'min_delay': delay if fixed_delay else None,
+            'max_delay': delay if fixed_delay else None
+        }
+        for task in range(tasks)
+    ]
+
+    monitors = asyncio.create_task(bot.run_monitors(tasks_to_run = synthetic_tasks, options = options))
+    await asyncio.sleep(duration)
+    monitors.cancel()
+    try:
+        await monitors
+    except asyncio.CancelledError:
+        pass
+
+    return {
+        'polled': metrics.total('mirror_messages_polled_total'),
+        'http_retries': metrics.total('http_retries_total'),
+        'delivery_retries': metrics.total('mirror_delivery_retries_total')
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tasks', type=int, default=100)
+    parser.add_argument('--delay', type=float, default=1.0)
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--message-rate', type=float, default=0.5, help="Messages per second generated in each channel.")
+    parser.add_argument('--embed-ratio', type=float, default=0.3, help="Share of messages that are rich embeds posted by a bot.")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds added to every stub response.")
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help="Share of requests answered with a 429.")
+    parser.add_argument('--retry-after', type=float, default=0.5, help="Retry-After of the injected 429s, in seconds.")
+    parser.add_argument('--global-rate', type=float, default=0, help="Override the bot's global requests per second, 0 keeps its default.")
+    parser.add_argument('--bot-options', default='', help="Extra command line options of the bot, e.g. \"--workers 8\".")
+    parser.add_argument('--json', action='store_true', help="Print the results as a single JSON line.")
+    args = parser.parse_args()
+
+    stub, base_url = start_stub({
+        'message_rate': args.message_rate,
+        'embed_ratio': args.embed_ratio,
+        'latency': args.latency,
+        'rate_limit_ratio': args.rate_limit_ratio,
+        'retry_after': args.retry_after
+    })
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            # ids.txt, the outbox and the other state files of the bot stay out of the repository
+            previous_directory = os.getcwd()
+            os.chdir(directory)
+            try:
+                bot_stats = asyncio.run(run_bot(base_url, args.tasks, args.delay, args.duration, args.global_rate, shlex.split(args.bot_options)))
+            finally:
+                os.chdir(previous_directory)
+
+        stub_stats = fetch_stub_stats(base_url)
+    finally:
+        stub.terminate()
+        stub.join()
+
+    lags = stub_stats['lags']
+    result = {
+        'tasks': args.tasks,
+        'duration_s': args.duration,
+        'generated': stub_stats['generated'],
+        'polled': bot_stats['polled'],
+        'delivered': stub_stats['delivered'],
+        'duplicates': stub_stats['duplicates'],
+        'throughput_msg_s': round(stub_stats['delivered'] / args.duration, 2),
+        'lag_p50_ms': round(percentile(lags, 50) * 1000, 1),
+        'lag_p99_ms': round(percentile(lags, 99) * 1000, 1),
+        'message_requests': stub_stats['requests']['messages'],
+        'webhook_requests': stub_stats['requests']['webhooks'],
+        'rate_limited': stub_stats['requests']['rate_limited'],
+        'http_retries': bot_stats['http_retries'],
+        'delivery_retries': bot_stats['delivery_retries'],
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+    if args.json:
+        print(json.dumps(result))
+        return
+    for key, value in result.items():
+        print(f"{key:<20}{value:>12}")
+
+
+if __name__ == '__main__':
+    main()
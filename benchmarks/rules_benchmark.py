@@ -0,0 +1,149 @@
+"""
+Measure the cost of evaluating a task's rule set on every mirrored message.
+
+A rule set with `--authors` excluded authors, `--patterns` include and exclude content
+patterns, mention rewriting and a link rewrite is applied to `--messages` synthetic
+messages (a mix of plain messages, mentions, links and rich embeds). The compiled
+RuleSet of utils/rule_utils.py is compared with a naive evaluator interpreting the
+rules.json definition for each message (list lookups and one re.search per pattern),
+for filters only and for filters plus rewrites.
+
+Usage:
+    python benchmarks/rules_benchmark.py --messages 20000 --authors 200 --patterns 20
+"""
+
+################################ IMPORTS ################################
+import os                                                              ##
+import re                                                              ##
+import sys                                                             ##
+import time                                                            ##
+import random                                                          ##
+import argparse                                                        ##
+#########################################################################
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from utils import rule_utils
+
+
+def build_definition(authors: int, patterns: int, rewrite: bool):
+    definition = {
+        'exclude_authors': [f"spammer{index}" for index in range(authors)],
+        'include_content': [rf"\bcoin{index}\b" for index in range(patterns)] + [r'signal', r'alert'],
+        'exclude_content': [rf"giveaway{index}" for index in range(patterns)],
+        'ignore_case': True,
+    }
+    if rewrite:
+        definition['mentions'] = 'plain'
+        definition['rewrite'] = [{'pattern': r'https?://discord\.gg/\S+', 'replace': '[invite removed]'}]
+    return definition
+
+
+def build_messages(count: int, authors: int, patterns: int):
+    messages = []
+    for index in range(count):
+        kind = index % 4
+        author = f"spammer{random.randrange(authors)}" if random.random() < 0.1 else f"user{index % 100}"
+        message = {
+            'id': str(1100000000000000000 + index),
+            'author': {'id': str(1000 + index % 100), 'username': author},
+            'content': f"Signal for coin{random.randrange(patterns * 2)} at {index}",
+            'embeds': [],
+            'mentions': []
+        }
+        if kind == 1:
+            message['content'] += ' <@1234> join https://discord.gg/abcdef @everyone'
+            message['mentions'] = [{'id': '1234', 'username': 'trader'}]
+        elif kind == 2:
+            message['content'] += f" giveaway{random.randrange(patterns * 4)}"
+        elif kind == 3:
+            message['content'] = ''
+            message['embeds'] = [{
+                'type': 'rich',
+                'title': 'Alert',
+                'description': f"coin{index % patterns} breakout, see https://discord.gg/xyz",
+                'fields': [{'name': 'Entry', 'value': str(index)}, {'name': 'Target', 'value': str(index * 2)}]
+            }]
+        messages.append(message)
+    return messages
+
+
+def naive_apply(definition: dict, message: dict):
+    """
+    Evaluate a rule set definition as it is, without any precompilation.
+    """
+    author = message.get('author') or {}
+    if author.get('username') in definition.get('exclude_authors', []) or str(author.get('id')) in definition.get('exclude_authors', []):
+        return None
+
+    flags = re.IGNORECASE if definition.get('ignore_case') else 0
+    text = '\n'.join([message.get('content') or ''] + [
+        part for embed in message.get('embeds') or () for part in (embed.get('title') or '', embed.get('description') or '')
+    ])
+    if definition.get('include_content') and not any(re.search(pattern, text, flags) for pattern in definition['include_content']):
+        return None
+    if any(re.search(pattern, text, flags) for pattern in definition.get('exclude_content', [])):
+        return None
+
+    if definition.get('mentions', 'keep') == 'keep' and not definition.get('rewrite'):
+        return message
+
+    usernames = {user['id']: user['username'] for user in message.get('mentions') or ()}
+
+    def rewrite(value: str):
+        if not value:
+            return value
+        value = re.sub(r'<@!?(\d+)>', lambda match: '@' + usernames.get(match.group(1), 'unknown-user'), value)
+        value = re.sub(r'<@&\d+>', '@role', value)
+        value = re.sub(r'<#\d+>', '#channel', value)
+        value = re.sub(r'@(everyone|here)', '@\u200b\\1', value)
+        for item in definition.get('rewrite', []):
+            value = re.sub(item['pattern'], item['replace'], value, flags=flags)
+        return value
+
+    rewritten = dict(message, content=rewrite(message.get('content')))
+    rewritten['embeds'] = [
+        dict(embed, title=rewrite(embed.get('title')), description=rewrite(embed.get('description')),
+             fields=[dict(field, name=rewrite(field['name']), value=rewrite(field['value'])) for field in embed.get('fields', [])])
+        for embed in message.get('embeds') or ()
+    ]
+    return rewritten
+
+
+def measure(apply, messages: list, rounds: int):
+    best = float('inf')
+    kept = 0
+    for _ in range(rounds):
+        started = time.perf_counter()
+        kept = sum(1 for message in messages if apply(message) is not None)
+        best = min(best, time.perf_counter() - started)
+    return best / len(messages), kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--authors', type=int, default=200)
+    parser.add_argument('--patterns', type=int, default=20)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(0)
+    messages = build_messages(args.messages, args.authors, args.patterns)
+
+    print(f"{'rules':<20}{'evaluator':<12}{'ns/message':>12}{'kept':>9}")
+    for label, rewrite in (('filters', False), ('filters + rewrites', True)):
+        definition = build_definition(args.authors, args.patterns, rewrite)
+        rule_set = rule_utils.RuleSet('benchmark', definition)
+        for evaluator, apply in (
+            ('naive', lambda message: naive_apply(definition, message)),
+            ('compiled', rule_set.apply),
+        ):
+            seconds, kept = measure(apply, messages, args.rounds)
+            print(f"{label:<20}{evaluator:<12}{seconds * 1e9:>12.0f}{kept:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Compare the start-up cost of loading tasks.csv with pandas and with the csv module.
+
+A temporary task file with `--rows` rows is generated, then each loader runs in a
+fresh interpreter which imports it, reads the file into a list of dictionaries and
+reports the wall time and peak RSS. The pandas loader is skipped if pandas is not
+installed.
+
+Usage:
+    python benchmarks/startup_benchmark.py --rows 1000 --runs 5
+"""
+
+################################ IMPORTS ################################
+import os                                                              ##
+import sys                                                             ##
+import csv                                                             ##
+import json                                                            ##
+import argparse                                                        ##
+import tempfile                                                        ##
+import subprocess                                                      ##
+#########################################################################
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOADERS = {
+    'pandas': (
+        "import pandas as pd\n"
+        "tasks = pd.read_csv(CSV_FILE).to_dict('records')\n"
+    ),
+    'csv': (
+        "from utils import file_utils\n"
+        "tasks = list(file_utils.read_task_rows(CSV_FILE))\n"
+    ),
+}
+
+TEMPLATE = (
+    "import time, json, resource, sys\n"
+    "started = time.perf_counter()\n"
+    "sys.path.insert(0, {repo_dir!r})\n"
+    "CSV_FILE = {csv_file!r}\n"
+    "{loader}"
+    "elapsed = time.perf_counter() - started\n"
+    "print(json.dumps({{'rows': len(tasks), 'seconds': elapsed,"
+    " 'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))\n"
+)
+
+
+def write_tasks(csv_file: str, rows: int):
+    with open(csv_file, mode="w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["account_token_id", "channel_id", "webhook_url", "incognito_mode", "delay"])
+        for row in range(rows):
+            writer.writerow([
+                f"token{row}",
+                1100000000000000000 + row,
+                f"https://discord.com/api/webhooks/{row}/token{row}",
+                row % 2 == 0,
+                5
+            ])
+
+
+def run_loader(name: str, csv_file: str):
+    code = TEMPLATE.format(repo_dir=REPO_DIR, csv_file=csv_file, loader=LOADERS[name])
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_file = os.path.join(directory, 'tasks.csv')
+        write_tasks(csv_file, args.rows)
+
+        print(f"{'loader':<8}{'rows':>8}{'best ms':>10}{'peak RSS MB':>13}")
+        for name in LOADERS:
+            results = [run_loader(name, csv_file) for _ in range(args.runs)]
+            if None in results:
+                print(f"{name:<8}{'skipped (import failed)':>31}")
+                continue
+            best = min(result['seconds'] for result in results)
+            rss = min(result['peak_rss_mb'] for result in results)
+            print(f"{name:<8}{results[0]['rows']:>8}{best * 1000:>10.1f}{rss:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,53 +1,137 @@
 ################################ IMPORTS ################################
+import sys                                                             ##
 import time                                                            ##
-import uuid                                                            ##
+import queue                                                           ##
+import atexit                                                          ##
 import logging                                                         ##
+import itertools                                                       ##
 import threading                                                       ##
-from colorama import Fore, Style,init                                  ##                                                                            ##
+from colorama import Fore, Style,init                                  ##
 #########################################################################
 
 
 # Only logs Errors into the file
 logging.basicConfig(filename='console.log', level=logging.ERROR)
-logging_mutex = threading.Lock()
 init(autoreset=True)
 
+colors = {
+    'SUCCESS': Fore.GREEN,
+    'WARNING': Fore.YELLOW,
+    'ERROR': Fore.RED,
+    'INFO': Fore.WHITE
+}
+# Messages below the current level are dropped before any formatting happens
+levels = {'INFO': 10, 'SUCCESS': 20, 'WARNING': 30, 'ERROR': 40}
+log_level = levels['INFO']
+
+# Cheap, ordered message IDs (itertools.count is atomic under the GIL)
+log_ids = itertools.count(1)
+log_queue = queue.SimpleQueue()
+_writer_thread = None
+_writer_mutex = threading.Lock()
+
+
+def set_log_level(msg_type: str):
+    """
+    Set the lowest message type that is printed.
+
+    Args:
+        msg_type (str): One of INFO, SUCCESS, WARNING or ERROR.
+    """
+    global log_level
+    log_level = levels[msg_type]
+
 
 def console_output(text: str, msg_type: str = 'INFO', color: str = None, file_path: str = None):
     """
     Outputs a console message with an optional message type, color, and file path.
 
+    The message is only queued here, a background thread formats and writes it,
+    so callers never wait on the console or the file.
+
     Args:
         text (str): The message to display.
         msg_type (str, optional): The type of the message (e.g., INFO, WARNING, ERROR). Defaults to 'INFO'.
         color (str, optional): The color of the message (e.g., Fore.GREEN, Fore.RED). Defaults to None.
         file_path (str, optional): The path to a file to write the message to. Defaults to None.
     """
-    colors = {
-        'SUCCESS': Fore.GREEN,
-        'WARNING': Fore.YELLOW,
-        'ERROR': Fore.RED,
-        'INFO': Fore.WHITE
-    }
-
-    if color:
-        text_color = color
-    elif msg_type in colors:
-        text_color = colors[msg_type]
-    else:
-        text_color = Fore.WHITE
+    if levels.get(msg_type, log_level) < log_level:
+        return
+
+    if _writer_thread is None:
+        _start_writer()
+    log_queue.put((time.time(), next(log_ids), text, msg_type, color, file_path))
+
+
+def _format(timestamp: float, log_id: int, text: str, msg_type: str, timestamps: dict):
+    second = int(timestamp)
+    if second not in timestamps:
+        timestamps.clear()
+        timestamps[second] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
 
     template = f"{msg_type}: " if msg_type else ""
-    text = f"{template}{text}"
+    return f"[{timestamps[second]}] (ID : {log_id}) {template}{text}"
+
+
+def _write_batch(batch: list, timestamps: dict):
+    console_lines = []
+    file_lines = {}
 
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-    log_uuid = uuid.uuid4()
-    formatted_text = f"[{timestamp}] (UUID : {log_uuid}) {text}"
-    
+    for timestamp, log_id, text, msg_type, color, file_path in batch:
+        formatted_text = _format(timestamp, log_id, text, msg_type, timestamps)
+        text_color = color or colors.get(msg_type, Fore.WHITE)
 
-    with logging_mutex:
-        logging.debug(formatted_text)
+        console_lines.append(f"{text_color}{formatted_text}{Style.RESET_ALL}\n")
         if file_path:
-            with open(file_path, 'a') as f:
-                f.write(f"{formatted_text}\n")
-        print(f"{text_color}{formatted_text}{Style.RESET_ALL}")
+            file_lines.setdefault(file_path, []).append(f"{formatted_text}\n")
+        if msg_type == 'ERROR':
+            logging.error(formatted_text)
+
+    for file_path, lines in file_lines.items():
+        with open(file_path, 'a') as f:
+            f.writelines(lines)
+
+    sys.stdout.write(''.join(console_lines))
+    sys.stdout.flush()
+
+
+def _writer():
+    timestamps = {}
+    while True:
+        batch = [log_queue.get()]
+        # Drain everything already queued so it is written in one go
+        while True:
+            try:
+                batch.append(log_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        stop = None in batch
+        _write_batch([entry for entry in batch if entry is not None], timestamps)
+        if stop:
+            return
+
+
+def _start_writer():
+    global _writer_thread
+    with _writer_mutex:
+        if _writer_thread is None:
+            _writer_thread = threading.Thread(target=_writer, name='console-writer', daemon=True)
+            _writer_thread.start()
+
+
+def flush_console_output():
+    """
+    Write every queued message and stop the background writer.
+    """
+    global _writer_thread
+    with _writer_mutex:
+        if _writer_thread is None:
+            return
+        log_queue.put(None)
+        _writer_thread.join()
+        _writer_thread = None
+
+
+# Pending messages are written before the interpreter exits
+atexit.register(flush_console_output)
@@ -1,35 +1,37 @@
 ################################ IMPORTS ################################
-import time                                                            ## 
-import threading                                                       ##
+import os                                                              ##
+import time                                                            ##
+import signal                                                          ##
+import contextlib                                                      ##
+import asyncio                                                         ##
+import argparse                                                        ##
+import datetime                                                        ##
                                                                        ##
-from logger import console_output                                      ##
-from utils import discord_utils,file_utils,verification_utils          ##
+from logger import console_output,set_log_level                        ##
+from utils import discord_utils,file_utils,http_utils,pipeline_utils   ##
+from utils import attachment_utils,polling_utils,shard_utils           ##
+from utils import reload_utils                                         ##
+from utils.metrics_utils import metrics,webhook_label                  ##
+from utils.ratelimit_utils import rate_limit_scheduler                 ##
 #########################################################################
 
 
 def hide_discord_username(
     username: str, 
-    incognito_names: dict
+    incognito_names: file_utils.IncognitoNameRegistry
 ):
     """
-    Hide a Discord username using an incognito names dictionary.
+    Hide a Discord username using the shared incognito names registry.
 
     Args:
         username (str): The original Discord username.
-        incognito_names (dict): A dictionary mapping original usernames to incognito names.
+        incognito_names (IncognitoNameRegistry): The registry mapping original usernames to incognito names.
 
     Returns:
         str: The hidden or incognito username.
     """
-    if username not in incognito_names:
-        incognito_names[username] = f'user{len(incognito_names) + 1}'
-
-    hidden_username = incognito_names[username]
-    
-    # Save the modified incognito_names dictionary to a JSON file
-    file_utils.save_custom_names(custom_names=incognito_names)
-    
-    return hidden_username
+    # The registry saves new names to 'custom_names.json' in the background
+    return incognito_names.get_name(username)
 
 
 def extract_embedded_data(embedded_list: list):
@@ -53,105 +55,846 @@ def extract_embedded_data(embedded_list: list):
         return embed_type, title, url, description, fields, thumbnail_url
 
 
-def monitor_discord_api(
+def build_webhook_kwargs(
+    message: dict,
+    channel_id: str,
+    incognito_mode: bool = False,
+    embed_passthrough: bool = False
+):
+    """
+    Turn a Discord message into the arguments of its mirrored webhook message.
+
+    Args:
+        message (dict): A message returned by the Discord API.
+        channel_id (str): The ID of the Discord channel the message comes from.
+        incognito_mode (bool, optional): Indicates if usernames should be hidden (default is False).
+        embed_passthrough (bool, optional): Forward every embed as it is instead of rebuilding the first one (default is False).
+
+    Returns:
+        dict: The keyword arguments for discord_utils.build_webhook_payload.
+    """
+    username = message.get('author').get('username')
+    message_content = message.get('content')
+    embeds = message.get('embeds')
+
+    if incognito_mode:
+        username = hide_discord_username(username, file_utils.get_incognito_name_registry())
+        avatar_link = None
+    else:
+        author = message.get('author')
+        username = author.get('username')
+        avatar = author.get('avatar')
+        auth_id = author.get('id')
+        avatar_link = f"https://cdn.discordapp.com/avatars/{auth_id}/{avatar}.png"
+    
+    if embed_passthrough:
+        return dict(
+            username=username,
+            avatar_url=avatar_link,
+            is_bot=False,
+            message_content=message_content,
+            embeds=discord_utils.sanitize_embeds(embeds)
+        )
+
+    if embeds and len(embeds) > 0:
+        embed_type, title, url, description, fields, thumbnail = extract_embedded_data(embedded_list=embeds)
+
+        if embed_type == 'rich' and fields:
+            console_output(text = f"Webhook detected on channel [{channel_id}].",msg_type = "INFO")
+            return dict(
+                username=username,
+                avatar_url=avatar_link,
+                title=title,
+                url=url,
+                description=description,
+                fields=fields,
+                thumbnail=thumbnail
+            )
+        else:
+            return dict(
+                username=username,
+                is_bot=False,
+                message_content=message_content
+            )
+
+    return dict(
+        username=username,
+        avatar_url=avatar_link,
+        is_bot=False,
+        message_content=message_content
+    )
+
+
+def transform_message(
+    message: dict,
+    channel_id: str,
+    incognito_mode: bool = False,
+    embed_passthrough: bool = False,
+    payload_key: str = None
+):
+    """
+    Return the serialized webhook payload of a Discord message.
+
+    Payloads are memoized by the content hash of the message, so a message mirrored to several
+    webhooks (or a bot posting the same embed again) is only transformed and serialized once.
+
+    Args:
+        message (dict): A message returned by the Discord API.
+        channel_id (str): The ID of the Discord channel the message comes from.
+        incognito_mode (bool, optional): Indicates if usernames should be hidden (default is False).
+        embed_passthrough (bool, optional): Forward every embed as it is (default is False).
+        payload_key (str, optional): The key of the payload, see message_payload_key (default is computed from the message).
+
+    Returns:
+        WebhookPayload: The payload to send to the webhook.
+    """
+    if payload_key is None:
+        payload_key = discord_utils.message_payload_key(discord_utils.message_hashes(message, embed_passthrough)[1], incognito_mode)
+    return discord_utils.payload_cache.get_or_build(
+        key = payload_key,
+        build = lambda: discord_utils.build_webhook_payload(
+            **build_webhook_kwargs(
+                message = message,
+                channel_id = channel_id,
+                incognito_mode = incognito_mode,
+                embed_passthrough = embed_passthrough
+            )
+        )
+    )
+
+
+async def sync_message_edits(
+    account_token_id: str,
+    channel_id: str,
+    destinations: list,
+    pipeline: pipeline_utils.DeliveryPipeline,
+    mirror_index: file_utils.MirrorIndex,
+    edit_window: int = 25,
+    embed_passthrough: bool = False
+):
+    """
+    Propagate the edits and deletions of the latest messages of a channel to their mirrors.
+
+    The latest messages are fetched in a single request and their content hash is compared with
+    the one recorded in the mirror index for every destination: changed messages are queued as a
+    webhook PATCH, and indexed messages missing from the window (but newer than its oldest message)
+    as a DELETE.
+
+    Args:
+        account_token_id (str): The Discord account token for authentication.
+        channel_id (str): The ID of the Discord channel to check.
+        destinations (list): The webhooks the channel is mirrored to, see plan_channel_monitors.
+        pipeline (DeliveryPipeline): The pipeline applying the edits and deletions.
+        mirror_index (MirrorIndex): The index of mirrored messages.
+        edit_window (int, optional): How many of the latest messages are checked, up to 100 (default is 25).
+        embed_passthrough (bool, optional): Forward every embed as it is (default is False).
+    """
+    messages = await discord_utils.fetch_discord_channel_messages(
+        account_token_id = account_token_id,
+        channel_id = channel_id,
+        limit = edit_window
+    )
+    if not messages:
+        return
+
+    present_ids = {message.get('id') for message in messages}
+    # A full window covers every message from its oldest one to now, anything indexed in between was deleted
+    oldest_id = min(present_ids, key = int)
+    newest_id = max(present_ids, key = int)
+
+    content_hashes = {message.get('id'): discord_utils.message_content_hash(message) for message in messages}
+    for destination in destinations:
+        webhook_url = destination['webhook_url']
+        for message in messages:
+            mirrored = mirror_index.get(source_id = message.get('id'), webhook_url = webhook_url)
+            if mirrored is None:
+                continue
+
+            webhook_message_id, content_hash = mirrored
+            new_content_hash = content_hashes[message.get('id')]
+            # An edited message that no longer passes the rules keeps its previous mirror
+            filtered_message = destination['rules'].apply(message) if destination.get('rules') else message
+            if new_content_hash != content_hash and filtered_message is not None:
+                await pipeline.submit(
+                    message_id = message.get('id'),
+                    webhook_url = webhook_url,
+                    payload = transform_message(
+                        message = filtered_message,
+                        channel_id = channel_id,
+                        incognito_mode = destination['incognito_mode'],
+                        embed_passthrough = embed_passthrough
+                    ),
+                    channel_id = channel_id,
+                    action = 'edit',
+                    content_hash = new_content_hash,
+                    webhook_message_id = webhook_message_id
+                )
+
+        for message_id, webhook_message_id in mirror_index.source_ids_between(channel_id, webhook_url, oldest_id, newest_id):
+            if message_id not in present_ids:
+                await pipeline.submit(
+                    message_id = message_id,
+                    webhook_url = webhook_url,
+                    channel_id = channel_id,
+                    action = 'delete',
+                    webhook_message_id = webhook_message_id
+                )
+
+
+def plan_channel_monitors(tasks: list):
+    """
+    Group the verified tasks by source channel, so every channel is polled once whatever the number of destinations.
+
+    The monitor of a channel polls with the first task's account token and the shortest delay
+    (and delay bounds) of its tasks. Rows repeating the same channel and webhook are skipped.
+
+    Args:
+        tasks (list): The verified tasks.
+
+    Returns:
+        list: One dictionary per channel with its polling settings and its 'destinations',
+              a list of {'webhook_url', 'incognito_mode', 'rules'} dictionaries.
+    """
+    channels = {}
+    for task in tasks:
+        channel_id = str(task.get('channel_id'))
+        channel = channels.get(channel_id)
+        if channel is None:
+            channel = channels[channel_id] = {
+                'channel_id': channel_id,
+                'account_token_id': task.get('account_token_id'),
+                'delay': task.get('delay'),
+                'min_delay': task.get('min_delay'),
+                'max_delay': task.get('max_delay'),
+                'destinations': []
+            }
+        else:
+            channel['delay'] = min(channel['delay'], task.get('delay'))
+            for bound in ('min_delay', 'max_delay'):
+                if task.get(bound) is not None:
+                    channel[bound] = task.get(bound) if channel[bound] is None else min(channel[bound], task.get(bound))
+
+        if any(destination['webhook_url'] == task.get('webhook_url') for destination in channel['destinations']):
+            console_output(text = f"Channel [{channel_id}] is already mirrored to this webhook | Duplicate task skipped.", msg_type = "WARNING")
+            continue
+
+        channel['destinations'].append({
+            'webhook_url': task.get('webhook_url'),
+            'incognito_mode': task.get('incognito_mode'),
+            'rules': task.get('rule_set')
+        })
+
+    return list(channels.values())
+
+
+async def submit_message(
+    message: dict,
+    channel_id: str,
+    destinations: list,
+    pipeline: pipeline_utils.DeliveryPipeline,
+    embed_passthrough: bool = False
+):
+    """
+    Hand a new message over to the delivery pipeline once per destination, with that destination's incognito setting.
+
+    Messages dropped by a destination's rule set never reach the pipeline. The source message is
+    hashed once, its payload key per destination only adds the incognito setting and the rule set.
+
+    The caller records the message ID first: every destination is recorded in the outbox before
+    the first await, so a flush of the IDs by another monitor never finds the message half handed over.
+
+    Args:
+        message (dict): A message returned by the Discord API.
+        channel_id (str): The ID of the Discord channel the message comes from.
+        destinations (list): The webhooks to send the message to, see plan_channel_monitors.
+        pipeline (DeliveryPipeline): The pipeline delivering the message.
+        embed_passthrough (bool, optional): Forward every embed as it is instead of rebuilding the first one (default is False).
+
+    Returns:
+        float: The number of seconds spent transforming the message.
+    """
+    started = time.perf_counter()
+    content_hash, source_key = discord_utils.message_hashes(message, embed_passthrough)
+    transform_time = time.perf_counter() - started
+    jobs = []
+    for destination in destinations:
+        started = time.perf_counter()
+        rules = destination.get('rules')
+        filtered_message = rules.apply(message) if rules else message
+        if filtered_message is None:
+            transform_time += time.perf_counter() - started
+            metrics.inc('mirror_messages_filtered_total', {'channel': channel_id, 'destination': webhook_label(destination['webhook_url'])})
+            continue
+
+        payload = transform_message(
+            message = filtered_message,
+            channel_id = channel_id,
+            incognito_mode = destination['incognito_mode'],
+            embed_passthrough = embed_passthrough,
+            payload_key = discord_utils.message_payload_key(
+                source_key = source_key,
+                incognito_mode = destination['incognito_mode'],
+                rules_key = rules.cache_key if rules and rules.rewrites_text else None
+            )
+        )
+        transform_time += time.perf_counter() - started
+
+        jobs.append(pipeline.prepare(
+            message_id = message.get('id'),
+            webhook_url = destination['webhook_url'],
+            payload = payload,
+            channel_id = channel_id,
+            content_hash = content_hash if pipeline.mirror_index else None,
+            attachments = filtered_message.get('attachments')
+        ))
+
+    # Delivery happens on the pipeline workers, a slow webhook never delays the next poll
+    for job in jobs:
+        await pipeline.enqueue(job)
+    return transform_time
+
+
+async def monitor_discord_api(
     delay:float,
     account_token_id: str,
     channel_id: str,
-    webhook_url: str,
-    incognito_mode: bool = False
+    destinations: list,
+    pipeline: pipeline_utils.DeliveryPipeline,
+    min_delay: float = None,
+    max_delay: float = None,
+    request_budget: polling_utils.RequestBudget = None,
+    mirror_index: file_utils.MirrorIndex = None,
+    edit_window: int = 0,
+    embed_passthrough: bool = False,
+    stop_event: asyncio.Event = None
 ):
     """
-    Monitor a Discord API for new messages and send them to a webhook.
+    Monitor a Discord API for new messages and send them to every destination webhook.
+
+    Every monitor is a coroutine sharing the event loop and HTTP client with the others.
+    The channel is fetched once per poll and each new message is handed to the delivery
+    pipeline once per destination, with that destination's incognito setting.
 
     Args:
+        delay (float): The number of seconds to wait between polls, adapted to the channel activity.
         account_token_id (str): The Discord account token for authentication.
         channel_id (str): The ID of the Discord channel to monitor.
-        webhook_url (str): The URL of the Discord webhook to send messages to.
-        incognito_mode (bool, optional): Indicates if usernames should be hidden (default is False).
+        destinations (list): The webhooks to send messages to, see plan_channel_monitors.
+        pipeline (DeliveryPipeline): The pipeline delivering new messages to the webhooks.
+        min_delay (float, optional): The shortest polling interval of a busy channel (default is delay / 4).
+        max_delay (float, optional): The longest polling interval of an idle channel (default is delay * 8).
+        request_budget (RequestBudget, optional): The polls-per-second budget shared by every monitor.
+        mirror_index (MirrorIndex, optional): The index of mirrored messages, needed to propagate edits and deletions.
+        edit_window (int, optional): How many of the latest messages are checked for edits and deletions, 0 disables it (default is 0).
+        embed_passthrough (bool, optional): Forward every embed as it is instead of rebuilding the first one (default is False).
+        stop_event (asyncio.Event, optional): Stops the monitor once set, between two polls so no fetched message is lost.
     """
-    while True:
-        messages = discord_utils.fetch_discord_channel_messages(
+    interval = polling_utils.AdaptivePollingInterval(delay = delay, min_delay = min_delay, max_delay = max_delay)
+
+    while not (stop_event and stop_event.is_set()):
+        if request_budget:
+            await request_budget.acquire()
+
+        new_messages = 0
+        started = time.perf_counter()
+        messages = await discord_utils.fetch_new_channel_messages(
             account_token_id = account_token_id, 
-            channel_id = channel_id
+            channel_id = channel_id,
+            after = file_utils.get_message_id_store('ids.txt').get_high_water_mark(channel_id)
         )
-        incognito_names = file_utils.load_custom_names_from_json()
+        metrics.observe('mirror_stage_seconds', time.perf_counter() - started, {'stage': 'fetch', 'channel': channel_id})
         
         if messages:
+            dedup_time = transform_time = 0.0
             for message in messages:
                 message_id = message.get('id')
+                started = time.perf_counter()
                 new_message = file_utils.record_new_message_id(
                     id_value = message_id, 
-                    filename = 'ids.txt'
+                    filename = 'ids.txt',
+                    channel_id = channel_id
                 )
-                
-                username = message.get('author').get('username')
-                message_content = message.get('content')
-                embeds = message.get('embeds')
+                dedup_time += time.perf_counter() - started
                 
                 if not new_message:
                     console_output(f"Message [{message_id}] already mirrored.",msg_type="INFO")
                 else:
                     console_output(f"New message [{message_id}] detected.",msg_type="SUCCESS")
-                    if incognito_mode:
-                        username = hide_discord_username(username, incognito_names)
-                        avatar_link = None
-                    else:
-                        author = message.get('author')
-                        username = author.get('username')
-                        avatar = author.get('avatar')
-                        auth_id = author.get('id')
-                        avatar_link = f"https://cdn.discordapp.com/avatars/{auth_id}/{avatar}.png"
-                    
-                    if embeds and len(embeds) > 0:
-                        embed_type, title, url, description, fields, thumbnail = extract_embedded_data(embedded_list=embeds)
-
-                        if embed_type == 'rich' and fields:
-                            console_output(text = f"Webhook detected on channel [{channel_id}].",msg_type = "INFO")
-                            discord_utils.send_discord_webhook(
-                                message_id = message_id,
-                                username=username,
-                                avatar_url=avatar_link,
-                                webhook_url=webhook_url,
-                                title=title,
-                                url=url,
-                                description=description,
-                                fields=fields,
-                                thumbnail=thumbnail
-                            )
-                        else:
-                            discord_utils.send_discord_webhook(
-                                message_id = message_id,
-                                username=username,
-                                is_bot=False,
-                                webhook_url=webhook_url,
-                                message_content=message_content
-                            )
-                    else:
-                        discord_utils.send_discord_webhook(
-                            message_id = message_id,
-                            username=username,
-                            avatar_url=avatar_link,
-                            is_bot=False,
-                            webhook_url=webhook_url,
-                            message_content=message_content
-                        )
-
-            console_output(text = f"No new messages on channel [{channel_id}] | Sleeping for [{delay}]s.",msg_type = "INFO")
-            time.sleep(delay)
+                    metrics.inc('mirror_messages_polled_total', {'channel': channel_id})
+                    new_messages += 1
+                    transform_time += await submit_message(
+                        message = message,
+                        channel_id = channel_id,
+                        destinations = destinations,
+                        pipeline = pipeline,
+                        embed_passthrough = embed_passthrough
+                    )
 
-if __name__ == '__main__':
-    threads = []
+            file_utils.flush_message_ids(filename = 'ids.txt')
+            metrics.observe('mirror_stage_seconds', dedup_time, {'stage': 'dedup', 'channel': channel_id})
+            metrics.observe('mirror_stage_seconds', transform_time, {'stage': 'transform', 'channel': channel_id})
+
+        if mirror_index and edit_window:
+            await sync_message_edits(
+                account_token_id = account_token_id,
+                channel_id = channel_id,
+                destinations = destinations,
+                pipeline = pipeline,
+                mirror_index = mirror_index,
+                edit_window = edit_window,
+                embed_passthrough = embed_passthrough
+            )
+
+        sleep_time = interval.next(new_messages = new_messages)
+        console_output(text = f"No new messages on channel [{channel_id}] | Sleeping for [{sleep_time:.2f}]s.",msg_type = "INFO")
+        if stop_event is None:
+            await asyncio.sleep(sleep_time)
+        else:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(stop_event.wait(), sleep_time)
+
+
+async def backfill_channel(
+    channel: dict,
+    start: str,
+    pipeline: pipeline_utils.DeliveryPipeline,
+    checkpoints: dict,
+    request_budget: polling_utils.RequestBudget = None,
+    embed_passthrough: bool = False
+):
+    """
+    Mirror the history of a channel, oldest first, from a start ID up to the messages already mirrored.
+
+    Pages of 100 messages are fetched forward with the 'after' cursor and streamed into the pipeline
+    in chronological order. The backfill stops at the oldest message ever mirrored from the channel
+    (its low-water mark, which compaction keeps) or at its newest message if nothing was mirrored yet,
+    so it never re-sends messages whose IDs were compacted away nor overlaps the live monitor. The cursor is
+    checkpointed after every page, once the page's IDs (and deliveries) are flushed to disk.
 
+    Args:
+        channel (dict): The channel and its destinations, see plan_channel_monitors.
+        start (str): Only messages posted after this snowflake ID are mirrored.
+        pipeline (DeliveryPipeline): The pipeline delivering the messages.
+        checkpoints (dict): The checkpoints of every channel, saved to 'backfill.json'.
+        request_budget (RequestBudget, optional): The requests-per-second budget shared by every channel.
+        embed_passthrough (bool, optional): Forward every embed as it is instead of rebuilding the first one (default is False).
+
+    Returns:
+        int: The number of messages handed over for delivery.
+    """
+    channel_id = channel['channel_id']
+    checkpoint = checkpoints.get(channel_id)
+
+    if checkpoint is not None and checkpoint['start'] == start:
+        if checkpoint['done']:
+            console_output(text = f"Channel [{channel_id}] is already backfilled.", msg_type = "INFO")
+            return 0
+        console_output(text = f"Resuming the backfill of channel [{channel_id}] after message [{checkpoint['after']}].", msg_type = "INFO")
+    else:
+        before = file_utils.get_message_id_store('ids.txt').get_low_water_mark(channel_id)
+        if before is None:
+            newest = await discord_utils.fetch_discord_channel_messages(
+                account_token_id = channel['account_token_id'],
+                channel_id = channel_id,
+                limit = 1
+            )
+            if newest is None:
+                console_output(text = f"Backfill of channel [{channel_id}] skipped | The channel could not be read.", msg_type = "WARNING")
+                return 0
+            if not newest:
+                return 0
+            # The newest message itself is part of the backfill
+            before = str(int(newest[0]['id']) + 1)
+        checkpoint = checkpoints[channel_id] = {'start': start, 'after': start, 'before': before, 'done': False}
+
+    mirrored = 0
+    while not checkpoint['done']:
+        if request_budget:
+            await request_budget.acquire()
+
+        page = await discord_utils.fetch_discord_channel_messages(
+            account_token_id = channel['account_token_id'],
+            channel_id = channel_id,
+            after = checkpoint['after'],
+            limit = 100
+        )
+        if page is None:
+            console_output(text = f"Backfill of channel [{channel_id}] interrupted | Run it again to resume.", msg_type = "WARNING")
+            break
+
+        page.sort(key=lambda message: int(message['id']))
+        messages = [message for message in page if int(message['id']) < int(checkpoint['before'])]
+        for message in messages:
+            if file_utils.record_new_message_id(id_value = message.get('id'), filename = 'ids.txt', channel_id = channel_id):
+                await submit_message(
+                    message = message,
+                    channel_id = channel_id,
+                    destinations = channel['destinations'],
+                    pipeline = pipeline,
+                    embed_passthrough = embed_passthrough
+                )
+                mirrored += 1
+
+        if messages:
+            checkpoint['after'] = messages[-1]['id']
+        checkpoint['done'] = len(page) < 100 or len(messages) < len(page)
+
+        # The checkpoint never moves past messages that aren't durably queued yet
+        file_utils.flush_message_ids(filename = 'ids.txt')
+        file_utils.save_backfill_checkpoints(checkpoints = checkpoints)
+        console_output(text = f"Backfill of channel [{channel_id}] | {mirrored} messages so far.", msg_type = "INFO")
+
+    return mirrored
+
+
+async def run_backfill(tasks_to_run: list, options: argparse.Namespace):
+    """
+    Mirror the history of every channel of the verified tasks since --backfill, then wait for the deliveries and return.
+
+    Up to --backfill-concurrency channels are backfilled at the same time, sharing the --request-budget.
+    An interrupted backfill resumes from its checkpoints when it is run again with the same start.
+
+    Args:
+        tasks_to_run (list): The verified tasks whose channels are backfilled.
+        options (argparse.Namespace): The command line options.
+    """
+    pipeline = await start_delivery_pipeline(options = options)
+    request_budget = polling_utils.RequestBudget(rate = options.request_budget)
+    concurrency = asyncio.Semaphore(options.backfill_concurrency)
+    checkpoints = file_utils.load_backfill_checkpoints()
+
+    async def backfill(channel: dict):
+        async with concurrency:
+            return await backfill_channel(
+                channel = channel,
+                start = options.backfill,
+                pipeline = pipeline,
+                checkpoints = checkpoints,
+                request_budget = request_budget,
+                embed_passthrough = options.embed_passthrough
+            )
+
+    try:
+        results = await asyncio.gather(*(backfill(channel) for channel in plan_channel_monitors(tasks = tasks_to_run)), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                console_output(text = f"Backfill stopped. [{result!r}]", msg_type = "ERROR")
+
+        await pipeline.join()
+        mirrored = sum(result for result in results if not isinstance(result, Exception))
+        console_output(text = f"Backfill done | {mirrored} messages mirrored.", msg_type = "SUCCESS")
+    finally:
+        await stop_delivery_pipeline(pipeline = pipeline)
+
+
+async def start_delivery_pipeline(options: argparse.Namespace):
+    """
+    Create and start the delivery pipeline (with its mirror index, attachment cache and outbox) and replay the outbox.
+
+    Args:
+        options (argparse.Namespace): The command line options.
+
+    Returns:
+        DeliveryPipeline: The running pipeline.
+    """
+    mirror_index = file_utils.MirrorIndex() if options.edit_window else None
+    attachment_cache = None
+    if options.mirror_attachments:
+        attachment_cache = attachment_utils.AttachmentCache(
+            max_bytes = options.attachment_cache_mb * 1024 * 1024,
+            max_transfers = options.attachment_transfers
+        )
+    outbox = None if options.no_outbox else file_utils.DeliveryOutbox()
+    pipeline = pipeline_utils.DeliveryPipeline(
+        workers = options.workers,
+        queue_size = options.queue_size,
+        batch_window = options.batch_window,
+        mirror_index = mirror_index,
+        attachment_cache = attachment_cache,
+        outbox = outbox,
+        max_attempts = options.max_attempts
+    )
+    pipeline.start()
+    # A message is only marked as mirrored once its deliveries are safely in the outbox
+    file_utils.get_message_id_store('ids.txt').before_flush = pipeline.commit
+
+    replayed = await pipeline.replay()
+    if replayed:
+        console_output(text = f"Replaying {replayed} pending deliveries from the outbox.", msg_type = "WARNING")
+    return pipeline
+
+
+async def stop_delivery_pipeline(pipeline: pipeline_utils.DeliveryPipeline):
+    """
+    Stop the delivery pipeline, flush every piece of state to disk and close the HTTP clients.
+
+    Args:
+        pipeline (DeliveryPipeline): The pipeline returned by start_delivery_pipeline.
+    """
+    await pipeline.close()
+    file_utils.flush_message_ids(filename = 'ids.txt')
+    if pipeline.outbox:
+        pipeline.outbox.close()
+    if pipeline.mirror_index:
+        pipeline.mirror_index.close()
+    file_utils.get_incognito_name_registry().flush()
+    console_output(text = f"Connection reuse ratio: {http_utils.get_connection_reuse_ratio():.2%}", msg_type = "INFO")
+    await http_utils.close_http_clients()
+
+
+async def run_monitors(
+    tasks_to_run: list,
+    options: argparse.Namespace,
+    shard_id: int = None,
+    status_queue = None,
+    task_watcher: reload_utils.TaskFileWatcher = None
+):
+    """
+    Run one monitor coroutine per source channel of the verified tasks on the current event loop.
+
+    Args:
+        tasks_to_run (list): The verified tasks to monitor.
+        options (argparse.Namespace): The command line options (workers, queue size, batching, metrics...).
+        shard_id (int, optional): The ID of the shard running the monitors, in sharded mode.
+        status_queue (multiprocessing.Queue, optional): Where heartbeats are sent to the shard supervisor.
+        task_watcher (TaskFileWatcher, optional): Reloads the tasks when the task file changes. Only the monitors
+            of channels whose tasks changed are stopped or started, the others keep running.
+    """
+    pipeline = await start_delivery_pipeline(options = options)
+    mirror_index = pipeline.mirror_index
+
+    background_tasks = [
+        asyncio.create_task(pipeline.report(interval = options.report_interval)),
+        asyncio.create_task(metrics.report(interval = options.report_interval))
+    ]
+    if options.metrics_port:
+        background_tasks.append(asyncio.create_task(metrics.serve(port = options.metrics_port)))
+    if status_queue is not None:
+        background_tasks.append(asyncio.create_task(shard_utils.send_heartbeats(shard_id = shard_id, status_queue = status_queue)))
+
+    request_budget = polling_utils.RequestBudget(rate = options.request_budget)
+
+    # Channel ID -> (polling settings and destinations, stop event, monitor task)
+    monitors = {}
+
+    def log_monitor_error(monitor: asyncio.Task):
+        # A failing monitor must not take down the others
+        if not monitor.cancelled() and monitor.exception():
+            console_output(text = f"Monitor stopped. [{monitor.exception()!r}]", msg_type = "ERROR")
+
+    def start_monitor(channel: dict):
+        console_output(text = f"Channel [{channel['channel_id']}] mirrored to {len(channel['destinations'])} webhook(s).", msg_type = "INFO")
+        stop_event = asyncio.Event()
+        monitor = asyncio.create_task(monitor_discord_api(
+            delay = channel['delay'],
+            account_token_id = channel['account_token_id'],
+            channel_id = channel['channel_id'],
+            destinations = channel['destinations'],
+            pipeline = pipeline,
+            min_delay = channel['min_delay'],
+            max_delay = channel['max_delay'],
+            request_budget = request_budget,
+            mirror_index = mirror_index,
+            edit_window = options.edit_window,
+            embed_passthrough = options.embed_passthrough,
+            stop_event = stop_event
+        ))
+        monitor.add_done_callback(log_monitor_error)
+        monitors[channel['channel_id']] = (channel, stop_event, monitor)
+
+    async def apply_tasks(tasks: list):
+        plan = {channel['channel_id']: channel for channel in plan_channel_monitors(tasks = tasks)}
+
+        # Cursors and mirrored IDs are kept per channel, so a restarted monitor resumes where it stopped.
+        # Monitors that died (e.g. on an unexpected response) are restarted as if their plan changed.
+        stopping = [
+            channel_id for channel_id, (channel, _, monitor) in monitors.items()
+            if plan.get(channel_id) != channel or monitor.done()
+        ]
+        for channel_id in stopping:
+            monitors[channel_id][1].set()
+        await asyncio.gather(*(monitors.pop(channel_id)[2] for channel_id in stopping), return_exceptions=True)
+        for channel_id in stopping:
+            if channel_id not in plan:
+                console_output(text = f"Channel [{channel_id}] is no longer mirrored.", msg_type = "INFO")
+
+        for channel_id, channel in plan.items():
+            if channel_id not in monitors:
+                start_monitor(channel)
+
+    await apply_tasks(tasks_to_run)
+
+    try:
+        if task_watcher:
+            await task_watcher.watch(apply = apply_tasks)
+        else:
+            await asyncio.gather(*(monitor for _, _, monitor in monitors.values()), return_exceptions=True)
+    finally:
+        for _, _, monitor in monitors.values():
+            monitor.cancel()
+        await asyncio.gather(*(monitor for _, _, monitor in monitors.values()), return_exceptions=True)
+        for background_task in background_tasks:
+            background_task.cancel()
+        await stop_delivery_pipeline(pipeline = pipeline)
+
+
+def run_shard(shard_id: int, directory: str, tasks: list, options: argparse.Namespace, status_queue, incognito_names):
+    """
+    Entry point of a shard process: monitor a share of the channels from the shard's state directory.
+
+    The global rate limit and request budget are split evenly between the shards, and the
+    metrics are reported to the supervisor instead of being served by the shard.
+
+    Args:
+        shard_id (int): The ID of the shard.
+        directory (str): The state directory of the shard (ids.txt, outbox...).
+        tasks (list): The verified tasks assigned to the shard.
+        options (argparse.Namespace): The command line options.
+        status_queue (multiprocessing.Queue): Where heartbeats are sent to the supervisor.
+        incognito_names: The proxy of the supervisor's IncognitoNameRegistry, shared by every shard.
+    """
+    os.chdir(directory)
+    file_utils.set_incognito_name_registry(shard_utils.RemoteIncognitoNames(incognito_names))
+    set_log_level(options.log_level)
+    http_utils.configure_http_pools(pool_size = options.pool_size, http2 = not options.no_http2)
+    discord_utils.DISCORD_API_URL = options.api_url
+    rate_limit_scheduler.global_rate /= options.shards
+    options.request_budget /= options.shards
+    options.metrics_port = 0
+    # The supervisor watches the task file and restarts the shards whose tasks changed
+    options.reload_interval = 0
+
+    async def shard_main():
+        monitors = asyncio.create_task(run_monitors(tasks_to_run = tasks, options = options, shard_id = shard_id, status_queue = status_queue))
+        # The supervisor stops a shard with SIGTERM, its state is flushed before exiting
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, monitors.cancel)
+        try:
+            await monitors
+        except asyncio.CancelledError:
+            pass
+
+    # Ctrl-C reaches every shard as well, the monitors are cancelled and their state flushed by asyncio.run
+    try:
+        asyncio.run(shard_main())
+    except KeyboardInterrupt:
+        pass
+
+
+async def main(options: argparse.Namespace):
+    """
+    Load and verify the tasks, then monitor every verified task until interrupted.
+
+    Args:
+        options (argparse.Namespace): The command line options.
+    """
+    http_utils.configure_http_pools(pool_size = options.pool_size, http2 = not options.no_http2)
+    discord_utils.DISCORD_API_URL = options.api_url
+
+    task_watcher = reload_utils.TaskFileWatcher(filename = 'tasks.csv', interval = options.reload_interval)
     tasks = file_utils.open_or_create_task_csv()
-    tasks_to_run = verification_utils.verify_and_filter_tasks(task_file = tasks)
-    for task in tasks_to_run:
-        account_token_id = task.get('account_token_id')
-        channel_id = str(task.get('channel_id'))
-        webhook_url = task.get('webhook_url')
-        delay = task.get('delay')
-        incognito_mode = task.get('incognito_mode')
+    tasks_to_run = await task_watcher.verify(tasks)
+    if not tasks_to_run:
+        if not options.reload_interval or options.shards > 1 or options.backfill:
+            console_output(text = "No valid task to run | Fix tasks.csv and restart.", msg_type = "ERROR")
+            return
+        console_output(text = "No valid task to run | Waiting for changes to tasks.csv.", msg_type = "WARNING")
+
+    if options.shards <= 1:
+        # Channels monitored by shards in a previous run keep their mirrored IDs and pending deliveries
+        shard_utils.adopt_shard_state(tasks = tasks_to_run)
 
-        thread = threading.Thread(target=monitor_discord_api, args=(delay,account_token_id, channel_id, webhook_url, incognito_mode))
-        threads.append(thread)
-        thread.start()
+    if options.backfill:
+        if options.shards > 1:
+            console_output(text = "Backfill runs in a single process | Run it without --shards.", msg_type = "ERROR")
+            return
+        await run_backfill(tasks_to_run = tasks_to_run, options = options)
+        return
 
+    if options.shards > 1:
+        supervisor = shard_utils.ShardSupervisor(
+            tasks = tasks_to_run,
+            shards = options.shards,
+            target = run_shard,
+            target_args = (options,)
+        )
+        background_tasks = [asyncio.create_task(metrics.report(interval = options.report_interval))]
+        if options.metrics_port:
+            background_tasks.append(asyncio.create_task(metrics.serve(port = options.metrics_port)))
+        if options.reload_interval:
+            background_tasks.append(asyncio.create_task(task_watcher.watch(apply = supervisor.reload)))
+        try:
+            await supervisor.run()
+        finally:
+            for background_task in background_tasks:
+                background_task.cancel()
+        return
+
+    await run_monitors(
+        tasks_to_run = tasks_to_run,
+        options = options,
+        task_watcher = task_watcher if options.reload_interval else None
+    )
+
+
+def parse_backfill_start(value: str):
+    """
+    Turn the value of --backfill, a message ID or an ISO date (UTC unless a timezone is given), into a snowflake ID.
+    """
+    if value.isdigit():
+        return value
+    try:
+        moment = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a message ID or an ISO date, got '{value}'") from None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo = datetime.timezone.utc)
+    return discord_utils.timestamp_to_snowflake(moment.timestamp())
+
+
+def parse_options(arguments: list = None):
+    """
+    Parse the command line options of the bot.
+
+    Args:
+        arguments (list, optional): The arguments to parse (default is sys.argv).
+
+    Returns:
+        argparse.Namespace: The parsed options.
+    """
+    parser = argparse.ArgumentParser(description = "Mirror Discord channels to webhooks.")
+    parser.add_argument('--pool-size', type = int, default = 100, help = "Maximum open connections per host (default 100).")
+    parser.add_argument('--no-http2', action = 'store_true', help = "Disable HTTP/2 even if the 'h2' package is installed.")
+    parser.add_argument('--workers', type = int, default = 4, help = "Number of webhook delivery workers (default 4).")
+    parser.add_argument('--queue-size', type = int, default = 1000, help = "Maximum pending deliveries per worker (default 1000).")
+    parser.add_argument('--batch-window', type = float, default = 0, help = "Seconds to coalesce embeds per webhook call, 0 disables batching (default 0).")
+    parser.add_argument('--log-level', default = 'INFO', choices = ['INFO', 'SUCCESS', 'WARNING', 'ERROR'], help = "Lowest message type printed (default INFO).")
+    parser.add_argument('--metrics-port', type = int, default = 0, help = "Serve Prometheus metrics on this local port, 0 disables it (default 0).")
+    parser.add_argument('--report-interval', type = float, default = 60, help = "Seconds between two metrics summaries in the console (default 60).")
+    parser.add_argument('--request-budget', type = float, default = 10, help = "Maximum channel polls per second across all tasks, 0 disables it (default 10).")
+    parser.add_argument('--edit-window', type = int, default = 0, help = "Check the latest N messages of each channel for edits and deletions on every poll, 0 disables it (default 0, max 100).")
+    parser.add_argument('--embed-passthrough', action = 'store_true', help = "Forward every embed (images, footers, authors, colors...) as it is instead of rebuilding the first one.")
+    parser.add_argument('--mirror-attachments', action = 'store_true', help = "Upload the attachments of mirrored messages along with them.")
+    parser.add_argument('--attachment-cache-mb', type = int, default = 512, help = "Size of the on-disk attachment cache in MiB (default 512).")
+    parser.add_argument('--attachment-transfers', type = int, default = 4, help = "Maximum concurrent attachment downloads (default 4).")
+    parser.add_argument('--max-attempts', type = int, default = 8, help = "Delivery attempts before a message is given up until the next start (default 8).")
+    parser.add_argument('--no-outbox', action = 'store_true', help = "Keep pending deliveries in memory only instead of the outbox.sqlite3 file.")
+    parser.add_argument('--shards', type = int, default = 1, help = "Spread the channels over N processes supervised by this one (default 1, no sharding).")
+    parser.add_argument('--reload-interval', type = float, default = 5, help = "Seconds between two checks of tasks.csv for changes, applied without a restart, 0 disables it (default 5).")
+    parser.add_argument('--backfill', type = parse_backfill_start, metavar = 'SINCE', help = "Mirror the history of every channel since a date (e.g. 2024-05-01) or a message ID, then exit. Interrupted backfills resume from backfill.json.")
+    parser.add_argument('--backfill-concurrency', type = int, default = 4, help = "Channels backfilled at the same time (default 4).")
+    parser.add_argument('--api-url', default = discord_utils.DISCORD_API_URL, help = "Base URL of the Discord API, e.g. a local stand-in for load tests (default %(default)s).")
+    options = parser.parse_args(arguments)
+    # Discord returns at most 100 messages per request and rejects larger limits
+    if not 0 <= options.edit_window <= 100:
+        parser.error("--edit-window must be between 0 and 100")
+    return options
+
+
+if __name__ == '__main__':
+    options = parse_options()
+    set_log_level(options.log_level)
+    # Ctrl-C is the normal way to stop the bot, run_monitors shuts down cleanly before this returns
+    try:
+        asyncio.run(main(options = options))
+    except KeyboardInterrupt:
+        pass
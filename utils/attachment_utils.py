@@ -0,0 +1,201 @@
+################################ IMPORTS ################################
+import os                                                              ##
+import asyncio                                                         ##
+import hashlib                                                         ##
+import collections                                                     ##
+import httpx                                                           ##
+                                                                       ##
+from logger import console_output                                      ##
+from utils import http_utils                                           ##
+from utils.metrics_utils import metrics                                ##
+#########################################################################
+
+
+CHUNK_SIZE = 64 * 1024
+# Discord rejects webhook uploads above 10 MiB (servers without boosts) and more than 10 files per message
+MAX_ATTACHMENT_BYTES = 10 * 1024 * 1024
+MAX_ATTACHMENTS_PER_MESSAGE = 10
+
+
+class AttachmentCache:
+    """
+    Keep downloaded attachments on disk, each file named after the SHA-256 of its content.
+
+    Attachments are streamed from the Discord CDN to disk in chunks, so a file is never held in
+    memory, and the same attachment sent to several destinations (or retried) is only downloaded
+    once. Once the cache grows past max_bytes, the least recently used files that no upload is
+    reading are evicted. At most max_transfers downloads run at the same time.
+
+    Args:
+        directory (str, optional): The cache directory (default is 'attachment_cache').
+        max_bytes (int, optional): The size the cache is trimmed to (default is 512 MiB).
+        max_transfers (int, optional): The maximum number of concurrent downloads (default is 4).
+    """
+
+    def __init__(self, directory: str = 'attachment_cache', max_bytes: int = 512 * 1024 * 1024, max_transfers: int = 4):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.transfers = asyncio.Semaphore(max_transfers)
+        self.total_bytes = 0
+
+        # Content digest -> size, least recently used first
+        self._files = collections.OrderedDict()
+        # Discord attachment ID -> content digest
+        self._sources = {}
+        self._downloads = {}
+        self._in_use = collections.Counter()
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.part'):
+                # Left over by an interrupted download
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, name, stat.st_size))
+
+        for _, name, size in sorted(entries):
+            self._files[name] = size
+            self.total_bytes += size
+        self._evict()
+
+    def _path(self, digest: str):
+        return os.path.join(self.directory, digest)
+
+    async def acquire(self, attachment: dict):
+        """
+        Return the cached file of an attachment, downloading it on a miss.
+
+        The file is protected from eviction until release() is called with its digest.
+
+        Args:
+            attachment (dict): An attachment of a message returned by the Discord API.
+
+        Returns:
+            tuple: The content digest and the path of the cached file.
+        """
+        source_id = attachment['id']
+        while True:
+            digest = self._sources.get(source_id)
+            if digest in self._files:
+                metrics.inc('attachment_cache_requests_total', {'result': 'hit'})
+                break
+
+            download = self._downloads.get(source_id)
+            if download is None:
+                metrics.inc('attachment_cache_requests_total', {'result': 'miss'})
+                # Destinations waiting for the same attachment share a single download
+                download = self._downloads[source_id] = asyncio.ensure_future(self._download(attachment))
+                download.add_done_callback(lambda _: self._downloads.pop(source_id, None))
+                # The downloaded file is handed over already protected from eviction
+                try:
+                    digest = await asyncio.shield(download)
+                except asyncio.CancelledError:
+                    download.add_done_callback(
+                        lambda done: done.cancelled() or done.exception() or self.release(done.result())
+                    )
+                    raise
+                return digest, self._path(digest)
+
+            await asyncio.shield(download)
+            # The file may have been evicted before this coroutine resumed, loop to check again
+
+        self._files.move_to_end(digest)
+        self._in_use[digest] += 1
+        return digest, self._path(digest)
+
+    def release(self, digest: str):
+        """
+        Allow a file returned by acquire() to be evicted again.
+        """
+        self._in_use[digest] -= 1
+        if self._in_use[digest] <= 0:
+            del self._in_use[digest]
+        self._evict()
+
+    async def _download(self, attachment: dict):
+        part_path = self._path(f"{attachment['id']}.part")
+        digest = hashlib.sha256()
+        size = 0
+
+        async with self.transfers:
+            try:
+                async with http_utils.stream('GET', attachment['url']) as response:
+                    response.raise_for_status()
+                    with open(part_path, 'wb') as file:
+                        async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                            digest.update(chunk)
+                            file.write(chunk)
+                            size += len(chunk)
+            except BaseException:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                raise
+
+        metrics.inc('attachment_bytes_downloaded_total', value = size)
+        digest = digest.hexdigest()
+        if digest in self._files:
+            # Same content already cached under another attachment ID
+            os.remove(part_path)
+        else:
+            os.replace(part_path, self._path(digest))
+            self._files[digest] = size
+            self.total_bytes += size
+
+        self._files.move_to_end(digest)
+        self._sources[attachment['id']] = digest
+        self._in_use[digest] += 1
+        self._evict()
+        return digest
+
+    def _evict(self):
+        evicted = False
+        for digest in list(self._files):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if self._in_use[digest]:
+                continue
+
+            self.total_bytes -= self._files.pop(digest)
+            evicted = True
+            try:
+                os.remove(self._path(digest))
+            except FileNotFoundError:
+                pass
+
+        if evicted:
+            self._sources = {source_id: digest for source_id, digest in self._sources.items() if digest in self._files}
+
+    async def prepare_files(self, message_id: str, attachments: list):
+        """
+        Download (or reuse) the attachments of a message for a webhook upload.
+
+        Attachments that are too large or can't be downloaded are skipped with a warning.
+
+        Args:
+            message_id (str): The ID of the source message (used for logging).
+            attachments (list): The 'attachments' list of the source message.
+
+        Returns:
+            tuple: The files as (filename, path, content_type) tuples, and the digests to release() once uploaded.
+        """
+        files, digests = [], []
+        for attachment in attachments[:MAX_ATTACHMENTS_PER_MESSAGE]:
+            if (attachment.get('size') or 0) > MAX_ATTACHMENT_BYTES:
+                console_output(text = f"Attachment [{attachment.get('filename')}] of message [{message_id}] is too large to mirror.", msg_type = "WARNING")
+                continue
+
+            try:
+                digest, path = await self.acquire(attachment)
+            except (httpx.HTTPError, OSError) as e:
+                console_output(text = f"Attachment [{attachment.get('filename')}] of message [{message_id}] could not be downloaded. [{e}]", msg_type = "WARNING")
+                continue
+
+            files.append((attachment.get('filename') or digest, path, attachment.get('content_type') or 'application/octet-stream'))
+            digests.append(digest)
+        return files, digests
@@ -1,17 +1,131 @@
-################################ IMPORTS ################################                                                                                                ##
+################################ IMPORTS ################################
 import json                                                            ##
-import time                                                            ##
-import random                                                          ##
-import requests                                                        ##
-from discord_webhook import DiscordWebhook, DiscordEmbed               ##
+import hashlib                                                         ##
+import contextlib                                                      ##
+import collections                                                     ##
+import httpx                                                           ##
                                                                        ##
 from logger import console_output                                      ##
+from utils import http_utils                                           ##
+from utils.metrics_utils import metrics                                ##
 #########################################################################
 
 
-def fetch_discord_channel_messages(
+# Base URL of the Discord API, overridden to run the bot against a local stand-in (see --api-url)
+DISCORD_API_URL = 'https://discord.com/api/v9'
+
+# Discord snowflakes count milliseconds from the first second of 2015
+DISCORD_EPOCH_MS = 1420070400000
+
+# Discord accepts up to 10 embeds and 6000 characters of embed text per webhook message
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_CHARACTERS = 6000
+MAX_EMBED_FIELDS = 25
+# Keys forwarded by sanitize_embeds and their maximum length (None for no limit)
+EMBED_KEYS = {'title': 256, 'description': 4096, 'url': None, 'timestamp': None, 'color': None}
+EMBED_OBJECT_KEYS = {
+    'author': {'name': 256, 'url': None, 'icon_url': None},
+    'footer': {'text': 2048, 'icon_url': None},
+    'image': {'url': None},
+    'thumbnail': {'url': None}
+}
+EMBED_FIELD_KEYS = {'name': 256, 'value': 1024}
+
+
+def snowflake_to_timestamp(snowflake: str):
+    """
+    Return the creation time of a Discord snowflake ID as a Unix timestamp.
+
+    Args:
+        snowflake (str): A Discord ID (message, channel, user...).
+
+    Returns:
+        float: The number of seconds since the Unix epoch.
+    """
+    return ((int(snowflake) >> 22) + DISCORD_EPOCH_MS) / 1000
+
+
+def timestamp_to_snowflake(timestamp: float):
+    """
+    Return the lowest Discord snowflake ID created at a Unix timestamp, e.g. to use it as an 'after' cursor.
+
+    Args:
+        timestamp (float): The number of seconds since the Unix epoch.
+
+    Returns:
+        str: The snowflake ID.
+    """
+    return str(max(0, int(timestamp * 1000) - DISCORD_EPOCH_MS) << 22)
+
+
+def message_content_hash(message: dict):
+    """
+    Return a short hash of everything that can change when a Discord message is edited.
+
+    Args:
+        message (dict): A message returned by the Discord API.
+
+    Returns:
+        str: A hexadecimal digest of the content, embeds and edit timestamp.
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(str(message.get('edited_timestamp')).encode())
+    digest.update((message.get('content') or '').encode())
+    if message.get('embeds'):
+        digest.update(json.dumps(message['embeds'], sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def message_hashes(message: dict, embed_passthrough: bool = False):
+    """
+    Return the content hash and the source key of a Discord message, serializing its embeds once.
+
+    Args:
+        message (dict): A message returned by the Discord API.
+        embed_passthrough (bool, optional): Indicates if embeds are forwarded as they are (default is False).
+
+    Returns:
+        tuple: The content hash (the same as message_content_hash) and a hexadecimal digest of the
+            author, content and embeds, to be combined per destination by message_payload_key.
+    """
+    author = message.get('author') or {}
+    content = (message.get('content') or '').encode()
+    content_digest = hashlib.blake2b(digest_size=8)
+    content_digest.update(str(message.get('edited_timestamp')).encode())
+    content_digest.update(content)
+    source_digest = hashlib.blake2b(digest_size=16)
+    source_digest.update(f"{embed_passthrough}\0{author.get('id')}\0{author.get('username')}\0{author.get('avatar')}\0".encode())
+    source_digest.update(content)
+    if message.get('embeds'):
+        embeds = json.dumps(message['embeds'], sort_keys=True).encode()
+        content_digest.update(embeds)
+        source_digest.update(embeds)
+    return content_digest.hexdigest(), source_digest.hexdigest()
+
+
+def message_payload_key(source_key: str, incognito_mode: bool = False, rules_key: str = None):
+    """
+    Return the key of the mirrored payload of a message for one destination.
+
+    Two messages with the same key (a bot re-posting the same embed, or the same message
+    mirrored to several webhooks) produce the same payload.
+
+    Args:
+        source_key (str): The source key of the message, see message_hashes.
+        incognito_mode (bool, optional): Indicates if usernames are hidden (default is False).
+        rules_key (str, optional): The cache key of the rule set rewriting the message, if any (default is None).
+
+    Returns:
+        str: The key of the payload in the payload cache.
+    """
+    return f"{source_key}:{incognito_mode:d}:{rules_key or ''}"
+
+
+async def fetch_discord_channel_messages(
     account_token_id: str,
-    channel_id: str
+    channel_id: str,
+    after: str = None,
+    limit: int = 5
 ):
     """
     Obtain messages from a Discord channel using the Discord API.
@@ -19,6 +133,8 @@ def fetch_discord_channel_messages(
     Args:
         account_token_id (str): The Discord account token for authentication.
         channel_id (str): The ID of the Discord channel from which to fetch messages.
+        after (str, optional): Only fetch messages newer than this message ID (default is None).
+        limit (int, optional): The maximum number of messages to fetch, up to 100 (default is 5).
 
     Returns:
         list or None: A list of messages if successful, or None if there was an error.
@@ -26,21 +142,26 @@ def fetch_discord_channel_messages(
     This function makes an HTTP GET request to the Discord API to fetch messages from a specific channel.
     It handles API response status codes and returns the fetched messages or None in case of errors.
     """
-    # Generate a random sleep time between 1 and 10 seconds
-    random_sleep_time = random.uniform(1, 10)
-
     # Define headers for the API request with authorization
     request_headers = {'authorization': account_token_id}
 
     # Define query parameters for the API request
-    query_parameters = (('limit', '5'),)
+    query_parameters = [('limit', str(limit))]
+    if after:
+        query_parameters.append(('after', str(after)))
 
     # Make the HTTP GET request to the Discord API
-    response = requests.get(
-        f'https://discord.com/api/v9/channels/{str(channel_id)}/messages',
-        headers=request_headers,
-        params=query_parameters
-    )
+    try:
+        response = await http_utils.request(
+            'GET',
+            f'{DISCORD_API_URL}/channels/{str(channel_id)}/messages',
+            headers=request_headers,
+            params=query_parameters
+        )
+    except httpx.HTTPError as e:
+        console_output(text = f"Request error on channel [{channel_id}]. [{e}]", msg_type = "WARNING")
+        return None
+
     # Check the HTTP response status code
     if response.status_code == 200:
         # If the response is successful (status code 200), parse the JSON response
@@ -58,16 +179,62 @@ def fetch_discord_channel_messages(
         console_output(text = f"Client error {response.status_code}. {detailed_information}", msg_type = "WARNING")
     
     else:
-        # If none of the above conditions are met, sleep for a random time
+        # Rate limits are handled by the scheduler, anything else is retried on the next poll
         console_output(text = f"Unknown error {response.status_code}.", msg_type = "WARNING")
-        time.sleep(random_sleep_time)
 
-    time.sleep(5)
 
+async def fetch_new_channel_messages(
+    account_token_id: str,
+    channel_id: str,
+    after: str = None,
+    page_size: int = 100
+):
+    """
+    Obtain every message posted in a Discord channel after a given message ID, oldest first.
 
-def send_discord_webhook(
-    message_id:str,
-    webhook_url: str,
+    Args:
+        account_token_id (str): The Discord account token for authentication.
+        channel_id (str): The ID of the Discord channel from which to fetch messages.
+        after (str, optional): The last mirrored message ID of the channel. If None, only the
+            latest messages are fetched to establish the cursor (default is None).
+        page_size (int, optional): The number of messages requested per page, up to 100 (default is 100).
+
+    Returns:
+        list or None: A list of messages sorted from oldest to newest, or None if the first request failed.
+
+    Pages forward with the 'after' cursor until a page comes back shorter than page_size,
+    so bursts larger than a single page are not lost between polls.
+    """
+    if not after:
+        messages = await fetch_discord_channel_messages(
+            account_token_id = account_token_id,
+            channel_id = channel_id
+        )
+        return sorted(messages, key=lambda message: int(message['id'])) if messages is not None else None
+
+    new_messages = None
+    while True:
+        page = await fetch_discord_channel_messages(
+            account_token_id = account_token_id,
+            channel_id = channel_id,
+            after = after,
+            limit = page_size
+        )
+        if page is None:
+            # Keep whatever was already paged in, the cursor resumes from there next poll
+            break
+
+        page.sort(key=lambda message: int(message['id']))
+        new_messages = (new_messages or []) + page
+
+        if len(page) < page_size:
+            break
+        after = page[-1]['id']
+
+    return new_messages
+
+
+def build_webhook_payload(
     username: str = None,
     avatar_url: str = None,
     title: str = None,
@@ -76,13 +243,13 @@ def send_discord_webhook(
     fields: list = None,
     thumbnail: str = None,
     is_bot: bool = True,
-    message_content: str = None
+    message_content: str = None,
+    embeds: list = None
 ):
     """
-    Send a Discord webhook message with optional embedded content.
+    Build the JSON payload of a Discord webhook message with optional embedded content.
 
     Args:
-        webhook_url (str): The URL of the Discord webhook.
         username (str, optional): The username for the webhook message.
         avatar_url (str, optional): The URL of the avatar for the webhook message.
         title (str, optional): The title for the embedded content.
@@ -92,24 +259,303 @@ def send_discord_webhook(
         thumbnail (str, optional): The URL of the thumbnail for the embedded content.
         is_bot (bool, optional): Indicates if the message is sent by a bot (default is True).
         message_content (str, optional): The content of the message if not using embedded content.
+        embeds (list, optional): Embeds forwarded as they are along with the message content (see sanitize_embeds).
 
-    This function sends a Discord webhook message with optional embedded content.
+    Returns:
+        dict: The payload to POST to the webhook.
     """
+    payload = {'username': username, 'avatar_url': avatar_url}
+
     if is_bot:
-        webhook = DiscordWebhook(url=webhook_url, username=username, avatar_url=avatar_url)
-        embed = DiscordEmbed(title=title, description=description, color='0x7b253c', url=url)
+        embed = {'title': title, 'description': description, 'color': 0x7b253c, 'url': url}
         
         if fields and len(fields) > 0:
-            for field in fields:
-                emb_name, emb_value = field['name'], field['value']
-                embed.add_embed_field(name=emb_name, value=emb_value, inline=True)
+            embed['fields'] = [
+                {'name': field['name'], 'value': field['value'], 'inline': True}
+                for field in fields
+            ]
         
         if thumbnail:
-            embed.set_thumbnail(url=thumbnail)
+            embed['thumbnail'] = {'url': thumbnail}
+
+        payload['embeds'] = [{key: value for key, value in embed.items() if value is not None}]
+    elif embeds:
+        payload['embeds'] = embeds
+        if message_content:
+            payload['content'] = message_content
+    else:
+        payload['content'] = message_content
+
+    return {key: value for key, value in payload.items() if value is not None}
+
+
+def embed_text_length(embed: dict):
+    """
+    Return the number of characters an embed counts towards Discord's per-message limit.
+    """
+    length = len(embed.get('title') or '') + len(embed.get('description') or '')
+    for field in embed.get('fields') or []:
+        length += len(field.get('name') or '') + len(field.get('value') or '')
+    length += len((embed.get('footer') or {}).get('text') or '')
+    length += len((embed.get('author') or {}).get('name') or '')
+    return length
+
+
+def _clip(value, limit: int):
+    return value[:limit] if limit and isinstance(value, str) else value
+
+
+def sanitize_embeds(embeds: list):
+    """
+    Prepare the embeds of a source message to be forwarded as they are by a webhook.
+
+    Only rich embeds are kept (link previews are regenerated by Discord from the content).
+    In a single pass, every embed is reduced to the keys a webhook accepts, texts are clipped
+    to Discord's limits and embeds past the 10 embeds / 6000 characters limits are dropped.
+
+    Args:
+        embeds (list): The 'embeds' list of a message returned by the Discord API.
+
+    Returns:
+        list: The embeds to put in the webhook payload (may be empty).
+    """
+    sanitized = []
+    characters = 0
+
+    for embed in embeds or []:
+        if embed.get('type', 'rich') != 'rich':
+            continue
+
+        clean = {key: _clip(embed[key], limit) for key, limit in EMBED_KEYS.items() if embed.get(key) not in (None, '')}
+        for key, sub_keys in EMBED_OBJECT_KEYS.items():
+            source = embed.get(key)
+            if source:
+                value = {sub_key: _clip(source[sub_key], limit) for sub_key, limit in sub_keys.items() if source.get(sub_key)}
+                if value:
+                    clean[key] = value
+
+        fields = [
+            {'name': _clip(field['name'], EMBED_FIELD_KEYS['name']), 'value': _clip(field['value'], EMBED_FIELD_KEYS['value']), 'inline': bool(field.get('inline'))}
+            for field in (embed.get('fields') or [])[:MAX_EMBED_FIELDS]
+            if field.get('name') and field.get('value')
+        ]
+        if fields:
+            clean['fields'] = fields
+
+        length = embed_text_length(clean)
+        if not clean or characters + length > MAX_EMBED_CHARACTERS:
+            continue
+        characters += length
+        sanitized.append(clean)
+        if len(sanitized) == MAX_EMBEDS_PER_MESSAGE:
+            break
+
+    return sanitized
+
+
+class WebhookPayload:
+    """
+    A webhook payload serialized to JSON once, the same bytes are sent to every destination.
+
+    Args:
+        data (dict): The payload built by build_webhook_payload.
+    """
+
+    __slots__ = ('data', 'body')
+
+    def __init__(self, data: dict, body: bytes = None):
+        self.data = data
+        self.body = body if body is not None else json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode()
+
+    @classmethod
+    def from_body(cls, body: bytes):
+        """
+        Rebuild a payload from its serialized JSON (e.g. read back from the delivery outbox).
+        """
+        return cls(json.loads(body), body)
+
+
+class PayloadCache:
+    """
+    Memoize serialized webhook payloads by the content hash of their source message.
+
+    The cache is bounded: once it holds max_size payloads the least recently used one is evicted.
+
+    Args:
+        max_size (int, optional): The maximum number of cached payloads (default is 1024).
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._payloads = collections.OrderedDict()
+
+    def get_or_build(self, key: str, build):
+        """
+        Return the cached payload of a key, building and caching it on a miss.
+
+        Args:
+            key (str): The content hash of the source message (see message_payload_key).
+            build (callable): Called without arguments on a miss, returns the payload dict.
+
+        Returns:
+            WebhookPayload: The serialized payload.
+        """
+        payload = self._payloads.get(key)
+        if payload is not None:
+            self._payloads.move_to_end(key)
+            metrics.inc('payload_cache_requests_total', {'result': 'hit'})
+            return payload
+
+        metrics.inc('payload_cache_requests_total', {'result': 'miss'})
+        payload = self._payloads[key] = WebhookPayload(build())
+        if len(self._payloads) > self.max_size:
+            self._payloads.popitem(last=False)
+        return payload
+
+
+# One cache is shared by every channel monitor
+payload_cache = PayloadCache()
+
+
+async def execute_webhook(
+    message_ids: list,
+    webhook_url: str,
+    payload: WebhookPayload,
+    wait: bool = False,
+    files: list = None
+):
+    """
+    POST a serialized payload to a Discord webhook.
+
+    With files, the request is a multipart upload streaming each file from disk in chunks,
+    the payload being sent as its 'payload_json' part.
+
+    Args:
+        message_ids (list): The IDs of the source messages carried by the payload (used for logging).
+        webhook_url (str): The URL of the Discord webhook.
+        payload (WebhookPayload): The serialized payload.
+        wait (bool, optional): Ask Discord to return the created message (default is False).
+        files (list, optional): The files to upload as (filename, path, content_type) tuples.
+
+    Returns:
+        httpx.Response or None: The webhook response, or None if the request could not be sent.
+    """
+    label = ', '.join(message_ids)
+    params = {'wait': 'true'} if wait else None
+    try:
+        if files:
+            with contextlib.ExitStack() as stack:
+                hook_response = await http_utils.request(
+                    'POST',
+                    webhook_url,
+                    data={'payload_json': payload.body.decode()},
+                    files={
+                        f"files[{index}]": (filename, stack.enter_context(open(path, 'rb')), content_type)
+                        for index, (filename, path, content_type) in enumerate(files)
+                    },
+                    params=params
+                )
+        else:
+            hook_response = await http_utils.request(
+                'POST',
+                webhook_url,
+                content=payload.body,
+                headers={'Content-Type': 'application/json'},
+                params=params
+            )
+    except (httpx.HTTPError, OSError) as e:
+        console_output(text = f"Message [{label}] could not be mirrored. [{e}]", msg_type = "WARNING")
+        return None
+
+    if hook_response.is_success:
+        console_output(text = f"Message [{label}] mirrored to channel.", msg_type = "SUCCESS")
+    else:
+        console_output(text = f"Message [{label}] rejected by the webhook. [{hook_response.status_code}]", msg_type = "WARNING")
+    return hook_response
+
+
+async def edit_webhook_message(
+    message_id: str,
+    webhook_url: str,
+    webhook_message_id: str,
+    payload: WebhookPayload
+):
+    """
+    Replace the content of a message previously sent by a Discord webhook.
+
+    Args:
+        message_id (str): The ID of the source message (used for logging).
+        webhook_url (str): The URL of the Discord webhook.
+        webhook_message_id (str): The ID of the mirrored message.
+        payload (WebhookPayload): The new payload.
+
+    Returns:
+        httpx.Response or None: The webhook response, or None if the request could not be sent.
+    """
+    # Username and avatar can't be changed once a webhook message is sent
+    payload = {key: value for key, value in payload.data.items() if key not in ('username', 'avatar_url')}
+    try:
+        hook_response = await http_utils.request('PATCH', f"{webhook_url}/messages/{webhook_message_id}", json=payload)
+    except httpx.HTTPError as e:
+        console_output(text = f"Edit of message [{message_id}] could not be mirrored. [{e}]", msg_type = "WARNING")
+        return None
+
+    if hook_response.is_success:
+        console_output(text = f"Edit of message [{message_id}] mirrored to channel.", msg_type = "SUCCESS")
+    else:
+        console_output(text = f"Edit of message [{message_id}] rejected by the webhook. [{hook_response.status_code}]", msg_type = "WARNING")
+    return hook_response
+
+
+async def delete_webhook_message(
+    message_id: str,
+    webhook_url: str,
+    webhook_message_id: str
+):
+    """
+    Delete a message previously sent by a Discord webhook.
+
+    Args:
+        message_id (str): The ID of the source message (used for logging).
+        webhook_url (str): The URL of the Discord webhook.
+        webhook_message_id (str): The ID of the mirrored message.
 
-        webhook.add_embed(embed)
+    Returns:
+        httpx.Response or None: The webhook response, or None if the request could not be sent.
+    """
+    try:
+        hook_response = await http_utils.request('DELETE', f"{webhook_url}/messages/{webhook_message_id}")
+    except httpx.HTTPError as e:
+        console_output(text = f"Deletion of message [{message_id}] could not be mirrored. [{e}]", msg_type = "WARNING")
+        return None
+
+    if hook_response.is_success:
+        console_output(text = f"Deletion of message [{message_id}] mirrored to channel.", msg_type = "SUCCESS")
+    elif hook_response.status_code == 404:
+        console_output(text = f"Mirror of message [{message_id}] already deleted.", msg_type = "INFO")
     else:
-        webhook = DiscordWebhook(url=webhook_url, content=message_content, username=username, avatar_url=avatar_url)
+        console_output(text = f"Deletion of message [{message_id}] rejected by the webhook. [{hook_response.status_code}]", msg_type = "WARNING")
+    return hook_response
+
 
-    hook_response = webhook.execute()
-    console_output(text = f"Message [{message_id}] mirrored to channel.", msg_type = "SUCCESS")
+async def send_discord_webhook(
+    message_id:str,
+    webhook_url: str,
+    **payload_kwargs
+):
+    """
+    Send a Discord webhook message with optional embedded content.
+
+    Args:
+        message_id (str): The ID of the source Discord message.
+        webhook_url (str): The URL of the Discord webhook.
+        **payload_kwargs: The message contents, see build_webhook_payload.
+
+    Returns:
+        httpx.Response or None: The webhook response, or None if the request could not be sent.
+    """
+    return await execute_webhook(
+        message_ids = [message_id],
+        webhook_url = webhook_url,
+        payload = WebhookPayload(build_webhook_payload(**payload_kwargs))
+    )
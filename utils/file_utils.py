@@ -3,44 +3,111 @@ import os                                                              ##
 import sys                                                             ##
 import csv                                                             ##
 import json                                                            ##
-import pandas as pd                                                    ##
+import collections                                                     ##
+import sqlite3                                                         ##
+import threading                                                       ##
                                                                        ##
 from logger import console_output                                      ##
 #########################################################################
 
 
+# Define the columns for the CSV file
+TASK_COLUMNS = ["account_token_id", "channel_id", "webhook_url", "incognito_mode","delay"]
+# Optional columns, bounds of the adaptive polling interval (empty means the default bounds)
+OPTIONAL_TASK_COLUMNS = ["min_delay", "max_delay"]
+# Optional column, the name of the task's rule set in 'rules.json' (empty means every message is mirrored)
+RULES_COLUMN = "rules"
+TRUE_VALUES = {'true', '1', 'yes'}
+FALSE_VALUES = {'false', '0', 'no'}
+
+_message_id_stores = {}
+_registry_mutex = threading.Lock()
+_incognito_name_registry = None
+
+
+def coerce_task_row(row:dict):
+    """
+    This function converts the raw strings of a task row to their expected types.
+
+    Parameters:
+    - row: A task row as read by csv.DictReader.
+
+    Returns:
+    - The same row with 'incognito_mode' as a bool, 'delay' as a float,
+      'min_delay'/'max_delay' as floats and 'rules' as a name (None when empty or missing).
+    - Values that can't be converted are left untouched so task verification can report them.
+    """
+    incognito_mode = (row.get('incognito_mode') or '').strip().lower()
+    if incognito_mode in TRUE_VALUES:
+        row['incognito_mode'] = True
+    elif incognito_mode in FALSE_VALUES:
+        row['incognito_mode'] = False
+
+    try:
+        row['delay'] = float(row.get('delay'))
+    except (TypeError, ValueError):
+        pass
+
+    for column in OPTIONAL_TASK_COLUMNS:
+        value = (row.get(column) or '').strip()
+        try:
+            row[column] = float(value) if value else None
+        except ValueError:
+            row[column] = value
+
+    row[RULES_COLUMN] = (row.get(RULES_COLUMN) or '').strip() or None
+
+    if row.get('channel_id') is not None:
+        row['channel_id'] = row['channel_id'].strip()
+
+    return row
+
+
+def read_task_rows(csv_file:str):
+    """
+    This function reads a task CSV file row by row.
+
+    Parameters:
+    - csv_file: The path of the task CSV file.
+
+    Returns:
+    - A generator yielding every non-empty row as a typed dictionary (see coerce_task_row).
+    """
+    with open(csv_file, mode="r", newline="") as file:
+        for row in csv.DictReader(file):
+            if any(value for value in row.values()):
+                yield coerce_task_row(row)
+
+
 def open_or_create_task_csv():
     """
     This function checks if a CSV file named 'tasks.csv' exists. If it doesn't exist,
     it creates the CSV file with the specified columns and writes the header row.
-    If the file already exists, it opens the CSV file and returns its contents as a DataFrame.
+    If the file already exists, it reads the CSV file and returns its rows.
 
     Returns:
-    - If the CSV file doesn't exist, it creates the file and returns None.
-    - If the CSV file exists, it returns the DataFrame containing its contents.
+    - If the CSV file doesn't exist, it creates the file and exits.
+    - If the CSV file exists, it returns a list of typed task dictionaries.
     """
     # Define the CSV file name
     csv_file = "tasks.csv"
     
-    # Define the columns for the CSV file
-    columns = ["account_token_id", "channel_id", "webhook_url", "incognito_mode","delay"]
-
     # Check if the CSV file exists
     if not os.path.exists(csv_file):
         # If the CSV file does not exist, create it and write the header row
         with open(csv_file, mode="w", newline="") as file:
             # Create a CSV writer object
-            writer = csv.DictWriter(file, fieldnames=columns)
+            writer = csv.DictWriter(file, fieldnames=TASK_COLUMNS)
             # Write the header row to the CSV file
             writer.writeheader()
         console_output(text = f"Created {csv_file} | Fill the file now.", msg_type='SUCCESS')
         sys.exit()
         
     else:
-        # If the CSV file already exists, open it and return its contents as a DataFrame
-        open_file = pd.read_csv(csv_file)
+        # If the CSV file already exists, read its rows
+        tasks = list(read_task_rows(csv_file))
         console_output(text = f"Loaded {csv_file} succesfully.", msg_type='SUCCESS')
-        return open_file
+        return tasks
 
 
 def load_custom_names_from_json():
@@ -68,17 +135,354 @@ def save_custom_names(custom_names:dict):
     Note:
     - The function overwrites the contents of 'custom_names.json' if it already exists.
     - If the file does not exist, it will be created.
+    - The file is written to a temporary file first and then renamed, so it is never left half-written.
 
     Returns:
     - None
     """
-    with open('custom_names.json', 'w') as file:
+    with open('custom_names.json.tmp', 'w') as file:
         json.dump(custom_names, file)
+    os.replace('custom_names.json.tmp', 'custom_names.json')
+
+
+def load_verification_cache():
+    """
+    This function loads the webhook verification cache from a JSON file named 'verification_cache.json'.
+
+    Returns:
+    - A dictionary mapping the cache key of each verified webhook (see verification_utils.webhook_cache_key) to the Unix time its verification expires.
+    - An empty dictionary if the file does not exist or cannot be read.
+    """
+    try:
+        with open('verification_cache.json', 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_verification_cache(verification_cache:dict):
+    """
+    This function saves the webhook verification cache to a JSON file named 'verification_cache.json'.
+
+    Parameters:
+    - verification_cache: A dictionary mapping webhook cache keys to the Unix time their verification expires.
+
+    Returns:
+    - None
+    """
+    with open('verification_cache.json.tmp', 'w') as file:
+        json.dump(verification_cache, file)
+    os.replace('verification_cache.json.tmp', 'verification_cache.json')
+
+
+def load_backfill_checkpoints():
+    """
+    This function loads the progress of backfills from a JSON file named 'backfill.json'.
+
+    Returns:
+    - A dictionary mapping each channel ID to its backfill checkpoint ('start', 'after', 'before' and 'done').
+    - An empty dictionary if the file does not exist or cannot be read.
+    """
+    try:
+        with open('backfill.json', 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_backfill_checkpoints(checkpoints:dict):
+    """
+    This function saves the progress of backfills to a JSON file named 'backfill.json'.
+
+    Parameters:
+    - checkpoints: A dictionary mapping each channel ID to its backfill checkpoint.
+
+    Returns:
+    - None
+    """
+    with open('backfill.json.tmp', 'w') as file:
+        json.dump(checkpoints, file)
+    os.replace('backfill.json.tmp', 'backfill.json')
+
+
+class IncognitoNameRegistry:
+    """
+    This class keeps the incognito names of every monitor in memory and saves them in the background.
+
+    Names are loaded once from 'custom_names.json'. A new mapping marks the registry as dirty and
+    schedules a snapshot 'save_delay' seconds later, so a burst of new users results in a single
+    atomic write. Access is guarded by a lock, so every monitor sees (and numbers) the same names.
+
+    Parameters:
+    - save_delay: The number of seconds to wait before writing pending changes to disk.
+    """
+
+    def __init__(self, save_delay: float = 2.0):
+        self.save_delay = save_delay
+
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._names = load_custom_names_from_json()
+        self._save_timer = None
+
+    def get_name(self, username: str):
+        """
+        Return the incognito name of a user, assigning the next free one if needed.
+
+        Parameters:
+        - username: The original Discord username.
+
+        Returns:
+        - The incognito name of the user.
+        """
+        with self._lock:
+            if username not in self._names:
+                self._names[username] = f'user{len(self._names) + 1}'
+                self._schedule_save_locked()
+            return self._names[username]
+
+    def _schedule_save_locked(self):
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.save_delay, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush(self):
+        """
+        Write the current names to disk now if anything changed since the last snapshot.
+        """
+        # Snapshots are written one at a time so an older one can never overwrite a newer one
+        with self._write_lock:
+            with self._lock:
+                if self._save_timer is None:
+                    return
+                self._save_timer.cancel()
+                self._save_timer = None
+                snapshot = dict(self._names)
+
+            save_custom_names(custom_names=snapshot)
+
+
+def get_incognito_name_registry():
+    """
+    This function returns the IncognitoNameRegistry shared by every monitor, loading it the first time.
+
+    Returns:
+    - The shared IncognitoNameRegistry instance.
+    """
+    global _incognito_name_registry
+    with _registry_mutex:
+        if _incognito_name_registry is None:
+            _incognito_name_registry = IncognitoNameRegistry()
+        return _incognito_name_registry
+
+
+def set_incognito_name_registry(registry):
+    """
+    This function replaces the registry returned by get_incognito_name_registry, e.g. by the one
+    shared by every shard (see shard_utils.RemoteIncognitoNames).
+
+    Parameters:
+    - registry: An object with the get_name and flush methods of IncognitoNameRegistry.
+    """
+    global _incognito_name_registry
+    with _registry_mutex:
+        _incognito_name_registry = registry
+
+
+class MessageIdStore:
+    """
+    This class keeps every mirrored Discord message ID in memory and persists them to a text file
+    with batched appends, so checking a message costs O(1) instead of rescanning the whole file.
+
+    Each line of the file holds 'message_id,channel_id' ('message_id' alone for legacy lines).
+    The highest ID seen for a channel is kept as its high-water mark and the lowest as its
+    low-water mark. Once a channel holds more than twice 'retain_per_channel' IDs, only its newest
+    'retain_per_channel' (and its low-water mark) are kept and the file is rewritten (compacted) atomically.
+
+    An optional 'before_flush' callable runs before any ID is written, so deliveries can be made
+    durable (see DeliveryOutbox) before their message is marked as mirrored.
+
+    Parameters:
+    - filename: The name of the text file where IDs are stored.
+    - flush_size: The number of pending IDs that triggers an automatic append to disk.
+    - retain_per_channel: The number of newest IDs kept per channel after a compaction.
+    """
+
+    def __init__(
+            self,
+            filename: str,
+            flush_size: int = 50,
+            retain_per_channel: int = 1000
+    ):
+        self.filename = filename
+        self.flush_size = flush_size
+        self.retain_per_channel = retain_per_channel
+
+        self._lock = threading.Lock()
+        self._ids = set()
+        self._channel_ids = {}
+        self._high_water_marks = {}
+        self._low_water_marks = {}
+        self._pending = []
+        self._needs_compaction = False
+        self.before_flush = None
+
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.filename, 'r') as file:
+                for line in file:
+                    id_value, _, channel_id = line.strip().partition(',')
+                    if id_value and id_value not in self._ids:
+                        self._remember(id_value, channel_id or None)
+        except FileNotFoundError:
+            # The file doesn't exist yet (nothing to compare against)
+            pass
+
+    def _remember(self, id_value: str, channel_id: str = None):
+        self._ids.add(id_value)
+        if channel_id is None:
+            return
+
+        channel_ids = self._channel_ids.setdefault(channel_id, [])
+        channel_ids.append(int(id_value))
+
+        if int(id_value) > self._high_water_marks.get(channel_id, 0):
+            self._high_water_marks[channel_id] = int(id_value)
+        if channel_id not in self._low_water_marks or int(id_value) < self._low_water_marks[channel_id]:
+            self._low_water_marks[channel_id] = int(id_value)
+
+        if len(channel_ids) > 2 * self.retain_per_channel:
+            self._needs_compaction = True
+
+    def record(self, id_value: str, channel_id: str = None):
+        """
+        Record a Discord message ID if it hasn't been seen before.
+
+        Parameters:
+        - id_value: The Discord message ID to compare and potentially add.
+        - channel_id: The ID of the channel the message belongs to (used for the high-water mark).
+
+        Returns:
+        - True if the ID was added (not already present).
+        - False if the ID was already recorded.
+        """
+        id_value = str(id_value)
+        channel_id = str(channel_id) if channel_id is not None else None
+
+        with self._lock:
+            if id_value in self._ids:
+                return False
+
+            # Flushed before adding the new ID, which isn't handed over for delivery yet
+            if len(self._pending) >= self.flush_size:
+                self._flush_locked()
+
+            self._remember(id_value, channel_id)
+            self._pending.append(f"{id_value},{channel_id}" if channel_id else id_value)
+
+        return True
+
+    def get_high_water_mark(self, channel_id: str):
+        """
+        Return the newest message ID recorded for a channel.
+
+        Parameters:
+        - channel_id: The ID of the Discord channel.
+
+        Returns:
+        - The newest recorded message ID as a string, or None if the channel has no recorded IDs.
+        """
+        with self._lock:
+            high_water_mark = self._high_water_marks.get(str(channel_id))
+        return str(high_water_mark) if high_water_mark else None
+
+    def get_low_water_mark(self, channel_id: str):
+        """
+        Return the oldest message ID ever recorded for a channel. Every message of the channel from
+        this ID to the high-water mark was seen, even if compaction dropped its ID since.
+
+        Parameters:
+        - channel_id: The ID of the Discord channel.
+
+        Returns:
+        - The oldest recorded message ID as a string, or None if the channel has no recorded IDs.
+        """
+        with self._lock:
+            low_water_mark = self._low_water_marks.get(str(channel_id))
+        return str(low_water_mark) if low_water_mark else None
+
+    def flush(self):
+        """
+        Append every pending ID to the file in a single write, compacting it first if needed.
+        """
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self.before_flush is not None and (self._pending or self._needs_compaction):
+            self.before_flush()
+
+        if self._needs_compaction:
+            self._compact_locked()
+            return
+
+        if not self._pending:
+            return
+
+        with open(self.filename, 'a') as file:
+            file.write('\n'.join(self._pending) + '\n')
+        self._pending = []
+
+    def _compact_locked(self):
+        legacy_ids = set(self._ids)
+        lines = []
+
+        for channel_id, channel_ids in self._channel_ids.items():
+            legacy_ids.difference_update(str(id_value) for id_value in channel_ids)
+            channel_ids.sort()
+            low_water_mark = channel_ids[0]
+            del channel_ids[:-self.retain_per_channel]
+            if channel_ids[0] != low_water_mark:
+                # Kept so the low-water mark survives restarts, backfills stop there
+                channel_ids.insert(0, low_water_mark)
+            lines.extend(f"{id_value},{channel_id}" for id_value in channel_ids)
+
+        # Anything left over has no channel attached (legacy lines) and is kept as-is
+        self._ids = legacy_ids.union(line.partition(',')[0] for line in lines)
+        lines = sorted(legacy_ids) + lines
+
+        temp_filename = f"{self.filename}.tmp"
+        with open(temp_filename, 'w') as file:
+            file.write(''.join(f"{line}\n" for line in lines))
+        os.replace(temp_filename, self.filename)
+
+        self._pending = []
+        self._needs_compaction = False
+
+
+def get_message_id_store(filename: str):
+    """
+    This function returns the shared MessageIdStore for a file, loading it from disk the first time.
+
+    Parameters:
+    - filename: The name of the text file where IDs are stored.
+
+    Returns:
+    - The MessageIdStore instance bound to the file.
+    """
+    with _registry_mutex:
+        if filename not in _message_id_stores:
+            _message_id_stores[filename] = MessageIdStore(filename=filename)
+        return _message_id_stores[filename]
 
 
 def record_new_message_id(
         id_value:str, 
-        filename:str
+        filename:str,
+        channel_id:str = None
 ):
     
     """
@@ -86,30 +490,305 @@ def record_new_message_id(
     If the ID is not already in the file, it adds it and returns True.
     If the ID is already in the file, it returns False.
 
+    The IDs are kept in memory by a shared MessageIdStore, so the file is only read once;
+    new IDs are appended in batches (call flush_message_ids to force the write).
+
     Parameters:
     - id_value: The Discord message ID to compare and potentially add.
     - filename: The name of the text file where IDs are stored and checked.
+    - channel_id: The ID of the channel the message belongs to (optional).
 
     Returns:
     - True if the ID was added to the file (not already present).
     - False if the ID was already in the file.
     """
-    new_id = False
+    return get_message_id_store(filename).record(id_value=id_value, channel_id=channel_id)
 
-    # Check if the ID is already in the file
-    existing_ids = set()
 
-    try:
-        with open(filename, 'r') as file:
-            existing_ids = set(line.strip() for line in file)
-    except FileNotFoundError:
-        # The file doesn't exist, create it (nothing to compare against)
-        pass
+def flush_message_ids(filename:str):
+    """
+    This function writes every pending message ID of a store to its text file.
+
+    Parameters:
+    - filename: The name of the text file where IDs are stored.
+    """
+    get_message_id_store(filename).flush()
+
+
+
+class MirrorIndex:
+    """
+    This class maps every mirrored source message to the webhook message it produced, so edits
+    and deletions in the source channel can be applied to the mirror.
+
+    Entries live in a SQLite file (on-disk tier) and the most recently used ones are also kept
+    in memory (hot tier, LRU), so checking a recent message for edits doesn't touch the disk.
+
+    Parameters:
+    - filename: The name of the SQLite file storing the index.
+    - hot_size: The number of entries kept in memory.
+    """
+
+    def __init__(self, filename: str = 'mirror_index.sqlite3', hot_size: int = 10000):
+        self.hot_size = hot_size
+        self._hot = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS mirrored_messages ('
+            ' source_id INTEGER NOT NULL,'
+            ' webhook_url TEXT NOT NULL,'
+            ' channel_id TEXT NOT NULL,'
+            ' webhook_message_id TEXT NOT NULL,'
+            ' content_hash TEXT,'
+            ' PRIMARY KEY (source_id, webhook_url))'
+        )
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS mirrored_messages_channel ON mirrored_messages (channel_id, source_id)'
+        )
+        self._connection.commit()
+
+    def _remember(self, key: tuple, value: tuple):
+        self._hot[key] = value
+        self._hot.move_to_end(key)
+        if len(self._hot) > self.hot_size:
+            self._hot.popitem(last=False)
+
+    def get(self, source_id: str, webhook_url: str):
+        """
+        Return the mirrored message of a source message.
+
+        Parameters:
+        - source_id: The ID of the source Discord message.
+        - webhook_url: The URL of the destination webhook.
+
+        Returns:
+        - A (webhook_message_id, content_hash) tuple, or None if the message isn't indexed.
+        """
+        key = (int(source_id), webhook_url)
+        with self._lock:
+            if key in self._hot:
+                self._hot.move_to_end(key)
+                return self._hot[key]
+
+            row = self._connection.execute(
+                'SELECT webhook_message_id, content_hash FROM mirrored_messages WHERE source_id = ? AND webhook_url = ?',
+                key
+            ).fetchone()
+            if row is not None:
+                self._remember(key, row)
+            return row
+
+    def put(self, source_id: str, channel_id: str, webhook_url: str, webhook_message_id: str, content_hash: str):
+        """
+        Record (or update) the mirrored message of a source message.
+        """
+        key = (int(source_id), webhook_url)
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO mirrored_messages VALUES (?, ?, ?, ?, ?)',
+                (key[0], webhook_url, str(channel_id), str(webhook_message_id), content_hash)
+            )
+            self._connection.commit()
+            self._remember(key, (str(webhook_message_id), content_hash))
+
+    def delete(self, source_id: str, webhook_url: str):
+        """
+        Forget the mirrored message of a source message.
+        """
+        key = (int(source_id), webhook_url)
+        with self._lock:
+            self._connection.execute('DELETE FROM mirrored_messages WHERE source_id = ? AND webhook_url = ?', key)
+            self._connection.commit()
+            self._hot.pop(key, None)
+
+    def source_ids_between(self, channel_id: str, webhook_url: str, first_id: str, last_id: str):
+        """
+        Return the indexed source message IDs of a channel and destination within an ID range.
+
+        Parameters:
+        - channel_id: The ID of the source channel.
+        - webhook_url: The URL of the destination webhook.
+        - first_id, last_id: The inclusive bounds of the range.
+
+        Returns:
+        - A list of (source_id, webhook_message_id) tuples, source IDs as strings.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT source_id, webhook_message_id FROM mirrored_messages'
+                ' WHERE channel_id = ? AND webhook_url = ? AND source_id BETWEEN ? AND ?',
+                (str(channel_id), webhook_url, int(first_id), int(last_id))
+            ).fetchall()
+        return [(str(source_id), webhook_message_id) for source_id, webhook_message_id in rows]
+
+    def close(self):
+        """
+        Close the SQLite connection.
+        """
+        with self._lock:
+            self._connection.close()
+
+
+
+class DeliveryOutbox:
+    """
+    This class durably records every message queued for delivery until its webhook accepts it,
+    so deliveries lost to an error or a crash are retried and replayed on the next start.
+
+    Rows live in a SQLite file in WAL mode. Writes are only made durable by commit() (group
+    commit): queuing thousands of messages per second costs one fsync per group instead of one
+    per message.
+
+    Parameters:
+    - filename: The name of the SQLite file storing the outbox.
+    """
+
+    def __init__(self, filename: str = 'outbox.sqlite3'):
+        self._lock = threading.Lock()
+        self._dirty = False
+
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=FULL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS outbox ('
+            ' outbox_id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' message_id TEXT NOT NULL,'
+            ' channel_id TEXT,'
+            ' webhook_url TEXT NOT NULL,'
+            ' payload BLOB NOT NULL,'
+            ' attachments TEXT,'
+            ' content_hash TEXT,'
+            ' attempts INTEGER NOT NULL DEFAULT 0)'
+        )
+        self._connection.commit()
+        self.pending = self._connection.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+
+    def add(self, message_id: str, channel_id: str, webhook_url: str, payload: bytes, attachments: list = None, content_hash: str = None):
+        """
+        Record a pending delivery (durable after the next commit).
+
+        Returns:
+        - The outbox ID of the delivery.
+        """
+        with self._lock:
+            cursor = self._connection.execute(
+                'INSERT INTO outbox (message_id, channel_id, webhook_url, payload, attachments, content_hash) VALUES (?, ?, ?, ?, ?, ?)',
+                (str(message_id), channel_id, webhook_url, payload, json.dumps(attachments) if attachments else None, content_hash)
+            )
+            self.pending += 1
+            self._dirty = True
+            return cursor.lastrowid
+
+    def record_attempt(self, outbox_id: int):
+        """
+        Count a failed delivery attempt.
+        """
+        with self._lock:
+            self._connection.execute('UPDATE outbox SET attempts = attempts + 1 WHERE outbox_id = ?', (outbox_id,))
+            self._dirty = True
+
+    def remove(self, outbox_ids: list):
+        """
+        Forget deliveries that are done (accepted or permanently rejected by their webhook).
+        """
+        with self._lock:
+            self._connection.executemany('DELETE FROM outbox WHERE outbox_id = ?', [(outbox_id,) for outbox_id in outbox_ids])
+            self.pending -= len(outbox_ids)
+            self._dirty = True
+
+    def commit(self):
+        """
+        Make every change since the last commit durable in a single transaction.
+        """
+        with self._lock:
+            if self._dirty:
+                self._connection.commit()
+                self._dirty = False
+
+    def pending_rows(self):
+        """
+        Return the deliveries still pending, oldest first.
+
+        Returns:
+        - A list of dictionaries with the columns of the outbox.
+        """
+        with self._lock:
+            cursor = self._connection.execute(
+                'SELECT outbox_id, message_id, channel_id, webhook_url, payload, attachments, content_hash, attempts'
+                ' FROM outbox ORDER BY outbox_id'
+            )
+            columns = [column[0] for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        for row in rows:
+            row['attachments'] = json.loads(row['attachments']) if row['attachments'] else None
+        return rows
+
+    def close(self):
+        """
+        Commit the pending changes and close the SQLite connection.
+        """
+        self.commit()
+        with self._lock:
+            self._connection.close()
+
+
+def transfer_channel_state(source_directory: str, target_directory: str, channel_ids: set):
+    """
+    This function moves the state of some channels from one state directory to another (e.g. from
+    a dead shard to the shard taking over its channels): mirrored message IDs, pending deliveries
+    and mirrored messages. The processes owning both directories must be stopped.
+
+    Parameters:
+    - source_directory: The directory the state is moved from.
+    - target_directory: The directory the state is moved to.
+    - channel_ids: The IDs of the channels to move.
+    """
+    channel_ids = {str(channel_id) for channel_id in channel_ids}
+    os.makedirs(target_directory, exist_ok=True)
+
+    source_ids = os.path.join(source_directory, 'ids.txt')
+    if os.path.exists(source_ids):
+        moved, kept = [], []
+        with open(source_ids, 'r') as file:
+            for line in file:
+                (moved if line.strip().partition(',')[2] in channel_ids else kept).append(line)
+
+        if moved:
+            with open(os.path.join(target_directory, 'ids.txt'), 'a') as file:
+                file.writelines(moved)
+            temp_filename = f"{source_ids}.tmp"
+            with open(temp_filename, 'w') as file:
+                file.writelines(kept)
+            os.replace(temp_filename, source_ids)
+
+    tables = (
+        ('outbox.sqlite3', 'outbox', DeliveryOutbox, 'message_id, channel_id, webhook_url, payload, attachments, content_hash, attempts'),
+        ('mirror_index.sqlite3', 'mirrored_messages', MirrorIndex, 'source_id, webhook_url, channel_id, webhook_message_id, content_hash')
+    )
+    placeholders = ','.join('?' * len(channel_ids))
+    for filename, table, store_class, columns in tables:
+        source = os.path.join(source_directory, filename)
+        if not os.path.exists(source) or not channel_ids:
+            continue
 
-    if id_value not in existing_ids:
-        # If the ID is not in the file, add it
-        with open(filename, 'a') as file:
-            file.write(str(id_value) + '\n')
-        new_id = True
+        target = os.path.join(target_directory, filename)
+        # Creates the target table if needed
+        store_class(target).close()
 
-    return new_id
\ No newline at end of file
+        connection = sqlite3.connect(target)
+        try:
+            connection.execute('ATTACH DATABASE ? AS source', (source,))
+            connection.execute(
+                f'INSERT OR REPLACE INTO main.{table} ({columns}) SELECT {columns} FROM source.{table} WHERE channel_id IN ({placeholders})',
+                tuple(channel_ids)
+            )
+            connection.execute(f'DELETE FROM source.{table} WHERE channel_id IN ({placeholders})', tuple(channel_ids))
+            connection.commit()
+        finally:
+            connection.close()
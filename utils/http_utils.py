@@ -0,0 +1,234 @@
+################################ IMPORTS ################################
+import asyncio                                                         ##
+import contextlib                                                      ##
+import collections                                                     ##
+import importlib.util                                                  ##
+import httpx                                                           ##
+                                                                       ##
+from utils.metrics_utils import metrics                                ##
+from utils.ratelimit_utils import rate_limit_scheduler                 ##
+#########################################################################
+
+
+# httpcore checks every connection of a pool for each idle one whenever a request starts or ends,
+# so the connections of a host are split over several clients of at most SUBPOOL_SIZE connections
+SUBPOOL_SIZE = 8
+
+# One keep-alive connection pool per host, shared by every monitor running on the event loop
+_http_clients = {}
+_pool_settings = {
+    'pool_size': 100,
+    # HTTP/2 is only used when the optional 'h2' package is installed
+    'http2': importlib.util.find_spec('h2') is not None
+}
+_connection_stats = {'requests': 0, 'new_connections': 0}
+
+
+def configure_http_pools(pool_size: int = None, http2: bool = None):
+    """
+    Change the settings used for connection pools created from now on.
+
+    Args:
+        pool_size (int, optional): The maximum number of connections kept open per host.
+        http2 (bool, optional): Use HTTP/2 when available. Ignored if the 'h2' package is not installed.
+    """
+    if pool_size is not None:
+        _pool_settings['pool_size'] = pool_size
+    if http2 is not None:
+        _pool_settings['http2'] = http2 and importlib.util.find_spec('h2') is not None
+
+
+class HostPool:
+    """
+    The keep-alive connections of one host, split over clients of at most SUBPOOL_SIZE connections.
+
+    Requests in flight are capped at the pool size and each one goes to the client with the most
+    free connections, so requests never queue inside httpx, where every completion would scan
+    the whole queue. Priority requests (webhook deliveries) get the next free connection before
+    the others (channel polls), so polling many channels never holds back mirroring.
+
+    Args:
+        pool_size (int): The maximum number of connections kept open to the host.
+        http2 (bool): Use HTTP/2.
+    """
+
+    def __init__(self, pool_size: int, http2: bool):
+        sizes = [SUBPOOL_SIZE] * (pool_size // SUBPOOL_SIZE) + ([pool_size % SUBPOOL_SIZE] if pool_size % SUBPOOL_SIZE else [])
+        # Loading the CA certificates is slow, the clients share one SSL context
+        ssl_context = httpx.create_ssl_context()
+        self.clients = [
+            httpx.AsyncClient(
+                timeout=httpx.Timeout(30.0),
+                verify=ssl_context,
+                http2=http2,
+                limits=httpx.Limits(max_connections=size, max_keepalive_connections=size)
+            )
+            for size in sizes
+        ]
+        # Free connections of each client
+        self.free = list(sizes)
+        self.available = pool_size
+        # Futures of the requests waiting for a connection, priority requests first
+        self._waiters = (collections.deque(), collections.deque())
+
+    def least_busy(self):
+        """
+        Return the index of the client with the most free connections.
+        """
+        return max(range(len(self.clients)), key=self.free.__getitem__)
+
+    async def _acquire(self, priority: bool):
+        if self.available and not any(self._waiters):
+            self.available -= 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[0 if priority else 1].append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # The connection was handed over right before the cancellation
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            raise
+
+    def _release(self):
+        for waiters in self._waiters:
+            while waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    # The connection is handed over directly
+                    waiter.set_result(None)
+                    return
+        self.available += 1
+
+    @contextlib.asynccontextmanager
+    async def client(self, priority: bool = False):
+        """
+        Wait for a free connection and yield the client it belongs to.
+
+        Args:
+            priority (bool, optional): Get the next free connection before non-priority requests (default is False).
+        """
+        await self._acquire(priority)
+        index = self.least_busy()
+        self.free[index] -= 1
+        try:
+            yield self.clients[index]
+        finally:
+            self.free[index] += 1
+            self._release()
+
+    async def aclose(self):
+        for client in self.clients:
+            await client.aclose()
+
+
+def get_host_pool(url: str):
+    """
+    Return the shared connection pool for the host of a URL, creating it on first use.
+
+    Args:
+        url (str): The URL that is about to be requested.
+
+    Returns:
+        HostPool: The connection pool of that host.
+    """
+    host = httpx.URL(url).host
+    if host not in _http_clients:
+        _http_clients[host] = HostPool(pool_size=max(1, _pool_settings['pool_size']), http2=_pool_settings['http2'])
+    return _http_clients[host]
+
+
+async def _trace_connections(event_name: str, info: dict):
+    if event_name == 'connection.connect_tcp.started':
+        _connection_stats['new_connections'] += 1
+
+
+async def request(method: str, url: str, **kwargs):
+    """
+    Send an HTTP request through the pooled client of the URL's host.
+
+    The request waits for the rate limit scheduler before being sent and is retried
+    after the advertised delay when Discord answers 429.
+
+    Args:
+        method (str): The HTTP method (GET, POST, ...).
+        url (str): The URL to request.
+        **kwargs: Any other argument accepted by httpx.AsyncClient.request.
+
+    Returns:
+        httpx.Response: The last response received for the request.
+    """
+    route = rate_limit_scheduler.route_key(method, url)
+
+    for _ in range(rate_limit_scheduler.max_retries + 1):
+        await rate_limit_scheduler.acquire(route)
+
+        # Webhook requests (deliveries) get a connection before channel polls
+        async with get_host_pool(url).client(priority=route.split(' ', 1)[1].startswith('webhooks/')) as client:
+            _connection_stats['requests'] += 1
+            response = await client.request(
+                method,
+                url,
+                extensions={'trace': _trace_connections},
+                **kwargs
+            )
+
+        metrics.inc('http_responses_total', {'route': route, 'status': response.status_code})
+        if rate_limit_scheduler.update(route, response) is None:
+            break
+        metrics.inc('http_retries_total', {'route': route})
+
+    return response
+
+
+@contextlib.asynccontextmanager
+async def stream(method: str, url: str, **kwargs):
+    """
+    Send an HTTP request through the pooled client of the URL's host and stream its response.
+
+    The connection counts against the pool size of the host until the response is closed.
+    Unlike request(), the rate limit scheduler is not involved (e.g. for CDN downloads).
+
+    Args:
+        method (str): The HTTP method (GET, POST, ...).
+        url (str): The URL to request.
+        **kwargs: Any other argument accepted by httpx.AsyncClient.stream.
+
+    Yields:
+        httpx.Response: The response, its body not read yet.
+    """
+    async with get_host_pool(url).client() as client:
+        _connection_stats['requests'] += 1
+        async with client.stream(method, url, extensions={'trace': _trace_connections}, **kwargs) as response:
+            yield response
+
+
+def get_connection_reuse_ratio():
+    """
+    Return the share of requests that were sent over an already open connection.
+
+    Returns:
+        float: A value between 0 and 1 (1 when no request has been sent yet).
+    """
+    if not _connection_stats['requests']:
+        return 1.0
+    return 1 - _connection_stats['new_connections'] / _connection_stats['requests']
+
+
+def _collect_connection_metrics():
+    metrics.set_gauge('http_connection_reuse_ratio', get_connection_reuse_ratio())
+    metrics.set_gauge('http_open_pools', len(_http_clients))
+
+
+metrics.add_collector(_collect_connection_metrics)
+
+
+async def close_http_clients():
+    """
+    Close every pooled HTTP client and release their connections.
+    """
+    for pool in _http_clients.values():
+        await pool.aclose()
+    _http_clients.clear()
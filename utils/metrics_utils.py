@@ -0,0 +1,281 @@
+################################ IMPORTS ################################
+import re                                                              ##
+import asyncio                                                         ##
+                                                                       ##
+from logger import console_output                                      ##
+#########################################################################
+
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+WEBHOOK_ID_PATTERN = re.compile(r'/webhooks/(\d+)')
+
+
+def webhook_label(webhook_url: str):
+    """
+    Return a label identifying a webhook without exposing its token.
+    """
+    match = WEBHOOK_ID_PATTERN.search(webhook_url or '')
+    return match.group(1) if match else 'unknown'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsRegistry:
+    """
+    Collect counters, gauges and histograms and render them in the Prometheus text format.
+
+    Collectors registered with add_collector are called right before rendering, so values
+    owned by other components (queue depths, connection reuse...) are always current.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.help = {}
+        self._collectors = []
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted((labels or {}).items()))
+
+    def describe(self, name: str, kind: str, text: str):
+        """
+        Register the type and help text of a metric.
+        """
+        self.help[name] = (kind, text)
+
+    def inc(self, name: str, labels: dict = None, value: float = 1):
+        """
+        Increase a counter.
+        """
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, labels: dict = None):
+        """
+        Set the current value of a gauge.
+        """
+        self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, value: float, labels: dict = None):
+        """
+        Record a value (usually a duration in seconds) in a histogram.
+        """
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            # One slot per bucket, then the sum and the count
+            histogram = self.histograms[key] = [0] * (len(BUCKETS) + 2)
+
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram[index] += 1
+                break
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    def add_collector(self, collector):
+        """
+        Register a function called before rendering, typically to refresh gauges.
+        """
+        self._collectors.append(collector)
+
+    def total(self, name: str, **label_filter):
+        """
+        Return the sum of a counter over every label set matching the filter.
+        """
+        return sum(
+            value for (metric, labels), value in self.counters.items()
+            if metric == name and all(dict(labels).get(k) == v for k, v in label_filter.items())
+        )
+
+    def histogram_totals(self, name: str, **label_filter):
+        """
+        Return the (sum, count) of a histogram over every label set matching the filter.
+        """
+        total, count = 0.0, 0
+        for (metric, labels), histogram in self.histograms.items():
+            if metric == name and all(dict(labels).get(k) == v for k, v in label_filter.items()):
+                total += histogram[-2]
+                count += histogram[-1]
+        return total, count
+
+    def snapshot(self):
+        """
+        Return a copy of every counter, gauge and histogram, e.g. to send it to another process.
+        """
+        for collector in self._collectors:
+            collector()
+        return {
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+            'histograms': {key: list(histogram) for key, histogram in self.histograms.items()}
+        }
+
+    def load_snapshots(self, snapshots: dict, label: str = 'shard'):
+        """
+        Replace every metric with the union of several snapshots, each one labelled with its key.
+
+        Args:
+            snapshots (dict): Snapshots returned by snapshot(), keyed by their source (e.g. a shard ID).
+            label (str, optional): The name of the label identifying the source (default is 'shard').
+        """
+        self.counters, self.gauges, self.histograms = {}, {}, {}
+        for source, snapshot in snapshots.items():
+            extra = ((label, str(source)),)
+            for kind in ('counters', 'gauges', 'histograms'):
+                metrics_of_kind = getattr(self, kind)
+                for (name, labels), value in snapshot[kind].items():
+                    metrics_of_kind[(name, tuple(sorted(labels + extra)))] = value
+
+    @staticmethod
+    def _format_labels(labels: tuple, extra: tuple = ()):
+        labels = labels + extra
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+    def render(self):
+        """
+        Return every metric in the Prometheus text exposition format.
+        """
+        for collector in self._collectors:
+            collector()
+
+        lines = []
+        described = set()
+
+        def header(name: str, default_kind: str):
+            if name not in described:
+                described.add(name)
+                kind, text = self.help.get(name, (default_kind, name))
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(self.counters.items()):
+            header(name, 'counter')
+            lines.append(f"{name}{self._format_labels(labels)} {value}")
+
+        for (name, labels), value in sorted(self.gauges.items()):
+            header(name, 'gauge')
+            lines.append(f"{name}{self._format_labels(labels)} {value}")
+
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram):
+                cumulative += count
+                lines.append(f"{name}_bucket{self._format_labels(labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_bucket{self._format_labels(labels, (('le', '+Inf'),))} {histogram[-1]}")
+            lines.append(f"{name}_sum{self._format_labels(labels)} {histogram[-2]}")
+            lines.append(f"{name}_count{self._format_labels(labels)} {histogram[-1]}")
+
+        return '\n'.join(lines) + '\n'
+
+    async def serve(self, port: int, host: str = '127.0.0.1'):
+        """
+        Serve the rendered metrics over HTTP on host:port until cancelled.
+
+        Args:
+            port (int): The local port to listen on.
+            host (str, optional): The interface to bind (default is 127.0.0.1).
+        """
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            try:
+                request_line = await reader.readline()
+                # Skip the request headers
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+
+                if request_line.split(b' ')[1:2] in ([b'/metrics'], [b'/']):
+                    status, body = '200 OK', self.render().encode()
+                else:
+                    status, body = '404 Not Found', b'Not Found\n'
+
+                writer.write(
+                    f"HTTP/1.1 {status}\r\n"
+                    f"Content-Type: text/plain; version=0.0.4\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: close\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+            finally:
+                writer.close()
+
+        server = await asyncio.start_server(handle, host, port)
+        console_output(text = f"Metrics available on http://{host}:{port}/metrics", msg_type = "INFO")
+        async with server:
+            await server.serve_forever()
+
+    async def report(self, interval: float = 60):
+        """
+        Log a summary of stage latencies, throughput and HTTP results every interval seconds until cancelled.
+
+        Args:
+            interval (float, optional): The number of seconds between two reports (default is 60).
+        """
+        previous = {}
+        while True:
+            await asyncio.sleep(interval)
+
+            current = {
+                'polled': self.total('mirror_messages_polled_total'),
+                'delivered': self.total('mirror_messages_delivered_total'),
+                'retries': self.total('http_retries_total'),
+            }
+            for stage in ('fetch', 'dedup', 'transform', 'send'):
+                current[stage] = self.histogram_totals('mirror_stage_seconds', stage=stage)
+            current['lag'] = self.histogram_totals('mirror_lag_seconds')
+
+            def average(key: str):
+                total, count = current[key]
+                previous_total, previous_count = previous.get(key, (0.0, 0))
+                return (total - previous_total) / (count - previous_count) if count > previous_count else 0.0
+
+            def rate(key: str):
+                return (current[key] - previous.get(key, 0)) / interval
+
+            statuses = {}
+            for (name, labels), value in self.counters.items():
+                if name == 'http_responses_total':
+                    status_class = f"{str(dict(labels).get('status'))[0]}xx"
+                    statuses[status_class] = statuses.get(status_class, 0) + value
+
+            console_output(
+                text = (
+                    f"Metrics | fetch {average('fetch'):.3f}s | dedup {average('dedup'):.4f}s | "
+                    f"transform {average('transform'):.4f}s | send {average('send'):.3f}s | "
+                    f"polled {rate('polled'):.2f} msg/s | delivered {rate('delivered'):.2f} msg/s | "
+                    f"lag {average('lag'):.2f}s | http {statuses} | retries {current['retries'] - previous.get('retries', 0):.0f}"
+                ),
+                msg_type = "INFO"
+            )
+            previous = current
+
+
+# One registry is shared by every component of the bot
+metrics = MetricsRegistry()
+metrics.describe('mirror_stage_seconds', 'histogram', "Time spent per stage (fetch, dedup, transform, send).")
+metrics.describe('mirror_lag_seconds', 'histogram', "Delay between message creation and its delivery to the webhook.")
+metrics.describe('mirror_messages_polled_total', 'counter', "New messages found per source channel.")
+metrics.describe('mirror_messages_delivered_total', 'counter', "Messages delivered per source channel and destination webhook.")
+metrics.describe('mirror_messages_updated_total', 'counter', "Edits and deletions propagated per action and destination webhook.")
+metrics.describe('mirror_messages_filtered_total', 'counter', "Messages dropped by the rule set of a destination, per source channel and destination webhook.")
+metrics.describe('payload_cache_requests_total', 'counter', "Webhook payload lookups per result (hit or miss).")
+metrics.describe('attachment_cache_requests_total', 'counter', "Attachment lookups per result (hit or miss).")
+metrics.describe('attachment_bytes_downloaded_total', 'counter', "Bytes of attachments downloaded from the Discord CDN.")
+metrics.describe('mirror_delivery_retries_total', 'counter', "Deliveries retried after a network error, a 5xx or exhausted 429 retries, per destination webhook.")
+metrics.describe('outbox_pending', 'gauge', "Deliveries recorded in the outbox and not yet accepted by their webhook.")
+metrics.describe('shard_up', 'gauge', "1 while a shard process is running.")
+metrics.describe('shard_channels', 'gauge', "Channels assigned to each shard.")
+metrics.describe('shard_heartbeat_age_seconds', 'gauge', "Seconds since the last heartbeat of each shard.")
+metrics.describe('shard_rebalances_total', 'counter', "Channel reassignments after a shard died.")
+metrics.describe('http_responses_total', 'counter', "HTTP responses per route and status code.")
+metrics.describe('http_retries_total', 'counter', "Requests retried after a 429 per route.")
+metrics.describe('http_connection_reuse_ratio', 'gauge', "Share of requests sent over an already open connection.")
+metrics.describe('http_open_pools', 'gauge', "Number of per-host connection pools.")
+metrics.describe('pipeline_queue_depth', 'gauge', "Messages waiting for delivery per pipeline worker.")
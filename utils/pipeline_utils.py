@@ -0,0 +1,501 @@
+################################ IMPORTS ################################
+import time                                                            ##
+import zlib                                                            ##
+import random                                                          ##
+import asyncio                                                         ##
+import collections                                                     ##
+                                                                       ##
+from logger import console_output                                      ##
+from utils import discord_utils                                        ##
+from utils.metrics_utils import metrics,webhook_label                  ##
+#########################################################################
+
+
+class DeliveryPipeline:
+    """
+    Decouple channel polling from webhook delivery.
+
+    Pollers submit normalized messages (new ones, edits and deletions) and a pool of workers delivers them. Each destination
+    webhook always hashes to the same worker, so messages reach a destination in the order they
+    were submitted while different destinations are delivered concurrently. Queues are bounded:
+    when a worker falls behind, submit() waits (backpressure) instead of buffering without limit.
+
+    Failed deliveries (network errors, 5xx and exhausted 429 retries) are retried with an exponential
+    backoff. Until the retry, the destination is held: its later messages wait behind the failed one
+    and are delivered after it, in order, once the backoff expires. With an outbox, every new message is also recorded on disk until its webhook accepts
+    it, so deliveries interrupted by a crash are replayed on the next start (see replay()).
+
+    With a batch window, consecutive embed messages for the same destination and author are
+    coalesced into a single webhook call, flushed once it holds 10 embeds or when the window
+    expires, whichever comes first.
+
+    Args:
+        workers (int, optional): The number of delivery workers (default is 4).
+        queue_size (int, optional): The maximum number of pending messages per worker (default is 1000).
+        batch_window (float, optional): Seconds to wait for more embeds to coalesce, 0 disables batching (default is 0).
+        mirror_index (MirrorIndex, optional): Where mirrored message IDs are recorded so edits and
+            deletions can be propagated, None disables it (default is None).
+        attachment_cache (AttachmentCache, optional): Where attachments are downloaded before being
+            uploaded with their message, None disables attachment mirroring (default is None).
+        outbox (DeliveryOutbox, optional): Where pending deliveries are recorded, None keeps them in memory only (default is None).
+        max_attempts (int, optional): The number of attempts before a delivery is given up until the next start (default is 8).
+        commit_interval (float, optional): Seconds between two group commits of the outbox (default is 0.2).
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        queue_size: int = 1000,
+        batch_window: float = 0,
+        mirror_index = None,
+        attachment_cache = None,
+        outbox = None,
+        max_attempts: int = 8,
+        commit_interval: float = 0.2
+    ):
+        self.queues = [asyncio.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.batch_window = batch_window
+        self.mirror_index = mirror_index
+        self.attachment_cache = attachment_cache
+        self.outbox = outbox
+        self.max_attempts = max_attempts
+        self.commit_interval = commit_interval
+        self._worker_tasks = []
+        self._retry_tasks = set()
+        # The jobs of each held destination, the failed ones first, waiting for the retry
+        self._held = {}
+
+        self.webhook_requests = 0
+        self.delivered = 0
+        self.failed = 0
+        self.retried = 0
+        self.queue_lag_total = 0.0
+        self.mirror_lag_total = 0.0
+        self.max_mirror_lag = 0.0
+
+    def start(self):
+        """
+        Start the delivery workers on the running event loop.
+        """
+        for queue in self.queues:
+            self._worker_tasks.append(asyncio.create_task(self._worker(queue)))
+        if self.outbox is not None:
+            self._worker_tasks.append(asyncio.create_task(self._commit_outbox()))
+        metrics.add_collector(self._collect_metrics)
+
+    def _collect_metrics(self):
+        for index, queue in enumerate(self.queues):
+            metrics.set_gauge('pipeline_queue_depth', queue.qsize(), {'worker': index})
+        if self.outbox is not None:
+            metrics.set_gauge('outbox_pending', self.outbox.pending)
+
+    def commit(self):
+        """
+        Make every delivery recorded in the outbox so far durable (group commit).
+        """
+        if self.outbox is not None:
+            self.outbox.commit()
+
+    async def _commit_outbox(self):
+        while True:
+            await asyncio.sleep(self.commit_interval)
+            self.commit()
+
+    async def replay(self):
+        """
+        Queue again every delivery left pending in the outbox by a previous run.
+
+        Returns:
+            int: The number of replayed deliveries.
+        """
+        if self.outbox is None:
+            return 0
+
+        rows = self.outbox.pending_rows()
+        for row in rows:
+            await self.submit(
+                message_id = row['message_id'],
+                webhook_url = row['webhook_url'],
+                payload = discord_utils.WebhookPayload.from_body(row['payload']),
+                channel_id = row['channel_id'],
+                content_hash = row['content_hash'],
+                attachments = row['attachments'],
+                outbox_id = row['outbox_id'],
+                attempts = row['attempts']
+            )
+        return len(rows)
+
+    async def join(self):
+        """
+        Wait until every submitted delivery is done (delivered, failed or given up), including pending retries.
+        """
+        while True:
+            await asyncio.gather(*(queue.join() for queue in self.queues))
+            if not self._retry_tasks:
+                return
+            # A retry queues the release of its destination once its backoff expires
+            await asyncio.gather(*self._retry_tasks, return_exceptions=True)
+
+    async def close(self):
+        """
+        Stop the delivery workers. Messages still queued are dropped (but kept in the outbox, if any).
+        """
+        for task in self._worker_tasks + list(self._retry_tasks):
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, *self._retry_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self.commit()
+
+    def _queue_for(self, webhook_url: str):
+        return self.queues[zlib.crc32(webhook_url.encode()) % len(self.queues)]
+
+    def prepare(
+        self,
+        message_id: str,
+        webhook_url: str,
+        payload: discord_utils.WebhookPayload = None,
+        channel_id: str = None,
+        action: str = 'send',
+        content_hash: str = None,
+        webhook_message_id: str = None,
+        attachments: list = None,
+        outbox_id: int = None,
+        attempts: int = 0
+    ):
+        """
+        Build the delivery job of a message and record it in the outbox, without waiting.
+
+        Recording every destination of a message before any await (see enqueue) keeps the outbox
+        complete whenever the message ID is flushed as mirrored.
+
+        Args:
+            message_id (str): The ID of the source Discord message.
+            webhook_url (str): The URL of the destination webhook.
+            payload (WebhookPayload, optional): The serialized payload to send (unused for deletions).
+            channel_id (str, optional): The ID of the source channel (used for metrics and the mirror index).
+            action (str, optional): 'send' a new message, 'edit' or 'delete' a mirrored one (default is 'send').
+            content_hash (str, optional): The content hash of the source message, stored in the mirror index.
+            webhook_message_id (str, optional): The ID of the mirrored message to edit or delete.
+            attachments (list, optional): The attachments of the source message, uploaded if attachment mirroring is enabled.
+            outbox_id (int, optional): The outbox ID of a replayed delivery.
+            attempts (int, optional): The number of failed attempts of a replayed delivery.
+
+        Returns:
+            dict: The job, to be passed to enqueue.
+        """
+        if self.outbox is not None and action == 'send' and outbox_id is None:
+            # Recorded before waiting for room in the queue, committed by the next group commit
+            outbox_id = self.outbox.add(
+                message_id = message_id,
+                channel_id = channel_id,
+                webhook_url = webhook_url,
+                payload = payload.body,
+                attachments = attachments,
+                content_hash = content_hash
+            )
+
+        return {
+            'enqueued_at': time.monotonic(),
+            'action': action,
+            'message_id': message_id,
+            'channel_id': channel_id,
+            'webhook_url': webhook_url,
+            'payload': payload,
+            'content_hash': content_hash,
+            'webhook_message_id': webhook_message_id,
+            'attachments': attachments if self.attachment_cache is not None else None,
+            'outbox_id': outbox_id,
+            'attempts': attempts
+        }
+
+    async def enqueue(self, job: dict):
+        """
+        Queue a job built by prepare, waiting if the destination's worker queue is full.
+        """
+        await self._queue_for(job['webhook_url']).put(job)
+
+    async def submit(self, **kwargs):
+        """
+        Queue a message for delivery, waiting if the destination's worker queue is full.
+
+        Args:
+            **kwargs: The arguments of prepare.
+        """
+        await self.enqueue(self.prepare(**kwargs))
+
+    @staticmethod
+    def _is_embed_only(payload: dict):
+        # Text content can't be merged, only messages made of embeds are batched
+        return 'embeds' in payload and not payload.get('content')
+
+    @classmethod
+    def _can_batch(cls, batch: list, payloads: list, job: dict, payload: dict):
+        # Payloads are the 'data' dicts of the jobs' WebhookPayload
+        first_job, first_payload = batch[0], payloads[0]
+        if job['action'] != 'send' or job['webhook_url'] != first_job['webhook_url'] or job['attachments'] or not cls._is_embed_only(payload):
+            return False
+        if payload.get('username') != first_payload.get('username') or payload.get('avatar_url') != first_payload.get('avatar_url'):
+            return False
+
+        embeds = [embed for batched in payloads for embed in batched['embeds']] + payload['embeds']
+        return (
+            len(embeds) <= discord_utils.MAX_EMBEDS_PER_MESSAGE
+            and sum(discord_utils.embed_text_length(embed) for embed in embeds) <= discord_utils.MAX_EMBED_CHARACTERS
+        )
+
+    async def _collect_batch(self, queue: asyncio.Queue, job: dict):
+        """
+        Collect the jobs that can share a webhook call with the given job.
+
+        Returns the batched jobs, their payloads and the first job that could not be batched (or None).
+        """
+        batch, payloads = [job], [job['payload'].data]
+        if not self.batch_window or job['attachments'] or not self._is_embed_only(payloads[0]):
+            return batch, payloads, None
+
+        deadline = time.monotonic() + self.batch_window
+        while True:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                return batch, payloads, None
+            try:
+                next_job = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                return batch, payloads, None
+
+            if next_job['action'] != 'send':
+                return batch, payloads, next_job
+            next_payload = next_job['payload'].data
+            if not self._can_batch(batch, payloads, next_job, next_payload):
+                return batch, payloads, next_job
+
+            batch.append(next_job)
+            payloads.append(next_payload)
+            if sum(len(payload['embeds']) for payload in payloads) == discord_utils.MAX_EMBEDS_PER_MESSAGE:
+                return batch, payloads, None
+
+    async def _send(self, queue: asyncio.Queue, job: dict, batching: bool = True):
+        """
+        Deliver a new message (batched with the following ones if possible).
+
+        Returns the delivered jobs and the first job that could not be batched (or None).
+        """
+        if batching:
+            batch, payloads, carried_job = await self._collect_batch(queue, job)
+        else:
+            batch, payloads, carried_job = [job], [job['payload'].data], None
+
+        payload = job['payload']
+        if len(payloads) > 1:
+            payload = discord_utils.WebhookPayload(
+                dict(payloads[0], embeds=[embed for batched in payloads for embed in batched['embeds']])
+            )
+
+        files, digests = [], []
+        if job['attachments']:
+            files, digests = await self.attachment_cache.prepare_files(job['message_id'], job['attachments'])
+
+        self.webhook_requests += 1
+        destination = webhook_label(job['webhook_url'])
+        started = time.perf_counter()
+        try:
+            response = await discord_utils.execute_webhook(
+                message_ids = [batched['message_id'] for batched in batch],
+                webhook_url = job['webhook_url'],
+                payload = payload,
+                # The mirrored message ID is only returned when Discord is asked to wait for it
+                wait = self.mirror_index is not None,
+                files = files
+            )
+        finally:
+            for digest in digests:
+                self.attachment_cache.release(digest)
+        metrics.observe('mirror_stage_seconds', time.perf_counter() - started, {'stage': 'send', 'destination': destination})
+
+        if response is None or response.status_code == 429 or response.status_code >= 500:
+            for batched in batch:
+                self._retry(batched)
+            return batch, carried_job
+
+        self._forget(batch)
+        if not response.is_success:
+            # Any other 4xx won't change on a retry (invalid payload, deleted webhook...)
+            self.failed += len(batch)
+            return batch, carried_job
+
+        # Batched messages share one mirrored message, they can't be edited or deleted one by one
+        if self.mirror_index is not None and len(batch) == 1:
+            self.mirror_index.put(
+                source_id = job['message_id'],
+                channel_id = job['channel_id'],
+                webhook_url = job['webhook_url'],
+                webhook_message_id = response.json().get('id'),
+                content_hash = job['content_hash']
+            )
+
+        for batched in batch:
+            self.delivered += 1
+            self.queue_lag_total += time.monotonic() - batched['enqueued_at']
+
+            mirror_lag = time.time() - discord_utils.snowflake_to_timestamp(batched['message_id'])
+            self.mirror_lag_total += mirror_lag
+            self.max_mirror_lag = max(self.max_mirror_lag, mirror_lag)
+
+            metrics.observe('mirror_lag_seconds', mirror_lag, {'channel': batched['channel_id']})
+            metrics.inc('mirror_messages_delivered_total', {'channel': batched['channel_id'], 'destination': destination})
+
+        return batch, carried_job
+
+    def _forget(self, batch: list):
+        outbox_ids = [batched['outbox_id'] for batched in batch if batched['outbox_id'] is not None]
+        if outbox_ids:
+            self.outbox.remove(outbox_ids)
+
+    def _retry(self, job: dict):
+        job['attempts'] += 1
+        if job['outbox_id'] is not None:
+            self.outbox.record_attempt(job['outbox_id'])
+
+        if job['attempts'] >= self.max_attempts:
+            self.failed += 1
+            console_output(
+                text = f"Delivery of message [{job['message_id']}] given up after {job['attempts']} attempts" + (" | Kept in the outbox until the next start." if job['outbox_id'] is not None else "."),
+                msg_type = "ERROR"
+            )
+            return
+
+        self.retried += 1
+        metrics.inc('mirror_delivery_retries_total', {'destination': webhook_label(job['webhook_url'])})
+        if job['webhook_url'] in self._held:
+            # Failed with the rest of its batch, the destination is already held
+            self._held[job['webhook_url']].append(job)
+            return
+
+        self._held[job['webhook_url']] = collections.deque([job])
+        # Exponential backoff with jitter, capped at 5 minutes
+        delay = min(2 ** job['attempts'], 300) * random.uniform(0.5, 1)
+        task = asyncio.create_task(self._release(job['webhook_url'], delay))
+        self._retry_tasks.add(task)
+        task.add_done_callback(self._retry_tasks.discard)
+
+    async def _release(self, webhook_url: str, delay: float):
+        await asyncio.sleep(delay)
+        # The worker delivers the held jobs when it reaches this marker, before anything queued after it
+        await self._queue_for(webhook_url).put({'action': 'release', 'webhook_url': webhook_url})
+
+    async def _update(self, job: dict):
+        """
+        Apply an edit or a deletion to a mirrored message and keep the mirror index in sync.
+        """
+        self.webhook_requests += 1
+        if job['action'] == 'edit':
+            response = await discord_utils.edit_webhook_message(
+                message_id = job['message_id'],
+                webhook_url = job['webhook_url'],
+                webhook_message_id = job['webhook_message_id'],
+                payload = job['payload']
+            )
+            if response is not None and response.is_success:
+                self.mirror_index.put(
+                    source_id = job['message_id'],
+                    channel_id = job['channel_id'],
+                    webhook_url = job['webhook_url'],
+                    webhook_message_id = job['webhook_message_id'],
+                    content_hash = job['content_hash']
+                )
+        else:
+            response = await discord_utils.delete_webhook_message(
+                message_id = job['message_id'],
+                webhook_url = job['webhook_url'],
+                webhook_message_id = job['webhook_message_id']
+            )
+            # 404 means the mirrored message is already gone
+            if response is not None and (response.is_success or response.status_code == 404):
+                self.mirror_index.delete(source_id = job['message_id'], webhook_url = job['webhook_url'])
+
+        metrics.inc('mirror_messages_updated_total', {'action': job['action'], 'destination': webhook_label(job['webhook_url'])})
+
+    async def _process(self, queue: asyncio.Queue, job: dict, batching: bool = True):
+        """
+        Deliver a job (and the jobs batched with it).
+
+        Returns the processed jobs and the first job that could not be batched (or None).
+        """
+        batch, carried_job = [job], None
+        try:
+            if job['action'] == 'send':
+                batch, carried_job = await self._send(queue, job, batching)
+            else:
+                await self._update(job)
+        except Exception as e:
+            self.failed += len(batch)
+            console_output(text = f"Delivery of message [{job['message_id']}] failed. [{e!r}]", msg_type = "ERROR")
+        return batch, carried_job
+
+    async def _release_held(self, queue: asyncio.Queue, webhook_url: str):
+        jobs = self._held.pop(webhook_url)
+        while jobs:
+            # Held jobs are delivered one by one, the queue only holds messages submitted after them
+            await self._process(queue, jobs.popleft(), batching = False)
+            if webhook_url in self._held:
+                # Failed again, the remaining jobs keep waiting behind it
+                self._held[webhook_url].extend(jobs)
+                return
+
+    async def _worker(self, queue: asyncio.Queue):
+        carried_job = None
+        while True:
+            job = carried_job or await queue.get()
+            carried_job = None
+            batch = [job]
+            try:
+                if job['action'] == 'release':
+                    await self._release_held(queue, job['webhook_url'])
+                elif job['webhook_url'] in self._held:
+                    # Waits behind the failed delivery of its destination
+                    self._held[job['webhook_url']].append(job)
+                else:
+                    batch, carried_job = await self._process(queue, job)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    def get_stats(self):
+        """
+        Return the backpressure metrics of the pipeline.
+
+        Returns:
+            dict: Queue depth per worker, webhook request, delivery and retry counts and average/max lag in seconds.
+        """
+        return {
+            'queue_depths': [queue.qsize() for queue in self.queues],
+            'webhook_requests': self.webhook_requests,
+            'delivered': self.delivered,
+            'failed': self.failed,
+            'retried': self.retried,
+            'outbox_pending': self.outbox.pending if self.outbox is not None else 0,
+            'avg_queue_lag': self.queue_lag_total / self.delivered if self.delivered else 0.0,
+            'avg_mirror_lag': self.mirror_lag_total / self.delivered if self.delivered else 0.0,
+            'max_mirror_lag': self.max_mirror_lag
+        }
+
+    async def report(self, interval: float = 60):
+        """
+        Log the pipeline metrics every interval seconds until cancelled.
+
+        Args:
+            interval (float, optional): The number of seconds between two reports (default is 60).
+        """
+        while True:
+            await asyncio.sleep(interval)
+            stats = self.get_stats()
+            console_output(
+                text = (
+                    f"Pipeline | queued {sum(stats['queue_depths'])} {stats['queue_depths']} | "
+                    f"delivered {stats['delivered']} in {stats['webhook_requests']} requests | failed {stats['failed']} | "
+                    f"retried {stats['retried']} | outbox {stats['outbox_pending']} | "
+                    f"queue lag {stats['avg_queue_lag']:.2f}s | "
+                    f"mirror lag {stats['avg_mirror_lag']:.2f}s (max {stats['max_mirror_lag']:.2f}s)"
+                ),
+                msg_type = "INFO"
+            )
@@ -0,0 +1,72 @@
+################################ IMPORTS ################################
+import time                                                            ##
+import asyncio                                                         ##
+#########################################################################
+
+
+class AdaptivePollingInterval:
+    """
+    Compute the delay before the next poll of a channel from its recent activity.
+
+    The interval is halved every time a poll finds new messages and multiplied by 'backoff'
+    after every idle poll, always staying within [min_delay, max_delay].
+
+    Args:
+        delay (float): The starting interval in seconds (the task's delay).
+        min_delay (float, optional): The shortest interval (default is delay / 4).
+        max_delay (float, optional): The longest interval (default is delay * 8).
+        backoff (float, optional): The growth factor applied after an idle poll (default is 1.5).
+    """
+
+    def __init__(self, delay: float, min_delay: float = None, max_delay: float = None, backoff: float = 1.5):
+        self.min_delay = min_delay if min_delay is not None else delay / 4
+        self.max_delay = max_delay if max_delay is not None else delay * 8
+        self.backoff = backoff
+        self.current = min(max(delay, self.min_delay), self.max_delay)
+
+    def next(self, new_messages: int):
+        """
+        Update the interval after a poll and return it.
+
+        Args:
+            new_messages (int): The number of new messages found by the poll.
+
+        Returns:
+            float: The number of seconds to wait before the next poll.
+        """
+        if new_messages:
+            self.current = max(self.min_delay, self.current / 2)
+        else:
+            self.current = min(self.max_delay, self.current * self.backoff)
+        return self.current
+
+
+class RequestBudget:
+    """
+    Share a global polls-per-second budget between every channel monitor.
+
+    Polls are spaced evenly so the whole bot never exceeds 'rate' polls per second,
+    however many channels are active.
+
+    Args:
+        rate (float): The maximum number of polls per second, 0 disables the budget.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """
+        Wait for the next free slot of the budget.
+        """
+        if not self.rate:
+            return
+
+        async with self._lock:
+            now = time.monotonic()
+            if self._next_slot > now:
+                await asyncio.sleep(self._next_slot - now)
+                now = self._next_slot
+            self._next_slot = now + 1 / self.rate
@@ -0,0 +1,144 @@
+################################ IMPORTS ################################
+import re                                                              ##
+import time                                                            ##
+import asyncio                                                         ##
+                                                                       ##
+from logger import console_output                                      ##
+#########################################################################
+
+
+# Discord rate limits are shared per bucket AND per top-level resource (channel or webhook).
+# A webhook is identified by its ID alone, so its token never ends up in route keys, logs or metrics.
+MAJOR_PARAMETER_PATTERN = re.compile(r'/(channels/\d+|webhooks/\d+)')
+
+
+class RateLimitBucket:
+    """
+    The last known state of a Discord rate limit bucket.
+
+    Args:
+        remaining (int, optional): Requests left before the bucket is exhausted (None if unknown).
+        reset_at (float, optional): time.monotonic() value at which the bucket refills.
+    """
+
+    def __init__(self, remaining: int = None, reset_at: float = 0.0):
+        self.remaining = remaining
+        self.reset_at = reset_at
+        self.lock = asyncio.Lock()
+
+
+class RateLimitScheduler:
+    """
+    Schedule every Discord request so it stays inside the published rate limits.
+
+    Buckets are learned from the X-RateLimit-Bucket / Remaining / Reset-After headers of each
+    response and tracked per route. A request on an exhausted bucket waits for its reset instead
+    of being sent and rejected, and every request also goes through a global requests-per-second
+    limit. When Discord still answers 429, the Retry-After delay is honored (globally if the limit
+    is global) before the request is retried.
+
+    Args:
+        global_rate (float, optional): Maximum requests per second across all routes (default is 50).
+        max_retries (int, optional): How many times a 429 response is retried (default is 5).
+    """
+
+    def __init__(self, global_rate: float = 50, max_retries: int = 5):
+        self.global_rate = global_rate
+        self.max_retries = max_retries
+
+        self._route_buckets = {}
+        self._buckets = {}
+        self._global_reset_at = 0.0
+        self._global_lock = asyncio.Lock()
+        self._next_global_slot = 0.0
+
+    @staticmethod
+    def route_key(method: str, url: str):
+        """
+        Return the key identifying the route (method + major parameter) of a request.
+        """
+        match = MAJOR_PARAMETER_PATTERN.search(url)
+        major_parameter = match.group(1) if match else url.split('?')[0]
+        return f"{method.upper()} {major_parameter}"
+
+    def _get_bucket(self, route: str):
+        bucket_key = self._route_buckets.get(route, route)
+        if bucket_key not in self._buckets:
+            self._buckets[bucket_key] = RateLimitBucket()
+        return self._buckets[bucket_key]
+
+    async def acquire(self, route: str):
+        """
+        Wait until a request on the given route can be sent without exceeding a rate limit.
+
+        Args:
+            route (str): The route key returned by route_key.
+        """
+        bucket = self._get_bucket(route)
+
+        async with bucket.lock:
+            now = time.monotonic()
+            if bucket.remaining == 0 and bucket.reset_at > now:
+                await asyncio.sleep(bucket.reset_at - now)
+                bucket.remaining = None
+            elif bucket.remaining:
+                bucket.remaining -= 1
+
+        async with self._global_lock:
+            now = time.monotonic()
+            wait_until = max(self._global_reset_at, self._next_global_slot)
+            if wait_until > now:
+                await asyncio.sleep(wait_until - now)
+                now = wait_until
+            self._next_global_slot = now + 1 / self.global_rate
+
+    def update(self, route: str, response):
+        """
+        Update the bucket of a route from the rate limit headers of its response.
+
+        Args:
+            route (str): The route key returned by route_key.
+            response (httpx.Response): The response received for the request.
+
+        Returns:
+            float or None: The number of seconds to wait before retrying if the response was a 429, otherwise None.
+        """
+        headers = response.headers
+        bucket_hash = headers.get('X-RateLimit-Bucket')
+
+        if bucket_hash:
+            bucket_key = f"{bucket_hash}:{route.split(' ', 1)[1]}"
+            if self._route_buckets.get(route) != bucket_key:
+                self._route_buckets[route] = bucket_key
+                self._buckets.setdefault(bucket_key, RateLimitBucket())
+
+        bucket = self._get_bucket(route)
+        if headers.get('X-RateLimit-Remaining') is not None:
+            bucket.remaining = int(headers['X-RateLimit-Remaining'])
+        if headers.get('X-RateLimit-Reset-After') is not None:
+            bucket.reset_at = time.monotonic() + float(headers['X-RateLimit-Reset-After'])
+
+        if response.status_code != 429:
+            return None
+
+        retry_after = headers.get('Retry-After')
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        if isinstance(body, dict) and body.get('retry_after') is not None:
+            retry_after = body['retry_after']
+        retry_after = float(retry_after or 1)
+
+        if headers.get('X-RateLimit-Global') == 'true' or (isinstance(body, dict) and body.get('global')):
+            self._global_reset_at = time.monotonic() + retry_after
+        else:
+            bucket.remaining = 0
+            bucket.reset_at = time.monotonic() + retry_after
+
+        console_output(text = f"Rate limited on [{route}] | Retrying in [{retry_after}]s.", msg_type = "WARNING")
+        return retry_after
+
+
+# One scheduler is shared by every request sent through http_utils
+rate_limit_scheduler = RateLimitScheduler()
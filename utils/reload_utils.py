@@ -0,0 +1,107 @@
+################################ IMPORTS ################################
+import os                                                              ##
+import csv                                                             ##
+import time                                                            ##
+import asyncio                                                         ##
+                                                                       ##
+from logger import console_output                                      ##
+from utils import file_utils,rule_utils,verification_utils             ##
+#########################################################################
+
+
+def task_key(task: dict):
+    """
+    Return a hashable key identifying the content of a task row.
+    """
+    return tuple(sorted((str(column), repr(value)) for column, value in task.items()))
+
+
+class TaskFileWatcher:
+    """
+    Watch the task file and hand over its verified tasks every time it changes.
+
+    The verification result of every row is remembered by content, so a reload only verifies
+    the rows that were added or changed since the previous one. Rows removed from the file are
+    forgotten, and an unchanged invalid row stays skipped until it is edited (or the bot restarts).
+    The rules file is watched too, verified tasks get their compiled rule set attached.
+
+    Args:
+        filename (str, optional): The task file (default is 'tasks.csv').
+        interval (float, optional): The number of seconds between two checks of the file (default is 5).
+        workers (int, optional): The maximum number of webhook verifications in flight (default is 10).
+        rule_file (RuleFile, optional): The rules of the tasks (default is 'rules.json').
+    """
+
+    def __init__(self, filename: str = 'tasks.csv', interval: float = 5, workers: int = 10, rule_file: rule_utils.RuleFile = None):
+        self.filename = filename
+        self.interval = interval
+        self.workers = workers
+        self.rule_file = rule_file or rule_utils.RuleFile()
+
+        # Task key -> True if the row passed verification
+        self._results = {}
+        # Taken before the first load, so a change made while loading is seen by the first check
+        self._signature = self._stat()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, self.rule_file.signature()
+
+    async def verify(self, tasks: list):
+        """
+        Verify the rows that were not verified yet and return every valid task, in file order.
+
+        Args:
+            tasks (list): Every row of the task file.
+
+        Returns:
+            list: The tasks that passed verification, with their rule set (see RuleFile.attach).
+        """
+        keys = [task_key(task) for task in tasks]
+        pending = [(row_number, task, key) for row_number, (task, key) in enumerate(zip(tasks, keys), start=2) if key not in self._results]
+
+        if pending:
+            verified = await verification_utils.verify_and_filter_tasks(
+                task_file = [task for _, task, _ in pending],
+                workers = self.workers,
+                row_numbers = [row_number for row_number, _, _ in pending]
+            )
+            verified_ids = {id(task) for task in verified}
+            for _, task, key in pending:
+                self._results[key] = id(task) in verified_ids
+
+        self._results = {key: self._results[key] for key in keys}
+        return self.rule_file.attach([task for task, key in zip(tasks, keys) if self._results[key]])
+
+    async def watch(self, apply):
+        """
+        Check the task file every interval seconds until cancelled, and call apply with the verified tasks after every change.
+
+        Args:
+            apply (coroutine function): Called with the list of verified tasks of the new file.
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+
+            signature = self._stat()
+            if signature is None or signature == self._signature:
+                continue
+            self._signature = signature
+
+            started = time.perf_counter()
+            try:
+                tasks = await asyncio.to_thread(lambda: list(file_utils.read_task_rows(self.filename)))
+            except (OSError, csv.Error) as e:
+                console_output(text = f"{self.filename} could not be read | Keeping the current tasks. [{e}]", msg_type = "WARNING")
+                continue
+
+            try:
+                await apply(await self.verify(tasks))
+            except Exception as e:
+                # A reload must never stop the watcher, the running monitors keep their tasks until the next change
+                console_output(text = f"{self.filename} could not be applied | Keeping the current tasks. [{e!r}]", msg_type = "ERROR")
+                continue
+            console_output(text = f"{self.filename} reloaded in {(time.perf_counter() - started) * 1000:.1f}ms.", msg_type = "SUCCESS")
@@ -0,0 +1,283 @@
+################################ IMPORTS ################################
+import os                                                              ##
+import re                                                              ##
+import json                                                            ##
+import hashlib                                                         ##
+                                                                       ##
+from logger import console_output                                      ##
+#########################################################################
+
+
+RULE_KEYS = {
+    'include_authors', 'exclude_authors', 'include_content', 'exclude_content',
+    'ignore_case', 'embed_types', 'mentions', 'rewrite'
+}
+MENTION_MODES = ('keep', 'plain', 'strip')
+# User (<@id>, <@!id>), role (<@&id>) and channel (<#id>) mentions, @everyone and @here
+MENTION_PATTERN = re.compile(r'<@!?(\d+)>|<@&(\d+)>|<#(\d+)>|@(everyone|here)')
+# Embed types used by embed_types to match messages without any embed
+NO_EMBED = 'none'
+
+
+class RuleSet:
+    """
+    Decide which messages are mirrored to a destination and rewrite their text, compiled once from rules.json.
+
+    Author lists become sets and the content patterns of each list are joined into a single regular
+    expression, so filtering a message costs a few set lookups and at most two regex scans whatever
+    the number of rules. Messages are only copied and rewritten once they passed every filter.
+
+    A definition accepts the keys:
+        include_authors / exclude_authors: Author IDs or usernames to keep / to drop.
+        include_content / exclude_content: Regular expressions searched in the content, embed titles and
+            descriptions, a message is kept if any include pattern matches and no exclude pattern does.
+        ignore_case: Match the content patterns and rewrite patterns case-insensitively.
+        embed_types: Keep only messages with an embed of these types ('rich', 'image', 'link'... or
+            'none' for messages without embeds).
+        mentions: 'keep' mentions as they are (default), turn them into 'plain' text or 'strip' them.
+        rewrite: A list of {"pattern": ..., "replace": ...} substitutions (e.g. to rewrite or remove links).
+
+    Args:
+        name (str): The name of the rule set in rules.json.
+        definition (dict): The rules, see above.
+
+    Raises:
+        ValueError: If the definition has an unknown key, an invalid value, pattern or replacement.
+    """
+
+    def __init__(self, name: str, definition: dict):
+        if not isinstance(definition, dict):
+            raise ValueError(f"Rule set '{name}' must be an object")
+        unknown_keys = set(definition) - RULE_KEYS
+        if unknown_keys:
+            raise ValueError(f"Rule set '{name}' has unknown keys: {', '.join(sorted(unknown_keys))}")
+
+        for key in RULE_KEYS - {'ignore_case', 'mentions'}:
+            if not isinstance(definition.get(key, []), list):
+                raise ValueError(f"Rule set '{name}': {key} must be a list")
+
+        self.name = name
+        self.definition = definition
+        flags = re.IGNORECASE if definition.get('ignore_case') else 0
+
+        self.include_authors = frozenset(str(author) for author in definition.get('include_authors', []))
+        self.exclude_authors = frozenset(str(author) for author in definition.get('exclude_authors', []))
+        self.include_content = self._compile_any(definition.get('include_content'), flags)
+        self.exclude_content = self._compile_any(definition.get('exclude_content'), flags)
+        self.embed_types = frozenset(definition['embed_types']) if definition.get('embed_types') else None
+
+        self.mentions = definition.get('mentions', 'keep')
+        if self.mentions not in MENTION_MODES:
+            raise ValueError(f"Rule set '{name}': mentions must be one of {', '.join(MENTION_MODES)}")
+
+        if not all(isinstance(rewrite, dict) for rewrite in definition.get('rewrite', [])):
+            raise ValueError(f"Rule set '{name}': rewrite must be a list of {{\"pattern\": ..., \"replace\": ...}} objects")
+        self.rewrites = tuple(
+            self._compile_rewrite(rewrite.get('pattern'), rewrite.get('replace', ''), flags)
+            for rewrite in definition.get('rewrite', [])
+        )
+        self.rewrites_text = bool(self.rewrites) or self.mentions != 'keep'
+        # Identifies the rewrites in payload cache keys, a reloaded definition never reuses stale payloads
+        self.cache_key = f"{name}:{hashlib.blake2b(json.dumps(definition, sort_keys = True).encode(), digest_size = 8).hexdigest()}"
+
+    def __eq__(self, other):
+        return isinstance(other, RuleSet) and self.name == other.name and self.definition == other.definition
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def _compile(self, pattern: str, flags: int):
+        try:
+            return re.compile(pattern, flags)
+        except (re.error, TypeError) as e:
+            raise ValueError(f"Rule set '{self.name}': invalid pattern {pattern!r} ({e})") from None
+
+    def _compile_rewrite(self, pattern: str, replace: str, flags: int):
+        compiled = self._compile(pattern, flags)
+        if not isinstance(replace, str):
+            raise ValueError(f"Rule set '{self.name}': the replacement of {pattern!r} must be a string")
+        # Bad group references (\\3, \\g<name>) only fail when substituted, check them before any message is
+        try:
+            compiled.sub(replace, '')
+        except (re.error, IndexError) as e:
+            raise ValueError(f"Rule set '{self.name}': invalid replacement {replace!r} for {pattern!r} ({e})") from None
+        return compiled, replace
+
+    def _compile_any(self, patterns: list, flags: int):
+        if not patterns:
+            return None
+        compiled = [self._compile(pattern, flags) for pattern in patterns]
+        if len(compiled) == 1:
+            return compiled[0]
+        # One scan per list, inline flags must be scoped in that case, e.g. (?i:word) instead of (?i)word
+        return self._compile('|'.join(f'(?:{pattern})' for pattern in patterns), flags)
+
+    @staticmethod
+    def _searchable_text(message: dict):
+        parts = [message.get('content') or '']
+        for embed in message.get('embeds') or ():
+            parts.append(embed.get('title') or '')
+            parts.append(embed.get('description') or '')
+        return '\n'.join(parts)
+
+    def accepts(self, message: dict):
+        """
+        Return True if the message passes the author, embed type and content rules.
+        """
+        author = message.get('author') or {}
+        author_keys = (str(author.get('id')), author.get('username'))
+        if self.include_authors and not any(key in self.include_authors for key in author_keys):
+            return False
+        if self.exclude_authors and any(key in self.exclude_authors for key in author_keys):
+            return False
+
+        if self.embed_types is not None:
+            embed_types = {embed.get('type') for embed in message.get('embeds') or ()} or {NO_EMBED}
+            if self.embed_types.isdisjoint(embed_types):
+                return False
+
+        if self.include_content or self.exclude_content:
+            text = self._searchable_text(message)
+            if self.include_content and not self.include_content.search(text):
+                return False
+            if self.exclude_content and self.exclude_content.search(text):
+                return False
+        return True
+
+    def _replace_mention(self, match: re.Match, usernames: dict):
+        if self.mentions == 'strip':
+            return ''
+        user_id, role_id, channel_id, everyone = match.groups()
+        if user_id:
+            return f"@{usernames.get(user_id, 'unknown-user')}"
+        if role_id:
+            return '@role'
+        if channel_id:
+            return '#channel'
+        # A zero-width space keeps the text readable without pinging anyone
+        return f"@\u200b{everyone}"
+
+    def _rewrite_text(self, text: str, usernames: dict):
+        if not text:
+            return text
+        if self.mentions != 'keep':
+            text = MENTION_PATTERN.sub(lambda match: self._replace_mention(match, usernames), text)
+        for pattern, replacement in self.rewrites:
+            text = pattern.sub(replacement, text)
+        return text
+
+    def apply(self, message: dict):
+        """
+        Filter and rewrite a message for the destination.
+
+        Args:
+            message (dict): A message returned by the Discord API.
+
+        Returns:
+            dict or None: The message itself if nothing is rewritten, a rewritten copy, or None if the message is dropped.
+        """
+        if not self.accepts(message):
+            return None
+        if not self.rewrites_text:
+            return message
+
+        usernames = {str(user.get('id')): user.get('username') for user in message.get('mentions') or ()}
+        rewritten = dict(message, content = self._rewrite_text(message.get('content'), usernames))
+        if message.get('embeds'):
+            rewritten['embeds'] = [self._rewrite_embed(embed, usernames) for embed in message['embeds']]
+        return rewritten
+
+    def _rewrite_embed(self, embed: dict, usernames: dict):
+        embed = dict(embed)
+        for key in ('title', 'description'):
+            if embed.get(key):
+                embed[key] = self._rewrite_text(embed[key], usernames)
+        if embed.get('fields'):
+            embed['fields'] = [
+                dict(field, name = self._rewrite_text(field.get('name'), usernames), value = self._rewrite_text(field.get('value'), usernames))
+                for field in embed['fields']
+            ]
+        return embed
+
+
+def load_rule_sets(filename: str = 'rules.json'):
+    """
+    Load and compile every rule set of a rules file.
+
+    Args:
+        filename (str, optional): The rules file, a JSON object mapping rule set names to their rules (default is 'rules.json').
+
+    Returns:
+        dict: The compiled RuleSet of each name, empty if the file doesn't exist.
+
+    Raises:
+        ValueError: If the file is not valid JSON or a rule set is invalid.
+    """
+    try:
+        with open(filename, 'r') as file:
+            definitions = json.load(file)
+    except FileNotFoundError:
+        return {}
+    if not isinstance(definitions, dict):
+        raise ValueError(f"{filename} must map rule set names to their rules")
+    return {name: RuleSet(name, definition) for name, definition in definitions.items()}
+
+
+class RuleFile:
+    """
+    Keep the rule sets of the rules file compiled and attach them to the tasks naming them in their 'rules' column.
+
+    The file is only recompiled when it changes. If it becomes invalid, the previous rule sets are kept.
+
+    Args:
+        filename (str, optional): The rules file (default is 'rules.json').
+    """
+
+    def __init__(self, filename: str = 'rules.json'):
+        self.filename = filename
+        self.rule_sets = {}
+        self._signature = False
+
+    def signature(self):
+        """
+        Return the modification time and size of the rules file, or None if it doesn't exist.
+        """
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _refresh(self):
+        signature = self.signature()
+        if signature == self._signature:
+            return
+        self._signature = signature
+        try:
+            self.rule_sets = load_rule_sets(self.filename)
+        except ValueError as e:
+            console_output(text = f"{self.filename} ignored | Keeping the previous rules. [{e}]", msg_type = "ERROR")
+
+    def attach(self, tasks: list):
+        """
+        Return the tasks with their compiled rule set under 'rule_set'.
+
+        Tasks naming a rule set missing from the rules file are skipped, so they are never mirrored unfiltered.
+
+        Args:
+            tasks (list): The verified tasks.
+
+        Returns:
+            list: The tasks to run.
+        """
+        self._refresh()
+        attached = []
+        for task in tasks:
+            name = task.get('rules')
+            if not name:
+                attached.append(task)
+            elif name in self.rule_sets:
+                attached.append(dict(task, rule_set = self.rule_sets[name]))
+            else:
+                console_output(text = f"Task [{task.get('channel_id')}] skipped: unknown rule set '{name}' (see {self.filename}).", msg_type = "ERROR")
+        return attached
@@ -0,0 +1,371 @@
+################################ IMPORTS ################################
+import os                                                              ##
+import json                                                            ##
+import time                                                            ##
+import queue                                                           ##
+import bisect                                                          ##
+import hashlib                                                         ##
+import asyncio                                                         ##
+import multiprocessing                                                 ##
+import multiprocessing.managers                                        ##
+                                                                       ##
+from logger import console_output                                      ##
+from utils import file_utils                                           ##
+from utils.metrics_utils import metrics                                ##
+#########################################################################
+
+
+# Seconds between two heartbeats (with a metrics snapshot) sent by a shard to the supervisor
+HEARTBEAT_INTERVAL = 2
+
+
+class ConsistentHashRing:
+    """
+    Map keys (channel IDs) to nodes (shards) so that removing a node only moves the keys it owned.
+
+    Args:
+        nodes (iterable): The initial nodes.
+        replicas (int, optional): The number of points of each node on the ring (default is 64).
+    """
+
+    def __init__(self, nodes, replicas: int = 64):
+        self.replicas = replicas
+        self.nodes = set()
+        self._points = []
+        self._owners = {}
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key: str):
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+    def add(self, node):
+        """
+        Add a node to the ring.
+        """
+        self.nodes.add(node)
+        for replica in range(self.replicas):
+            point = self._hash(f"{node}:{replica}")
+            self._owners[point] = node
+            bisect.insort(self._points, point)
+
+    def remove(self, node):
+        """
+        Remove a node from the ring, its keys move to the next nodes on the ring.
+        """
+        self.nodes.discard(node)
+        for replica in range(self.replicas):
+            point = self._hash(f"{node}:{replica}")
+            del self._owners[point]
+            self._points.remove(point)
+
+    def node_for(self, key: str):
+        """
+        Return the node owning a key.
+        """
+        index = bisect.bisect(self._points, self._hash(str(key))) % len(self._points)
+        return self._owners[self._points[index]]
+
+
+async def send_heartbeats(shard_id: int, status_queue, interval: float = HEARTBEAT_INTERVAL):
+    """
+    Send a heartbeat with a snapshot of the shard's metrics to the supervisor every interval seconds until cancelled.
+
+    Args:
+        shard_id (int): The ID of the shard.
+        status_queue (multiprocessing.Queue): The queue read by the supervisor.
+        interval (float, optional): The number of seconds between two heartbeats.
+    """
+    while True:
+        status_queue.put((shard_id, metrics.snapshot()))
+        await asyncio.sleep(interval)
+
+
+class IncognitoNameManager(multiprocessing.managers.BaseManager):
+    """
+    Serve the incognito names registry of the supervisor to the shards (see RemoteIncognitoNames).
+    """
+
+
+IncognitoNameManager.register('IncognitoNameRegistry', file_utils.IncognitoNameRegistry, exposed = ('get_name', 'flush'))
+
+
+class RemoteIncognitoNames:
+    """
+    The incognito names of a shard, assigned by the registry of the supervisor so that every shard
+    gives a user the same name. Names never change once given, so each one is requested once per shard.
+
+    Args:
+        registry: The proxy of the supervisor's IncognitoNameRegistry.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._names = {}
+
+    def get_name(self, username: str):
+        """
+        Return the incognito name of a user, asking the supervisor the first time.
+        """
+        name = self._names.get(username)
+        if name is None:
+            name = self._names[username] = self.registry.get_name(username)
+        return name
+
+    def flush(self):
+        """
+        Nothing to write, the supervisor saves the names.
+        """
+
+
+def _merge_shard_names(directory: str):
+    # Shards of older versions numbered new users on their own, the users missing from the
+    # working directory's names get a name there (an alias is never given to two users)
+    names_file = os.path.join(directory, 'custom_names.json')
+    if not os.path.exists(names_file):
+        return
+
+    with open(names_file, 'r') as file:
+        shard_names = json.load(file)
+    registry = file_utils.IncognitoNameRegistry()
+    for username in shard_names:
+        registry.get_name(username)
+    registry.flush()
+    os.remove(names_file)
+
+
+class ShardSupervisor:
+    """
+    Partition the tasks across worker processes by consistent hashing on their channel ID.
+
+    Every shard process runs in its own state directory (mirrored IDs, outbox, mirror index...),
+    so it owns the state of its channels. The supervisor collects the shards' heartbeats and
+    metrics, and when a shard dies (or stops sending heartbeats) its channels are reassigned to the
+    other shards with their state, restarting the shards taking them over. Incognito names are
+    assigned by a single registry owned by the supervisor, so they are the same in every shard.
+
+    Args:
+        tasks (list): The verified tasks.
+        shards (int): The number of shard processes.
+        target (callable): The shard entry point, called as target(shard_id, directory, tasks, *target_args, status_queue, incognito_names),
+            incognito_names being the proxy of the supervisor's IncognitoNameRegistry.
+        target_args (tuple, optional): Extra arguments passed to the target.
+        directory (str, optional): The directory holding one state directory per shard (default is 'shards').
+        heartbeat_timeout (float, optional): Seconds without heartbeat after which a shard is considered dead (default is 30).
+    """
+
+    def __init__(
+        self,
+        tasks: list,
+        shards: int,
+        target,
+        target_args: tuple = (),
+        directory: str = 'shards',
+        heartbeat_timeout: float = 30
+    ):
+        self.target = target
+        self.target_args = target_args
+        self.directory = os.path.abspath(directory)
+        self.heartbeat_timeout = heartbeat_timeout
+
+        self.ring = ConsistentHashRing(range(shards))
+        # Spawned processes don't inherit the event loop and threads of the supervisor
+        self.context = multiprocessing.get_context('spawn')
+        self.status_queue = self.context.Queue()
+        self.name_manager = None
+        self.incognito_names = None
+
+        self.assignments = {shard_id: [] for shard_id in range(shards)}
+        for shard_id, shard_tasks in self._assign(tasks).items():
+            self.assignments[shard_id] = shard_tasks
+
+        self.processes = {}
+        self.heartbeats = {}
+        self.snapshots = {}
+        self.rebalances = 0
+
+    def shard_directory(self, shard_id: int):
+        """
+        Return the state directory of a shard.
+        """
+        return os.path.join(self.directory, f"shard-{shard_id}")
+
+    def _assign(self, tasks: list):
+        groups = {}
+        for task in tasks:
+            groups.setdefault(self.ring.node_for(str(task.get('channel_id'))), []).append(task)
+        return groups
+
+    @staticmethod
+    def _channels(tasks: list):
+        return {str(task.get('channel_id')) for task in tasks}
+
+    def _adopt_state(self):
+        # State left in the working directory (single process runs) or in another shard's directory
+        # (different shard count) is moved to the shard now owning the channel
+        sources = [os.getcwd()] + [self.shard_directory(shard_id) for shard_id in self.assignments]
+        for shard_id in self.assignments:
+            os.makedirs(self.shard_directory(shard_id), exist_ok=True)
+
+        for source in sources:
+            if not os.path.isdir(source):
+                continue
+            if source != os.getcwd():
+                _merge_shard_names(source)
+            for shard_id, tasks in self.assignments.items():
+                target = self.shard_directory(shard_id)
+                if tasks and source != target:
+                    file_utils.transfer_channel_state(source, target, self._channels(tasks))
+
+    def _start(self, shard_id: int):
+        directory = self.shard_directory(shard_id)
+        os.makedirs(directory, exist_ok=True)
+        process = self.context.Process(
+            target=self.target,
+            args=(shard_id, directory, self.assignments[shard_id], *self.target_args, self.status_queue, self.incognito_names),
+            name=f"shard-{shard_id}"
+        )
+        process.start()
+        self.processes[shard_id] = process
+        self.heartbeats[shard_id] = time.monotonic()
+        console_output(text = f"Shard [{shard_id}] started with {len(self._channels(self.assignments[shard_id]))} channels | PID {process.pid}.", msg_type = "INFO")
+
+    async def _stop(self, shard_id: int, timeout: float = 30):
+        process = self.processes.pop(shard_id, None)
+        if process is None:
+            return
+
+        # SIGTERM lets the shard flush its state before exiting
+        process.terminate()
+        await asyncio.to_thread(process.join, timeout)
+        if process.is_alive():
+            process.kill()
+            await asyncio.to_thread(process.join)
+
+    async def _rebalance(self, dead_shard: int):
+        self.ring.remove(dead_shard)
+        orphans = self.assignments.pop(dead_shard)
+        if not self.ring.nodes:
+            return
+
+        for shard_id, tasks in self._assign(orphans).items():
+            await self._stop(shard_id)
+            file_utils.transfer_channel_state(self.shard_directory(dead_shard), self.shard_directory(shard_id), self._channels(tasks))
+            self.assignments[shard_id].extend(tasks)
+            self.rebalances += len(self._channels(tasks))
+            metrics.inc('shard_rebalances_total', value = len(self._channels(tasks)))
+            console_output(text = f"{len(self._channels(tasks))} channels of shard [{dead_shard}] moved to shard [{shard_id}].", msg_type = "WARNING")
+            self._start(shard_id)
+
+    async def reload(self, tasks: list):
+        """
+        Apply a new list of verified tasks, restarting only the shards whose tasks changed.
+
+        Channels stay on the shard the ring maps them to, so their state doesn't have to move.
+
+        Args:
+            tasks (list): The verified tasks of the reloaded task file.
+        """
+        assignments = self._assign(tasks)
+        for shard_id in sorted(self.ring.nodes):
+            shard_tasks = assignments.get(shard_id, [])
+            if shard_tasks == self.assignments.get(shard_id, []):
+                continue
+
+            await self._stop(shard_id)
+            self.assignments[shard_id] = shard_tasks
+            if shard_tasks:
+                console_output(text = f"Tasks of shard [{shard_id}] changed | Restarting it.", msg_type = "INFO")
+                self._start(shard_id)
+            else:
+                console_output(text = f"Shard [{shard_id}] has no task left | Stopped.", msg_type = "INFO")
+
+    def _collect_metrics(self):
+        now = time.monotonic()
+        for shard_id, tasks in self.assignments.items():
+            process = self.processes.get(shard_id)
+            metrics.set_gauge('shard_up', int(process is not None and process.is_alive()), {'shard': shard_id})
+            metrics.set_gauge('shard_channels', len(self._channels(tasks)), {'shard': shard_id})
+            if shard_id in self.heartbeats:
+                metrics.set_gauge('shard_heartbeat_age_seconds', now - self.heartbeats[shard_id], {'shard': shard_id})
+
+    def _read_statuses(self):
+        while True:
+            try:
+                shard_id, snapshot = self.status_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.heartbeats[shard_id] = time.monotonic()
+            self.snapshots[shard_id] = snapshot
+
+        if self.snapshots:
+            # Dead shards keep their last snapshot, so aggregated counters never go backwards
+            metrics.load_snapshots(self.snapshots)
+            if self.rebalances:
+                metrics.inc('shard_rebalances_total', value = self.rebalances)
+
+    async def run(self):
+        """
+        Start the shards and supervise them until cancelled or until every shard is dead.
+        """
+        self._adopt_state()
+        # The registry lives in a manager process started from (and saving to) the working directory
+        self.name_manager = IncognitoNameManager(ctx=self.context)
+        self.name_manager.start()
+        self.incognito_names = self.name_manager.IncognitoNameRegistry()
+        metrics.add_collector(self._collect_metrics)
+        for shard_id, tasks in self.assignments.items():
+            if tasks:
+                self._start(shard_id)
+
+        try:
+            while self.processes:
+                await asyncio.sleep(1)
+                self._read_statuses()
+
+                now = time.monotonic()
+                for shard_id, process in list(self.processes.items()):
+                    if self.processes.get(shard_id) is not process:
+                        # Restarted by a rebalance earlier in this loop
+                        continue
+
+                    if process.is_alive() and now - self.heartbeats[shard_id] > self.heartbeat_timeout:
+                        console_output(text = f"Shard [{shard_id}] stopped sending heartbeats | Killing it.", msg_type = "ERROR")
+                        process.kill()
+                        await asyncio.to_thread(process.join)
+
+                    if not process.is_alive():
+                        console_output(text = f"Shard [{shard_id}] died | Exit code {process.exitcode}.", msg_type = "ERROR")
+                        del self.processes[shard_id]
+                        await self._rebalance(shard_id)
+
+            console_output(text = "Every shard is dead | Supervisor stopping.", msg_type = "ERROR")
+        finally:
+            for shard_id in list(self.processes):
+                await self._stop(shard_id)
+            self.incognito_names.flush()
+            self.name_manager.shutdown()
+
+
+def adopt_shard_state(tasks: list, directory: str = 'shards'):
+    """
+    Move the state of the tasks' channels left in shard directories by a sharded run back to the
+    working directory, so a single process run never mirrors those channels again. Incognito names
+    left in shard directories by older versions are merged into the working directory's names.
+
+    Must run before the message ID store, outbox and mirror index of the working directory are opened.
+
+    Args:
+        tasks (list): The verified tasks about to run.
+        directory (str, optional): The directory holding the state directory of each shard (default is 'shards').
+    """
+    if not os.path.isdir(directory):
+        return
+
+    channel_ids = ShardSupervisor._channels(tasks)
+    for name in sorted(os.listdir(directory)):
+        source = os.path.join(directory, name)
+        if name.startswith('shard-') and os.path.isdir(source):
+            file_utils.transfer_channel_state(source, os.getcwd(), channel_ids)
+            _merge_shard_names(source)
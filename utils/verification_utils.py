@@ -1,8 +1,11 @@
 ################################ IMPORTS ################################
-import sys                                                             ##
-import requests                                                        ##
+import time                                                            ##
+import asyncio                                                         ##
+import hashlib                                                         ##
+import httpx                                                           ##
                                                                        ##
 from logger import console_output                                      ##
+from utils import file_utils,http_utils                                ##
 #########################################################################
 
 
@@ -18,7 +21,7 @@ class DiscordChannelIdVerificationError(Exception):
         super().__init__(message)
 
 
-def verify_discord_webhook(webhook_url: str):
+async def verify_discord_webhook(webhook_url: str):
     """
     Verify a Discord webhook by making an HTTP GET request to the provided URL and checking if it contains a 'token' field in the JSON response.
 
@@ -32,26 +35,44 @@ def verify_discord_webhook(webhook_url: str):
         DiscordWebhookVerificationError: If there is an HTTP error or if the response does not contain a 'token' field.
     """
     try:
-        r = requests.get(webhook_url)
+        r = await http_utils.request('GET', webhook_url)
         r.raise_for_status()
         r_parsed = r.json()
-        if 'token' in r_parsed.keys():  
+        if isinstance(r_parsed, dict) and 'token' in r_parsed.keys():  
             return True
         else:
             return False
     
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         if 400 <= e.response.status_code < 500:
-            parsed_error = e.response.json()
+            try:
+                parsed_error = e.response.json()
+            except ValueError:
+                # Not a JSON body, e.g. an HTML error page
+                parsed_error = {}
+            message = parsed_error.get('message') if isinstance(parsed_error, dict) else None
             # Raise the custom exception without including the original traceback
-            raise DiscordWebhookVerificationError(f"Error {e.response.status_code}: {parsed_error.get('message')}") from None
+            raise DiscordWebhookVerificationError(f"Error {e.response.status_code}: {message or e.response.reason_phrase}") from None
         else:
             raise  # Re-raise other HTTP errors
-    except requests.exceptions.RequestException as e:
-        # Handle RequestException separately without trying to access e.response
+    except httpx.HTTPError as e:
+        # Handle transport errors separately without trying to access e.response
         raise DiscordWebhookVerificationError(f"Request Exception: {str(e)}")
     
 
+def webhook_cache_key(webhook_url: str):
+    """
+    Return the key of a webhook in the verification cache, a digest that doesn't reveal its token.
+
+    Args:
+        webhook_url (str): The URL of the Discord webhook.
+
+    Returns:
+        str: The SHA-256 hexadecimal digest of the URL.
+    """
+    return hashlib.sha256(webhook_url.encode()).hexdigest()
+
+
 def verify_incognito_mode(incognito_mode: str):
     """
     Verify if the provided incognito mode is a boolean value.
@@ -67,7 +88,6 @@ def verify_incognito_mode(incognito_mode: str):
         # If it is a boolean, return True, indicating a successful verification
         return True
     else:
-        console_output(text=f"Incognito mode value MUST be True or False", msg_type = "ERROR")
         # If it is not a boolean, return False, indicating a verification failure
         return False
 
@@ -82,83 +102,136 @@ def is_float_or_int(value):
     Returns:
         bool: True if the value is a float or int, False otherwise.
     """
-    valid = isinstance(value, (float, int))
-    if not valid:
-        console_output(text=f"Delay value MUST be an Integer or a Float", msg_type = "ERROR")
-    return valid
+    return isinstance(value, (float, int))
 
 
-def verify_all(
-    delay,
-    webhook_url: str, 
-    incognito_mode: str
+async def verify_discord_webhooks(
+    webhook_urls: list,
+    workers: int = 10,
+    cache_ttl: float = 86400
 ):
     """
-    Verify multiple aspects, including Discord webhook, channel ID, and incognito mode.
+    Verify several Discord webhooks concurrently, skipping the ones verified recently.
+
+    Every distinct URL is checked once, at most 'workers' at a time. Successful verifications are
+    kept in the verification cache for 'cache_ttl' seconds, so warm restarts skip the network.
+    The cache is keyed by webhook_cache_key, webhook tokens are never written to disk.
 
     Args:
-        webhook_url (str): The URL of the Discord webhook to verify.
-        incognito_mode (str): The value of incognito mode to verify.
+        webhook_urls (list): The webhook URLs to verify (duplicates are checked once).
+        workers (int, optional): The maximum number of verifications in flight (default is 10).
+        cache_ttl (float, optional): Seconds a successful verification stays valid (default is 86400).
 
     Returns:
-        bool: True if all verifications are successful, False otherwise.
+        dict: The error message of each URL, or None if the webhook is verified.
     """
-    try:
-        # Attempt to verify the Discord webhook and store the result in 'verified_discord_webhook'
-        verified_discord_webhook = verify_discord_webhook(webhook_url=webhook_url)
-    except DiscordWebhookVerificationError as e:
-        # If a DiscordWebhookVerificationError exception is raised during webhook verification,
-        # set 'verified_discord_webhook' to False and print an error message.
-        verified_discord_webhook = False
-        console_output(f"Error verifying the Discord Webhook. [{e}]", msg_type = "ERROR")
-        
+    cache = file_utils.load_verification_cache()
+    now = time.time()
+
+    results = {}
+    pending = []
+    for webhook_url in dict.fromkeys(webhook_urls):
+        # Missing webhook URLs are reported by verify_task, not requested
+        if not isinstance(webhook_url, str) or not webhook_url:
+            continue
+        if cache.get(webhook_cache_key(webhook_url), 0) > now:
+            results[webhook_url] = None
+        else:
+            pending.append(webhook_url)
+
+    semaphore = asyncio.Semaphore(workers)
+
+    async def verify(webhook_url: str):
+        async with semaphore:
+            try:
+                if await verify_discord_webhook(webhook_url=webhook_url):
+                    return None
+                return "Response does not contain a webhook token"
+            except (DiscordWebhookVerificationError, httpx.HTTPError, httpx.InvalidURL) as e:
+                return str(e)
+            except ValueError:
+                return "Response is not valid JSON"
+
+    errors = await asyncio.gather(*(verify(webhook_url) for webhook_url in pending))
+    for webhook_url, error in zip(pending, errors):
+        results[webhook_url] = error
+        if error is None:
+            cache[webhook_cache_key(webhook_url)] = now + cache_ttl
+
+    # Entries written by older versions are keyed by the full URL (token included) and dropped
+    file_utils.save_verification_cache(
+        verification_cache={key: expires_at for key, expires_at in cache.items() if expires_at > now and '/' not in key}
+    )
+    return results
+
+
+def verify_task(task: dict, webhook_errors: dict):
+    """
+    Verify a single task row, including Discord webhook, incognito mode and delay bounds.
 
-    # Verify incognito mode by calling the 'verify_incognito_mode' function and store the result in 'verified_incognito_mode'.
-    verified_incognito_mode = verify_incognito_mode(incognito_mode=incognito_mode)
+    Args:
+        task (dict): The task row to verify.
+        webhook_errors (dict): The result of verify_discord_webhooks for the task webhooks.
 
-    # Verify delay value is int or float
-    correct_delay = is_float_or_int(value = delay)
+    Returns:
+        list: A description of every failed verification (empty if the task is valid).
+    """
+    problems = []
 
-    # Check if both verifications (webhook and incognito) are successful using 'all()'
-    if all([verified_discord_webhook, verified_incognito_mode,correct_delay]):
-        # If both verifications are successful, return True, indicating that all verifications passed.
-        return True
-    else:
-        # If at least one verification fails, return False, indicating that not all verifications passed.
-        return False
+    webhook_url = task.get('webhook_url')
+    if not isinstance(webhook_url, str) or not webhook_url:
+        problems.append("webhook_url MUST NOT be empty")
+    elif webhook_errors.get(webhook_url):
+        problems.append(f"Error verifying the Discord Webhook. [{webhook_errors[webhook_url]}]")
 
+    # Verify incognito mode and delay values
+    if not verify_incognito_mode(incognito_mode=task.get('incognito_mode')):
+        problems.append("Incognito mode value MUST be True or False")
+    if not is_float_or_int(value=task.get('delay')):
+        problems.append("Delay value MUST be an Integer or a Float")
 
-def verify_and_filter_tasks(task_file:dict):
+    # Optional adaptive polling bounds
+    min_delay, max_delay = task.get('min_delay'), task.get('max_delay')
+    for column, value in (('min_delay', min_delay), ('max_delay', max_delay)):
+        if value is not None and not is_float_or_int(value=value):
+            problems.append(f"{column} value MUST be empty, an Integer or a Float")
+    if is_float_or_int(value=min_delay) and is_float_or_int(value=max_delay) and min_delay > max_delay:
+        problems.append("min_delay MUST NOT be greater than max_delay")
+
+    return problems
+
+
+async def verify_and_filter_tasks(task_file: list, workers: int = 10, row_numbers: list = None):
     """
     Verify tasks and filter them based on verification results.
 
+    Webhooks are verified concurrently and each row gets its own report line, invalid rows
+    are skipped instead of stopping the bot.
+
     Args:
-        task_file: The file containing tasks to be verified.
+        task_file (list): The task rows loaded from the task file.
+        workers (int, optional): The maximum number of webhook verifications in flight (default is 10).
+        row_numbers (list, optional): The line of each row in the CSV file, when only some rows are verified
+            (default is the position of the row, the header being line 1).
 
     Returns:
         list: A list of tasks that have passed verification.
     """
-    threaded_tasks = []  # Initialize an empty list to store verified tasks
-
-    # Iterate through tasks in the provided task_file
-    for task in task_file.to_dict('records'):
-        channel_id = task.get('channel_id')
-        webhook_url = task.get('webhook_url')
-        incognito_mode = task.get('incognito_mode')
-        delay = task.get('delay')
-        
-        # Verify the task using the 'verify_all' function
-        is_verified = verify_all(
-            webhook_url=webhook_url,
-            incognito_mode=incognito_mode,
-            delay = delay
-        )
-        
-        # If the task is verified, append it to the 'threaded_tasks' list
-        if is_verified:
-            threaded_tasks.append(task)
+    tasks = list(task_file)
+    webhook_errors = await verify_discord_webhooks(
+        webhook_urls=[task.get('webhook_url') for task in tasks],
+        workers=workers
+    )
+
+    verified_tasks = []
+    # Row numbers match the lines of the CSV file (line 1 is the header)
+    for row_number, task in zip(row_numbers or range(2, len(tasks) + 2), tasks):
+        problems = verify_task(task=task, webhook_errors=webhook_errors)
+        if problems:
+            console_output(text=f"Row {row_number} [{task.get('channel_id')}] skipped: {' | '.join(problems)}", msg_type="ERROR")
         else:
-            sys.exit()  # Exit the program if verification fails
+            console_output(text=f"Row {row_number} [{task.get('channel_id')}] verified.", msg_type="SUCCESS")
+            verified_tasks.append(task)
 
-    # Return the list of tasks that have passed verification
-    return threaded_tasks
\ No newline at end of file
+    console_output(text=f"{len(verified_tasks)}/{len(tasks)} tasks verified.", msg_type="INFO")
+    return verified_tasks